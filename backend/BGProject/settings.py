@@ -70,7 +70,10 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
 
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    # ?format=pdf|excel|csv elige el archivo de los reportes; sin esto DRF lo
+    # toma como selector de renderer y responde 404
+    'URL_FORMAT_OVERRIDE': None,
 }
 
 # REST_FRAMEWORK = {
@@ -116,6 +119,126 @@ TEMPLATES = [
 WSGI_APPLICATION = 'BGProject.wsgi.application'
 ASGI_APPLICATION = 'BGProject.asgi.application'
 
+# Reparto de lecturas a los WebSockets (grupos de dashboard/streams.py). La
+# capa en memoria sólo sirve dentro de un proceso (y en las pruebas); con
+# CHANNEL_REDIS_URL (p.ej. redis://redis:6379/0) se usa Redis, necesario para
+# correr varios workers Daphne detrás de nginx o `manage.py mqtt_ingest` aparte.
+# Todo proceso que publica en los grupos (también `manage.py report_worker`,
+# que avisa el fin de los reportes) debe tener la misma URL.
+CHANNEL_REDIS_URL = os.getenv('CHANNEL_REDIS_URL', '')
+if CHANNEL_REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [CHANNEL_REDIS_URL],
+                # Mensajes encolados por canal antes de descartar (cliente lento)
+                "capacity": int(os.getenv('CHANNEL_REDIS_CAPACITY', '200')),
+                "expiry": 10,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
+
+# Segundos por tick del reparto en vivo: las lecturas de un tick salen como un
+# solo mensaje por grupo y un solo frame por cliente.
+SENSOR_STREAM_TICK = float(os.getenv('SENSOR_STREAM_TICK', '0.5'))
+# Frames en cola por cliente; con la cola llena (cliente lento) los ticks se
+# acumulan en la ventana y se informan como meta.dropped.
+SENSOR_STREAM_MAX_PENDING = int(os.getenv('SENSOR_STREAM_MAX_PENDING', '2'))
+
+# Minutos de lecturas en vivo que guarda la ingesta para repetir al conectarse
+# (ws/mqtt/?replay=1) o reanudar tras una reconexión (&since=<seq>).
+SENSOR_REPLAY_MINUTES = float(os.getenv('SENSOR_REPLAY_MINUTES', '10'))
+
+# Ingesta MQTT dentro del proceso ASGI. Con Redis (CHANNEL_REDIS_URL) puede
+# haber varios procesos Daphne y cada uno se suscribiría al broker (lecturas
+# guardadas N veces), así que por defecto queda apagada y la ingesta corre
+# en un único `python manage.py mqtt_ingest` aparte; sin Redis (un solo
+# proceso) queda encendida.
+MQTT_INGEST_EMBEDDED = os.getenv('MQTT_INGEST_EMBEDDED', '0' if CHANNEL_REDIS_URL else '1') == '1'
+
+# Escritura por lotes de lecturas: se vacía al llegar a INGEST_BATCH_SIZE filas
+# o cada INGEST_FLUSH_INTERVAL segundos. Con la cola llena el productor espera
+# hasta INGEST_PUT_TIMEOUT segundos antes de descartar la lectura.
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '500'))
+INGEST_FLUSH_INTERVAL = float(os.getenv('INGEST_FLUSH_INTERVAL', '1.0'))
+INGEST_MAX_QUEUE = int(os.getenv('INGEST_MAX_QUEUE', '10000'))
+INGEST_PUT_TIMEOUT = float(os.getenv('INGEST_PUT_TIMEOUT', '5.0'))
+
+# Caché de la etapa activa. La copia en memoria de cada proceso vence a los
+# ACTIVE_STAGE_CACHE_TTL segundos; con ACTIVE_STAGE_CACHE_SHARED=1 también se
+# guarda en el backend de CACHES (útil si es Redis/Memcached).
+ACTIVE_STAGE_CACHE_TTL = float(os.getenv('ACTIVE_STAGE_CACHE_TTL', '5.0'))
+ACTIVE_STAGE_CACHE_SHARED = os.getenv('ACTIVE_STAGE_CACHE_SHARED', '0') == '1'
+
+# raw_payload de cada lectura: 'always' lo guarda siempre; 'irregular' sólo
+# cuando el mensaje trae claves o valores que no caben en las columnas tipadas.
+SENSOR_STORE_RAW_PAYLOAD = os.getenv('SENSOR_STORE_RAW_PAYLOAD', 'always')
+
+# Lecturas por bloque al recorrer rangos grandes (cursor del lado del servidor
+# en PostgreSQL). Con pgbouncer en modo transacción hay que activar
+# DISABLE_SERVER_SIDE_CURSORS en DATABASES.
+READING_CHUNK_SIZE = int(os.getenv('READING_CHUNK_SIZE', '5000'))
+
+# Producción y reportes salen de los rollups (dashboard.rollups). Las lecturas
+# previas los obtienen con la migración 0012, que equivale a correr, en este
+# orden, `manage.py backfill_reading_columns` y `manage.py rebuild_rollups`
+# (volver a correrlos si la migración se interrumpe).
+
+# Generación de reportes en segundo plano (`python manage.py report_worker`).
+# El worker consulta la cola cada REPORT_WORKER_POLL_INTERVAL segundos y
+# renderiza PDF/Excel/CSV en REPORT_RENDER_PROCESSES procesos. Un trabajo en
+# curso por más de REPORT_JOB_TIMEOUT segundos se reintenta (hasta
+# REPORT_JOB_MAX_ATTEMPTS veces).
+REPORT_WORKER_POLL_INTERVAL = float(os.getenv('REPORT_WORKER_POLL_INTERVAL', '2.0'))
+REPORT_RENDER_PROCESSES = int(os.getenv('REPORT_RENDER_PROCESSES', '3'))
+REPORT_JOB_TIMEOUT = int(os.getenv('REPORT_JOB_TIMEOUT', '600'))
+REPORT_JOB_MAX_ATTEMPTS = int(os.getenv('REPORT_JOB_MAX_ATTEMPTS', '3'))
+
+# Caché en disco (MEDIA_ROOT/report_cache) de reportes generados; al superar
+# REPORT_CACHE_MAX_BYTES se borran los menos usados.
+REPORT_CACHE_MAX_BYTES = int(os.getenv('REPORT_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+
+# Máximo de escenarios por llamada a /api/biocalculadora/estimate/batch/
+BIOCALC_BATCH_MAX_SCENARIOS = int(os.getenv('BIOCALC_BATCH_MAX_SCENARIOS', '5000'))
+
+# Series esperadas memoizadas (biocalculadora.series_cache): entradas en la
+# copia local de cada proceso y vigencia en segundos (también en CACHES).
+EXPECTED_SERIES_CACHE_SIZE = int(os.getenv('EXPECTED_SERIES_CACHE_SIZE', '256'))
+EXPECTED_SERIES_CACHE_TTL = float(os.getenv('EXPECTED_SERIES_CACHE_TTL', '3600'))
+
+# Pronóstico Monte Carlo: máximo de muestras y de días (horizon_days) por
+# llamada a la API y muestras de las bandas del dashboard (/production/current/?bands=1).
+BIOCALC_FORECAST_MAX_SAMPLES = int(os.getenv('BIOCALC_FORECAST_MAX_SAMPLES', '20000'))
+BIOCALC_FORECAST_MAX_DAYS = int(os.getenv('BIOCALC_FORECAST_MAX_DAYS', '365'))
+DASHBOARD_FORECAST_SAMPLES = int(os.getenv('DASHBOARD_FORECAST_SAMPLES', '2000'))
+
+# Cálculos (recetas) por bloque en `manage.py recompute_calculations`
+RECIPE_CHUNK_SIZE = int(os.getenv('RECIPE_CHUNK_SIZE', '500'))
+
+# Optimizador de recetas (/api/biocalculadora/optimize/): tiempo máximo de
+# búsqueda en segundos, mezclas evaluadas por ronda, rondas de refinamiento y
+# vigencia en segundos de los resultados guardados en CACHES.
+RECIPE_OPTIMIZER_TIME_LIMIT = float(os.getenv('RECIPE_OPTIMIZER_TIME_LIMIT', '0.8'))
+RECIPE_OPTIMIZER_MAX_CANDIDATES = int(os.getenv('RECIPE_OPTIMIZER_MAX_CANDIDATES', '20000'))
+RECIPE_OPTIMIZER_MAX_ROUNDS = int(os.getenv('RECIPE_OPTIMIZER_MAX_ROUNDS', '12'))
+RECIPE_OPTIMIZER_CACHE_TTL = float(os.getenv('RECIPE_OPTIMIZER_CACHE_TTL', '600'))
+
+# Particiones mensuales de lecturas (PostgreSQL) y retención de datos crudos.
+# `manage.py maintain_partitions --retention` (p.ej. diario por cron) crea las
+# particiones de los próximos meses y, para los meses anteriores a
+# SENSOR_RAW_RETENTION_MONTHS (0 = conservar todo) con rollups completos,
+# 'compact' deja una lectura por hora y 'drop' elimina las lecturas.
+SENSOR_PARTITION_MONTHS_AHEAD = int(os.getenv('SENSOR_PARTITION_MONTHS_AHEAD', '3'))
+SENSOR_RAW_RETENTION_MONTHS = int(os.getenv('SENSOR_RAW_RETENTION_MONTHS', '0'))
+SENSOR_RETENTION_MODE = os.getenv('SENSOR_RETENTION_MODE', 'compact')
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
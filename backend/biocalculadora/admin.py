@@ -1,5 +1,6 @@
 from django.contrib import admin
 from biocalculadora.models import Feedstock, Calculation, RecipeItem
+from biocalculadora.recipes import recompute
 
 @admin.register(Feedstock)
 class FeedstockAdmin(admin.ModelAdmin):
@@ -9,5 +10,11 @@ class FeedstockAdmin(admin.ModelAdmin):
 class CalculationAdmin(admin.ModelAdmin):
     list_display = ('name', 'retention_time', 'temperature', 'total_biogas', 'created')
     readonly_fields = ('total_biogas', 'total_slurry', 'required_volume', 'created') # Results are read-only
+    actions = ['recompute_results']
+
+    @admin.action(description="Recalcular resultados")
+    def recompute_results(self, request, queryset):
+        count = recompute(queryset)
+        self.message_user(request, f"Cálculos recalculados: {count}")
 
 admin.site.register(RecipeItem)
\ No newline at end of file
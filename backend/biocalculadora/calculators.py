@@ -1,6 +1,8 @@
 import math
 from typing import Dict, List, Tuple
 
+import numpy as np
+
 e = math.e
 
 # Parámetros por defecto
@@ -44,22 +46,29 @@ def gompertz_rate(t, A, mu_g, lam):
     return A * math.exp(-exp_inner) * exp_inner * (mu_g * e / A)
 
 
-def estimate_timeseries_for_material(
+def gompertz_curves(t, A, mu_g, lam) -> Tuple[np.ndarray, np.ndarray]:
+    """G(t) y G'(t) para un arreglo de tiempos, con una sola evaluación de
+    cada exponencial (mismas fórmulas que gompertz_cumulative/gompertz_rate)."""
+    k = mu_g * e / A if A else 0.0
+    exp_inner = np.exp(k * (lam - np.asarray(t, dtype=float)) + 1.0)
+    cumulative = A * np.exp(-exp_inner)
+    return cumulative, cumulative * exp_inner * k
+
+def gompertz_time_to_fraction(fraction, A, mu_g, lam):
+    """Inversa de Gompertz: t tal que G(t) = fraction * A (None si no existe)."""
+    k = mu_g * e / A if A else 0.0
+    if not (0.0 < fraction < 1.0) or k <= 0:
+        return None
+    return lam + (1.0 - math.log(-math.log(fraction))) / k
+
+def material_gompertz_params(
     material_type: str,
     vs_kg_per_day: float,
     reactor_volume_m3: float | None,
     temperature_c: float,
-    target_fraction: float = 0.95,
-    max_days: int = 120,
     HRT_days: float | None = None,
-) -> Dict[str, List[float]]:
-    """
-    Genera series de producción diaria y acumulada (m3 de biogás) usando Gompertz modificado
-    para biodigestores de bolsa, ajustando por temperatura y tipo de materia.
-
-    Se detiene cuando la producción acumulada alcanza target_fraction del potencial A o
-    al llegar a max_days.
-    """
+) -> Tuple[Dict[str, float], float, float, float]:
+    """Parámetros (p, A_biogas, mu_g, lam) de la curva de un tipo de materia."""
     p = DEFAULTS.copy()
     # aplicar parámetros por tipo si existen
     mt = MATERIAL_PARAMS.get(material_type.lower())
@@ -85,24 +94,51 @@ def estimate_timeseries_for_material(
     mu_max = adjust_mu_by_temp(p.get("mu_max_ref", DEFAULTS["mu_max_ref"]), p["T_ref"], p["Q10"], temperature_c)
     mu_eff = monod_mu(mu_max, S, p["Ks"])
     mu_g = mu_eff * A_biogas
-    lam = p["lag"]
+    return p, A_biogas, mu_g, p["lag"]
 
-    days: List[float] = []
-    daily: List[float] = []
-    cumulative: List[float] = []
 
-    cum = 0.0
-    t = 0.0
-    dt = 1.0  # días
+def estimate_timeseries_for_material(
+    material_type: str,
+    vs_kg_per_day: float,
+    reactor_volume_m3: float | None,
+    temperature_c: float,
+    target_fraction: float = 0.95,
+    max_days: int = 120,
+    HRT_days: float | None = None,
+) -> Dict[str, List[float]]:
+    """
+    Genera series de producción diaria y acumulada (m3 de biogás) usando Gompertz modificado
+    para biodigestores de bolsa, ajustando por temperatura y tipo de materia.
+
+    Se detiene cuando la producción acumulada alcanza target_fraction del potencial A o
+    al llegar a max_days. Los días se evalúan juntos con NumPy (gompertz_curves).
+    """
+    p, A_biogas, mu_g, lam = material_gompertz_params(
+        material_type, vs_kg_per_day, reactor_volume_m3, temperature_c, HRT_days,
+    )
     target = A_biogas * target_fraction
 
-    while t <= max_days and cum < target:
-        rate = max(gompertz_rate(t, A_biogas, mu_g, lam), 0.0)
-        cum = max(gompertz_cumulative(t, A_biogas, mu_g, lam), 0.0)
-        days.append(t)
-        daily.append(rate)
-        cumulative.append(cum)
-        t += dt
+    # Días 0, 1, ..., max_days; la serie termina en el primero que alcanza el
+    # objetivo. La inversa de Gompertz da ese día, así que sólo se evalúan los
+    # días necesarios (uno más por redondeo; si aun así no alcanza, todos).
+    n_days = math.floor(max_days) + 1 if max_days >= 0 and target > 0 else 0
+    bounds = [n_days]
+    t_target = gompertz_time_to_fraction(target_fraction, A_biogas, mu_g, lam)
+    if t_target is not None and t_target + 2 < n_days:
+        bounds.insert(0, max(math.floor(t_target) + 2, 1))
+    for end in bounds:
+        t = np.arange(end, dtype=float)
+        cumulative, daily = gompertz_curves(t, A_biogas, mu_g, lam)
+        np.maximum(cumulative, 0.0, out=cumulative)
+        np.maximum(daily, 0.0, out=daily)
+        reached = np.flatnonzero(cumulative >= target)
+        if reached.size:
+            end = int(reached[0]) + 1
+            break
+
+    days: List[float] = t[:end].tolist()
+    daily: List[float] = daily[:end].tolist()
+    cumulative: List[float] = cumulative[:end].tolist()
 
     return {
         "days": days,
@@ -203,4 +239,213 @@ def estimate(biowaste_vs_kg_per_day,
         "cost_additives_usd_per_day": additives_cost_per_day,
         "total_cost_usd_per_day": total_cost_day,
 
-    }
\ No newline at end of file
+    }
+
+# --- Evaluación por lotes (muchos escenarios a la vez) ---
+
+BATCH_FIELDS = ("material_type", "vs_per_day", "temperature", "HRT", "reactor_volume")
+
+def scenario_grid(**values) -> Dict[str, list]:
+    """Producto cartesiano de listas por campo (BATCH_FIELDS) en columnas.
+
+    Ej.: scenario_grid(material_type=["bovino", "porcino"], vs_per_day=[50, 100])
+    da 4 escenarios. Los campos que falten quedan en None (valor por defecto).
+    """
+    axes = [list(values.get(name) or [None]) for name in BATCH_FIELDS]
+    index = np.indices([len(axis) for axis in axes]).reshape(len(axes), -1)
+    return {name: [axis[i] for i in idx] for name, axis, idx in zip(BATCH_FIELDS, axes, index)}
+
+def grid_size(**values) -> int:
+    """Cantidad de escenarios de scenario_grid(**values), sin armarlos.
+
+    Cada eje debe ser una lista (o faltar); si no, ValueError.
+    """
+    size = 1
+    for name in BATCH_FIELDS:
+        axis = values.get(name)
+        if axis is None:
+            continue
+        if not isinstance(axis, (list, tuple)):
+            raise ValueError(f"grid.{name} debe ser una lista")
+        size *= max(len(axis), 1)
+    return size
+
+# Tabla de parámetros por material (una fila por material, la última con
+# DEFAULTS para los desconocidos). Se arma la primera vez que se usa y se
+# rearma sola si cambian DEFAULTS o MATERIAL_PARAMS.
+_material_table_cache: Dict[str, object] = {}
+
+def _params_fingerprint() -> tuple:
+    return (
+        tuple(sorted(DEFAULTS.items())),
+        tuple((name, tuple(sorted(values.items()))) for name, values in sorted(MATERIAL_PARAMS.items())),
+    )
+
+def material_table() -> Dict[str, object]:
+    """names (material -> fila), columns (parámetro -> columna) y values
+    (materiales + 1 x parámetros). Incluye ``log_Q10_10`` = ln(Q10) / 10."""
+    fingerprint = _params_fingerprint()
+    if _material_table_cache.get("fingerprint") != fingerprint:
+        names = {name: i for i, name in enumerate(sorted(MATERIAL_PARAMS))}
+        columns = {name: j for j, name in enumerate(DEFAULTS)}
+        values = np.tile(np.array([DEFAULTS[name] for name in columns], dtype=float), (len(names) + 1, 1))
+        for material, row in names.items():
+            for name, value in MATERIAL_PARAMS[material].items():
+                values[row, columns[name]] = value
+        columns["log_Q10_10"] = len(columns)
+        values = np.column_stack([values, np.log(values[:, columns["Q10"]]) / 10.0])
+        _material_table_cache.update(fingerprint=fingerprint, names=names, columns=columns, values=values)
+    return _material_table_cache
+
+def material_gompertz_arrays(material_type, vs_kg_per_day, reactor_volume_m3, temperature_c, HRT_days):
+    """Versión por arreglos de material_gompertz_params (None -> por defecto).
+
+    Devuelve un dict de arreglos con los parámetros de cada escenario.
+    """
+    n = len(material_type)
+    table = material_table()
+    default_row = len(table["names"])
+    rows = np.fromiter(
+        (table["names"].get(str(material).lower(), default_row) for material in material_type), dtype=np.intp, count=n,
+    )
+    params = table["values"][rows]
+    cols = {name: params[:, j] for name, j in table["columns"].items()}
+
+    def _column(values, default):
+        out = np.array([default if v is None else v for v in values], dtype=float)
+        return np.broadcast_to(out, (n,)) if out.ndim == 0 else out
+
+    vs = _column(vs_kg_per_day, np.nan)
+    temp = _column(temperature_c, 35.0)
+    hrt = _column(HRT_days, np.nan)
+    hrt = np.where(np.isnan(hrt), cols["HRT"], hrt)
+    volume = _column(reactor_volume_m3, 0.0)
+
+    A_ch4_potential = cols["Y"] * vs
+    A_biogas = np.where(cols["fCH4"] > 0, A_ch4_potential / np.where(cols["fCH4"] > 0, cols["fCH4"], 1.0), A_ch4_potential)
+    # Sin volumen: el derivado del HRT (mínimo 1 m3 si da <= 0)
+    derived = (hrt * vs) / 1000.0
+    volume = np.where(volume > 0, volume, np.where(derived > 0, derived, 1.0))
+    S = vs / volume
+
+    # Q10 ** (dT / 10) como exp(dT * ln(Q10) / 10): mismo valor, la mitad de costo
+    mu_max = cols["mu_max_ref"] * np.exp((temp - cols["T_ref"]) * cols.pop("log_Q10_10"))
+    denom = cols["Ks"] + S
+    mu_eff = np.where(denom > 0, mu_max * S / np.where(denom > 0, denom, 1.0), 0.0)
+    cols.update({
+        "vs": vs, "temperature": temp, "HRT": hrt, "reactor_volume_m3": volume, "S": S,
+        "A_biogas": A_biogas, "mu_max": mu_max, "mu_eff": mu_eff, "mu_g": mu_eff * A_biogas,
+    })
+    return cols
+
+def _json_column(values) -> list:
+    # NaN/inf (p. ej. división por cero) -> None para que sea JSON válido
+    out = values.tolist()
+    for i in np.flatnonzero(~np.isfinite(values)):
+        out[i] = None
+    return out
+
+def _batch_curves(t, A, mu_g, lam):
+    # gompertz_curves con un escenario por fila (A, mu_g, lam: columnas)
+    k = np.divide(mu_g * e, A, out=np.zeros_like(A), where=A != 0)
+    exp_inner = np.exp(k * (lam - t) + 1.0)
+    cumulative = A * np.exp(-exp_inner)
+    return cumulative, cumulative * exp_inner * k
+
+def estimate_batch(
+    material_type,
+    vs_per_day,
+    temperature=None,
+    HRT=None,
+    reactor_volume=None,
+    target_fraction: float = 0.95,
+    max_days: int = 120,
+    include_series: bool = False,
+    vs_cost_per_kg=0.0,
+    water_cost_per_m3=0.0,
+    water_m3_per_day=0.0,
+    additives_cost_per_day=0.0,
+) -> Dict[str, object]:
+    """Evalúa muchos escenarios en una sola pasada con arreglos NumPy.
+
+    Cada argumento de escenario es una lista (una entrada por escenario; None
+    usa el valor por defecto) y los costos pueden ser un número o una lista.
+    Los resultados por escenario equivalen a ``estimate`` con los parámetros
+    del material y a ``estimate_timeseries_for_material``; se devuelven en
+    columnas (una lista por resultado). Con ``include_series`` se agregan las
+    series diarias de cada escenario.
+    """
+    n = len(material_type)
+    none = [None] * n
+    cols = material_gompertz_arrays(material_type, vs_per_day, reactor_volume or none, temperature or none, HRT or none)
+    A, mu_g, lam, hrt = cols["A_biogas"], cols["mu_g"], cols["lag"], cols["HRT"]
+
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        # Igual que estimate(): producción en el horizonte HRT
+        cum_at_hrt, prod_day = _batch_curves(hrt, A, mu_g, lam)
+        meth_day = prod_day * cols["fCH4"]
+        vs_degraded = np.where(cols["Y"] > 0, meth_day / cols["Y"], 0.0)
+        outflow = np.where(hrt > 0, cols["reactor_volume_m3"] / hrt, cols["reactor_volume_m3"])
+        vs_out = np.maximum(cols["vs"] - vs_degraded, 0.0)
+
+        cost_vs = cols["vs"] * np.asarray(vs_cost_per_kg, dtype=float)
+        cost_water = np.asarray(water_m3_per_day, dtype=float) * np.asarray(water_cost_per_m3, dtype=float)
+        additives = np.broadcast_to(np.asarray(additives_cost_per_day, dtype=float), (n,))
+
+        # Serie hasta alcanzar target_fraction (como estimate_timeseries_for_material)
+        target = A * target_fraction
+        n_days = math.floor(max_days) + 1 if max_days >= 0 else 0
+        bounds = [n_days]
+        k = np.divide(mu_g * e, A, out=np.zeros_like(A), where=A != 0)
+        active = target > 0
+        if 0.0 < target_fraction < 1.0 and active.any() and np.all(k[active] > 0):
+            t_target = np.max(lam[active] + (1.0 - math.log(-math.log(target_fraction))) / k[active])
+            if t_target + 2 < n_days:
+                bounds.insert(0, max(math.floor(t_target) + 2, 1))
+        for width in bounds:
+            t = np.arange(width, dtype=float)
+            cumulative, daily = _batch_curves(t[None, :], A[:, None], mu_g[:, None], lam[:, None])
+            np.maximum(cumulative, 0.0, out=cumulative)
+            np.maximum(daily, 0.0, out=daily)
+            reached = cumulative >= target[:, None]
+            done = reached.any(axis=1)
+            if done.all() or width == n_days:
+                break
+        lengths = np.where(done, reached.argmax(axis=1) + 1, width)
+        lengths = np.where(target > 0, lengths, 0)
+        mask = t[None, :] < lengths[:, None]
+        total = np.where(mask, daily, 0.0).sum(axis=1)
+
+    results = {
+        "reactor_volume_m3": cols["reactor_volume_m3"],
+        "S_kg_per_m3": cols["S"],
+        "mu_max_adj_per_day": cols["mu_max"],
+        "mu_eff_per_day": cols["mu_eff"],
+        "A_biogas_m3": A,
+        "cumulative_biogas_m3_at_HRT": cum_at_hrt,
+        "biogas_m3_per_day_estimated": prod_day,
+        "methane_m3_per_day": meth_day,
+        "vs_degraded_kg_per_day": vs_degraded,
+        "vs_out_kg_per_day": vs_out,
+        "biol_volume_m3_per_day": outflow,
+        "total_cost_usd_per_day": cost_vs + cost_water + additives,
+        "days_to_target": lengths,
+        "series_total_biogas_m3": total,
+    }
+    out: Dict[str, object] = {
+        "count": n,
+        "scenarios": {
+            "material_type": [str(m).lower() for m in material_type],
+            "vs_per_day": cols["vs"].tolist(),
+            "temperature": cols["temperature"].tolist(),
+            "HRT": hrt.tolist(),
+            "reactor_volume": list(reactor_volume or none),
+        },
+        "results": {name: _json_column(np.broadcast_to(values, (n,))) for name, values in results.items()},
+    }
+    if include_series:
+        out["series"] = {
+            "daily_biogas_m3": [row[:length].tolist() for row, length in zip(daily, lengths)],
+            "cumulative_biogas_m3": [row[:length].tolist() for row, length in zip(cumulative, lengths)],
+        }
+    return out
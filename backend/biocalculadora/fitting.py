@@ -0,0 +1,113 @@
+"""Ajuste de la curva de Gompertz (A, mu_g, lam) a una serie observada.
+
+Mínimos cuadrados no lineales por Levenberg-Marquardt con el jacobiano
+analítico, todo con arreglos NumPy (sin SciPy). Se ajusta en
+(log A, log mu_g, lam) para que A y mu_g queden positivos.
+
+Acepta un punto de partida (``initial``): al reajustar una etapa con un día
+más de datos se parte del ajuste anterior y converge en pocas iteraciones.
+"""
+import math
+from typing import Dict, Optional
+
+import numpy as np
+
+from .calculators import e, gompertz_curves
+
+# Días con producción necesarios para ajustar
+MIN_POINTS = 3
+
+
+def _jacobian(t, A, mu_g, lam):
+    """G(t) y derivadas respecto de (log A, log mu_g, lam)."""
+    k = mu_g * e / A
+    exp_inner = np.exp(k * (lam - t) + 1.0)
+    decay = np.exp(-exp_inner)
+    G = A * decay
+    dG_dA = decay * (1.0 + exp_inner * k * (lam - t))
+    dG_dmu = -decay * exp_inner * e * (lam - t)
+    dG_dlam = -G * exp_inner * k
+    return G, np.column_stack([A * dG_dA, mu_g * dG_dmu, dG_dlam])
+
+
+def initial_guess(t, y) -> Dict[str, float]:
+    """Estimación inicial: pendiente máxima y su tangente (definición de lam)."""
+    slopes = np.diff(y) / np.diff(t)
+    i = int(np.argmax(slopes)) if slopes.size else 0
+    mu_g = float(slopes[i]) if slopes.size and slopes[i] > 0 else max(float(y[-1]) / max(float(t[-1]), 1.0), 1e-6)
+    # Si la curva sigue subiendo, el potencial está por encima de lo observado
+    A = float(y[-1]) * (1.5 if slopes.size and slopes[-1] > 0.25 * mu_g else 1.05)
+    lam = float(t[i] - y[i] / mu_g) if slopes.size else 0.0
+    return {"A": max(A, 1e-6), "mu_g": mu_g, "lam": max(lam, 0.0)}
+
+
+def fit_gompertz(t, y, initial: Optional[Dict[str, float]] = None,
+                 max_iter: int = 100, tol: float = 1e-10) -> Optional[Dict[str, float]]:
+    """Ajusta G(t) a los puntos (t, y). Devuelve None si hay pocos datos.
+
+    Resultado: A, mu_g, lam, rmse, iterations, converged, n.
+    """
+    t = np.asarray(t, dtype=float)
+    y = np.asarray(y, dtype=float)
+    ok = np.isfinite(t) & np.isfinite(y)
+    t, y = t[ok], y[ok]
+    if np.count_nonzero(y > 0) < MIN_POINTS or y.max() <= 0:
+        return None
+
+    start = initial or initial_guess(t, y)
+    theta = np.array([
+        math.log(max(start["A"], 1e-6)),
+        math.log(max(start["mu_g"], 1e-9)),
+        float(start["lam"]),
+    ])
+    damping = 1e-3
+    G, J = _jacobian(t, *_params(theta))
+    residual = y - G
+    cost = float(residual @ residual)
+    converged = False
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        JtJ = J.T @ J
+        step_rhs = J.T @ residual
+        try:
+            step = np.linalg.solve(JtJ + damping * np.diag(np.diag(JtJ) + 1e-12), step_rhs)
+        except np.linalg.LinAlgError:
+            break
+        candidate = theta + step
+        with np.errstate(over="ignore", invalid="ignore"):
+            G_new, J_new = _jacobian(t, *_params(candidate))
+        residual_new = y - G_new
+        cost_new = float(residual_new @ residual_new)
+        if np.isfinite(cost_new) and cost_new < cost:
+            improvement = cost - cost_new
+            theta, G, J, residual, cost = candidate, G_new, J_new, residual_new, cost_new
+            damping = max(damping / 3.0, 1e-12)
+            if improvement <= tol * max(cost, 1e-12) or np.max(np.abs(step)) < 1e-10:
+                converged = True
+                break
+        else:
+            damping *= 4.0
+            if damping > 1e12:
+                converged = True  # sin mejora posible desde aquí
+                break
+
+    A, mu_g, lam = _params(theta)
+    return {
+        "A": A,
+        "mu_g": mu_g,
+        "lam": lam,
+        "rmse": math.sqrt(cost / len(t)),
+        "iterations": iterations,
+        "converged": converged,
+        "n": int(len(t)),
+    }
+
+
+def _params(theta):
+    return float(math.exp(theta[0])), float(math.exp(theta[1])), float(theta[2])
+
+
+def predict_cumulative(days, A, mu_g, lam) -> list:
+    """Acumulado ajustado G(t) en los días indicados."""
+    cumulative, _rate = gompertz_curves(np.asarray(days, dtype=float), A, mu_g, lam)
+    return np.maximum(cumulative, 0.0).tolist()
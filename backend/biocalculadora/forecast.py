@@ -0,0 +1,150 @@
+"""Pronóstico probabilístico (Monte Carlo) de la producción de biogás.
+
+Se muestrean ``Y``, ``mu_max_ref``, ``lag`` y la temperatura según
+``DEFAULT_UNCERTAINTY`` (o las distribuciones que se indiquen) y se evalúan
+todas las trayectorias de Gompertz juntas como una matriz días x muestras.
+El resultado son bandas de percentiles (P10/P50/P90 por defecto) de la
+producción diaria y acumulada. Con la misma semilla el resultado es el mismo.
+
+Todas las trayectorias usan el mismo eje de días (el de la serie
+determinística, sin corte por trayectoria).
+"""
+import math
+from typing import Dict, Optional
+
+import numpy as np
+
+from .calculators import DEFAULTS, MATERIAL_PARAMS, estimate_timeseries_for_material
+
+# Distribución de cada parámetro: "normal", "lognormal" o "uniform", con
+# desvío relativo a la media ("cv") o absoluto ("sd"). "min" recorta.
+DEFAULT_UNCERTAINTY: Dict[str, Dict[str, object]] = {
+    "Y": {"dist": "normal", "cv": 0.15, "min": 0.0},
+    "mu_max_ref": {"dist": "lognormal", "cv": 0.25},
+    "lag": {"dist": "normal", "sd": 0.75, "min": 0.0},
+    "temperature": {"dist": "normal", "sd": 2.0},
+}
+DEFAULT_PERCENTILES = (10, 50, 90)
+DEFAULT_SEED = 12345
+
+
+def sample(spec, mean, size, rng) -> np.ndarray:
+    """Muestras de una distribución con media ``mean`` según ``spec``."""
+    sd = float(spec["cv"]) * abs(mean) if "cv" in spec else float(spec.get("sd", 0.0))
+    dist = spec.get("dist", "normal")
+    if sd <= 0:
+        values = np.full(size, float(mean))
+    elif dist == "normal":
+        values = mean + sd * rng.standard_normal(size)
+    elif dist == "lognormal":
+        if mean <= 0:
+            raise ValueError("lognormal requiere media positiva")
+        sigma = math.sqrt(math.log1p((sd / mean) ** 2))
+        values = rng.lognormal(math.log(mean) - sigma ** 2 / 2.0, sigma, size)
+    elif dist == "uniform":
+        half = sd * math.sqrt(3.0)  # mismo desvío que la normal
+        values = rng.uniform(mean - half, mean + half, size)
+    else:
+        raise ValueError(f"Distribución desconocida: {dist}")
+    if spec.get("min") is not None:
+        np.maximum(values, float(spec["min"]), out=values)
+    return values
+
+
+def percentile_rows(matrix, percentiles) -> np.ndarray:
+    """np.percentile(matrix, percentiles, axis=1) (interpolación lineal).
+
+    Ordena cada fila completa: np.sort es bastante más rápido que la
+    selección parcial que usa np.percentile para unas pocas posiciones.
+    """
+    ordered = np.sort(matrix, axis=1)
+    position = (ordered.shape[1] - 1) * np.asarray(percentiles, dtype=float) / 100.0
+    lower = np.floor(position).astype(int)
+    upper = np.ceil(position).astype(int)
+    frac = position - lower
+    return (ordered[:, lower] * (1.0 - frac) + ordered[:, upper] * frac).T
+
+
+def _bands(matrix, percentiles) -> Dict[str, list]:
+    values = percentile_rows(matrix, percentiles)
+    return {f"p{p:g}": row.tolist() for p, row in zip(percentiles, values)}
+
+
+def forecast_bands(
+    material_type: str,
+    vs_kg_per_day: float,
+    reactor_volume_m3: Optional[float],
+    temperature_c: float,
+    samples: int = 10000,
+    seed: Optional[int] = DEFAULT_SEED,
+    uncertainty: Optional[Dict[str, Dict[str, object]]] = None,
+    percentiles=DEFAULT_PERCENTILES,
+    horizon_days: Optional[int] = None,
+    HRT_days: Optional[float] = None,
+) -> Dict[str, object]:
+    """Bandas de percentiles de la serie esperada para ``samples`` trayectorias.
+
+    ``uncertainty`` reemplaza por parámetro las entradas de
+    ``DEFAULT_UNCERTAINTY``. Sin ``horizon_days`` se usa el largo de la serie
+    determinística (``estimate_timeseries_for_material``).
+    """
+    spec = {**DEFAULT_UNCERTAINTY, **(uncertainty or {})}
+    unknown = set(spec) - set(DEFAULT_UNCERTAINTY)
+    if unknown:
+        raise ValueError(f"Parámetros sin distribución: {sorted(unknown)}")
+    samples = int(samples)
+    if samples <= 0:
+        raise ValueError("samples debe ser positivo")
+    percentiles = list(percentiles)
+    if not all(0.0 <= float(q) <= 100.0 for q in percentiles):
+        raise ValueError("percentiles debe estar entre 0 y 100")
+    if horizon_days is not None and int(horizon_days) <= 0:
+        raise ValueError("horizon_days debe ser positivo")
+
+    p = DEFAULTS.copy()
+    p.update(MATERIAL_PARAMS.get(material_type.lower(), {}))
+    if HRT_days is None:
+        HRT_days = p["HRT"]
+    if horizon_days is None:
+        deterministic = estimate_timeseries_for_material(
+            material_type, vs_kg_per_day, reactor_volume_m3, temperature_c, HRT_days=HRT_days,
+        )
+        horizon_days = len(deterministic["days"])
+
+    # S no depende de los parámetros muestreados
+    if reactor_volume_m3 and reactor_volume_m3 > 0:
+        S = vs_kg_per_day / reactor_volume_m3
+    else:
+        volume = (HRT_days * vs_kg_per_day) / 1000.0
+        S = vs_kg_per_day / (volume if volume > 0 else 1.0)
+
+    rng = np.random.default_rng(seed)
+    Y = sample(spec["Y"], p["Y"], samples, rng)
+    mu_ref = sample(spec["mu_max_ref"], p["mu_max_ref"], samples, rng)
+    lag = sample(spec["lag"], p["lag"], samples, rng)
+    temperature = sample(spec["temperature"], temperature_c, samples, rng)
+
+    A = Y * vs_kg_per_day / p["fCH4"] if p["fCH4"] > 0 else Y * vs_kg_per_day
+    mu_max = mu_ref * np.exp((temperature - p["T_ref"]) * (math.log(p["Q10"]) / 10.0))
+    mu_eff = mu_max * (S / (p["Ks"] + S)) if (p["Ks"] + S) > 0 else np.zeros(samples)
+    # k = mu_g * e / A con mu_g = mu_eff * A
+    k = mu_eff * math.e
+
+    # Matriz días x muestras: cada fila (un día) es contigua para ordenarla
+    t = np.arange(int(horizon_days), dtype=float)
+    exp_inner = np.exp(k * (lag - t[:, None]) + 1.0)
+    cumulative = A * np.exp(-exp_inner)
+    daily = cumulative * exp_inner * k
+    np.maximum(cumulative, 0.0, out=cumulative)
+    np.maximum(daily, 0.0, out=daily)
+
+    return {
+        "days": t.tolist(),
+        "samples": samples,
+        "seed": seed,
+        "percentiles": percentiles,
+        "daily_biogas_m3": _bands(daily, percentiles),
+        "cumulative_biogas_m3": _bands(cumulative, percentiles),
+        "A_biogas_m3": {key: values[0] for key, values in _bands(A[None, :], percentiles).items()},
+        "uncertainty": spec,
+    }
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from biocalculadora.models import Calculation
+from biocalculadora.recipes import recompute
+
+
+class Command(BaseCommand):
+    help = "Recalcula total_biogas, total_slurry y required_volume de los cálculos guardados."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--id", type=int, action="append", default=None, help="Cálculo (id); se puede repetir. Por defecto todos")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Cálculos por bloque (por defecto RECIPE_CHUNK_SIZE)")
+
+    def handle(self, *args, **options):
+        queryset = Calculation.objects.all()
+        if options["id"]:
+            queryset = queryset.filter(pk__in=options["id"])
+        total = recompute(queryset, chunk_size=options["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(f"Cálculos recalculados: {total}"))
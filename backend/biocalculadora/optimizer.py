@@ -0,0 +1,279 @@
+"""Optimizador de recetas: mezcla diaria más barata que cumple un objetivo.
+
+Busca cantidades (kg/día) de las materias primas disponibles que produzcan
+al menos ``target_biogas`` m3/día, quepan en el volumen del digestor y
+dejen el C:N dentro de la ventana pedida, con el menor costo diario. El
+costo usa los mismos términos que ``calculators.estimate`` (VS, agua y
+aditivos) más un costo por kg de cada materia prima.
+
+El modelo de la mezcla (``recipes.blend_items``) no es lineal en las
+cantidades (la fracción degradada depende de la concentración), así que en
+lugar de programación lineal se hace una búsqueda en grilla vectorizada con
+refinamiento: cada ronda evalúa de una vez una grilla (o una muestra
+aleatoria si es muy grande) alrededor de la mejor mezcla y achica el paso.
+Se detiene al agotar ``time_limit`` o cuando el paso ya es despreciable.
+
+Cachés:
+- la grilla gruesa de la primera ronda depende sólo de las materias primas
+  y de las condiciones del digestor; se guarda en memoria del proceso, así
+  que explorar otros objetivos, ventanas de C:N o costos la reutiliza;
+- el resultado de una búsqueda completa (no cortada por ``time_limit``) se
+  guarda en el backend de caché de Django.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .recipes import SLURRY_DENSITY, blend_items
+
+CACHE_PREFIX = 'biocalc:optimize'
+# Grillas gruesas evaluadas (por proceso)
+_GRID_CACHE_SIZE = 32
+_grid_lock = threading.Lock()
+_grid_cache: "OrderedDict[str, tuple]" = OrderedDict()
+# Penalización por unidad relativa de restricción incumplida
+_PENALTY = 1e6
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _evaluate(amounts, props, conditions) -> Dict[str, np.ndarray]:
+    """Evalúa m mezclas (amounts: m x n kg/día) en una sola pasada."""
+    m, n = amounts.shape
+    items = {
+        'calc': np.repeat(np.arange(m), n),
+        'amount': amounts.ravel(),
+        'ts_pct': np.tile(props['ts_pct'], m),
+        'vs_pct': np.tile(props['vs_pct'], m),
+        'cn': np.tile(props['cn'], m),
+        'yield': np.tile(props['yield'], m),
+    }
+    return blend_items(items, m, conditions['retention'], conditions['water_ratio'], conditions['temperature'])
+
+
+def _grid(lower, upper, steps, max_candidates, rng):
+    """Grilla regular entre ``lower`` y ``upper``; si supera ``max_candidates``
+    puntos, una muestra uniforme de ese tamaño."""
+    n = len(lower)
+    if steps ** n <= max_candidates:
+        axes = [np.linspace(lo, hi, steps) for lo, hi in zip(lower, upper)]
+        return np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, n)
+    return lower + rng.random((max_candidates, n)) * (upper - lower)
+
+
+def _coarse_grid(props, conditions, upper, steps, max_candidates):
+    """Primera ronda: grilla y su evaluación, memoizadas por proceso."""
+    key = json.dumps([props['key'], conditions, upper.tolist(), steps, max_candidates], sort_keys=True, default=str)
+    with _grid_lock:
+        if key in _grid_cache:
+            _grid_cache.move_to_end(key)
+            return _grid_cache[key] + (True,)
+    amounts = _grid(np.zeros_like(upper), upper, steps, max_candidates, np.random.default_rng(0))
+    physics = _evaluate(amounts, props, conditions)
+    with _grid_lock:
+        _grid_cache[key] = (amounts, physics)
+        while len(_grid_cache) > _GRID_CACHE_SIZE:
+            _grid_cache.popitem(last=False)
+    return amounts, physics, False
+
+
+def _score(amounts, physics, props, goal):
+    """Costo diario y costo penalizado por restricciones incumplidas."""
+    feed = physics['feed_kg_per_day']
+    water_m3 = feed * goal['water_ratio'] / SLURRY_DENSITY
+    cost = (
+        amounts @ props['cost_per_kg']
+        + physics['vs_kg_per_day'] * goal['vs_cost_per_kg']
+        + water_m3 * goal['water_cost_per_m3']
+        + goal['additives_cost_per_day']
+    )
+    target = goal['target_biogas']
+    shortfall = np.maximum(target - physics['total_biogas'], 0.0) / max(target, 1e-9)
+    overflow = np.maximum(physics['required_volume'] - goal['volume'], 0.0) / max(goal['volume'], 1e-9)
+    cn = physics['cn_ratio']
+    cn_low = np.where(np.isnan(cn), 0.0, np.maximum(goal['cn_min'] - cn, 0.0)) / max(goal['cn_min'], 1.0)
+    cn_high = np.where(np.isnan(cn), 0.0, np.maximum(cn - goal['cn_max'], 0.0)) / max(goal['cn_max'], 1.0)
+    violation = shortfall + overflow + cn_low + cn_high
+    # Sin C:N cargado no se puede verificar la ventana: se acepta
+    feasible = violation <= 1e-9
+    return cost, feasible, cost + _PENALTY * violation
+
+
+def optimize_mix(
+    feedstocks: List[dict],
+    target_biogas: float,
+    volume: float,
+    cn_min: float = 20.0,
+    cn_max: float = 30.0,
+    retention: float = 30.0,
+    water_ratio: float = 1.0,
+    temperature: float = 35.0,
+    vs_cost_per_kg: float = 0.0,
+    water_cost_per_m3: float = 0.0,
+    additives_cost_per_day: float = 0.0,
+    steps: int = 11,
+    time_limit: Optional[float] = None,
+    alternatives: int = 5,
+) -> Dict[str, object]:
+    """Mezcla más barata que cumple el objetivo (ver docstring del módulo).
+
+    ``feedstocks``: dicts con id, name, total_solids, volatile_solids,
+    cn_ratio, biogas_yield y opcionalmente max_kg_per_day y cost_per_kg.
+    """
+    if not feedstocks:
+        raise ValueError("Se requiere al menos una materia prima")
+    if target_biogas <= 0 or volume <= 0 or retention <= 0:
+        raise ValueError("target_biogas, volume y retention deben ser positivos")
+    if cn_min > cn_max:
+        raise ValueError("cn_min no puede ser mayor que cn_max")
+    steps = max(int(steps), 3)
+    time_limit = float(time_limit if time_limit is not None else _setting('RECIPE_OPTIMIZER_TIME_LIMIT', 0.8))
+    max_candidates = int(_setting('RECIPE_OPTIMIZER_MAX_CANDIDATES', 20000))
+    goal = {
+        'target_biogas': float(target_biogas), 'volume': float(volume),
+        'cn_min': float(cn_min), 'cn_max': float(cn_max), 'water_ratio': float(water_ratio),
+        'vs_cost_per_kg': float(vs_cost_per_kg), 'water_cost_per_m3': float(water_cost_per_m3),
+        'additives_cost_per_day': float(additives_cost_per_day),
+    }
+    conditions = {'retention': float(retention), 'water_ratio': float(water_ratio), 'temperature': float(temperature)}
+
+    def column(name, default=np.nan):
+        return np.array([default if f.get(name) is None else f[name] for f in feedstocks], dtype=float)
+
+    props = {
+        'ts_pct': column('total_solids'),
+        'vs_pct': column('volatile_solids'),
+        'cn': column('cn_ratio'),
+        'yield': column('biogas_yield'),
+        'cost_per_kg': column('cost_per_kg', 0.0),
+    }
+    props['key'] = [[f.get(k) for k in ('id', 'total_solids', 'volatile_solids', 'cn_ratio', 'biogas_yield')] for f in feedstocks]
+
+    cache_key = CACHE_PREFIX + ':' + hashlib.sha1(json.dumps(
+        [props['key'], [f.get('max_kg_per_day') for f in feedstocks], props['cost_per_kg'].tolist(),
+         goal, conditions, steps, alternatives], sort_keys=True, default=str,
+    ).encode('utf-8')).hexdigest()
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return {**cached, 'cached': True}
+
+    started = time.perf_counter()
+    # Cota por materia prima: su máximo o todo el volumen del digestor
+    feed_limit = volume * SLURRY_DENSITY / ((1.0 + water_ratio) * retention)
+    upper = np.minimum(column('max_kg_per_day', feed_limit), feed_limit)
+
+    amounts, physics, grid_cached = _coarse_grid(props, conditions, upper, steps, max_candidates)
+    rng = np.random.default_rng(1)
+    pool_amounts, pool_cost, pool_feasible, pool_penalized = [], [], [], []
+    evaluations = 0
+    rounds = 0
+    step = upper / (steps - 1)
+    best = None
+    timed_out = False
+    while True:
+        cost, feasible, penalized = _score(amounts, physics, props, goal)
+        evaluations += len(amounts)
+        rounds += 1
+        pool_amounts.append(amounts)
+        pool_cost.append(cost)
+        pool_feasible.append(feasible)
+        pool_penalized.append(penalized)
+        index = int(np.argmin(penalized))
+        if best is None or penalized[index] < best[1]:
+            best = (amounts[index], penalized[index])
+
+        if time.perf_counter() - started > time_limit:
+            timed_out = True
+            break
+        if np.all(step < 1e-3) or rounds >= int(_setting('RECIPE_OPTIMIZER_MAX_ROUNDS', 12)):
+            break
+        # Siguiente ronda: grilla alrededor de la mejor mezcla con la mitad del paso
+        lower = np.maximum(best[0] - step, 0.0)
+        upper_round = np.minimum(best[0] + step, upper)
+        step = step / 2.0
+        amounts = _grid(lower, upper_round, steps, max_candidates, rng)
+        physics = _evaluate(amounts, props, conditions)
+
+    all_amounts = np.concatenate(pool_amounts)
+    all_cost = np.concatenate(pool_cost)
+    all_feasible = np.concatenate(pool_feasible)
+    feasible_index = np.flatnonzero(all_feasible)
+    ranked = feasible_index[np.argsort(all_cost[feasible_index], kind='stable')]
+
+    chosen = []
+    seen = set()
+    for index in ranked:
+        signature = tuple(np.round(all_amounts[index], 1))
+        if signature in seen:
+            continue
+        seen.add(signature)
+        chosen.append(index)
+        if len(chosen) >= max(int(alternatives), 1):
+            break
+    mixes = all_amounts[chosen] if chosen else best[0][None, :]
+    details = _evaluate(mixes, props, conditions)
+    costs, feasible, _penalized = _score(mixes, details, props, goal)
+
+    def mix_payload(i):
+        return {
+            'amounts_kg_per_day': [
+                {'feedstock': f.get('id'), 'name': f.get('name'), 'kg_per_day': float(x)}
+                for f, x in zip(feedstocks, mixes[i])
+            ],
+            'total_cost_usd_per_day': float(costs[i]),
+            'total_biogas_m3_per_day': float(details['total_biogas'][i]),
+            'required_volume_m3': float(details['required_volume'][i]),
+            'cn_ratio': float(details['cn_ratio'][i]) if np.isfinite(details['cn_ratio'][i]) else None,
+            'vs_kg_per_day': float(details['vs_kg_per_day'][i]),
+            'feasible': bool(feasible[i]),
+        }
+
+    result = {
+        'feasible': bool(chosen),
+        'best': mix_payload(0),
+        'alternatives': [mix_payload(i) for i in range(1, len(mixes))],
+        'evaluations': int(evaluations),
+        'rounds': rounds,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000.0, 1),
+        'timed_out': timed_out,
+        'coarse_grid_cached': grid_cached,
+    }
+    # Una búsqueda cortada por time_limit no se guarda: la clave no incluye
+    # el tiempo y otro pedido con más margen encontraría una mezcla mejor
+    if not timed_out:
+        cache.set(cache_key, result, float(_setting('RECIPE_OPTIMIZER_CACHE_TTL', 600)))
+    return {**result, 'cached': False}
+
+
+def feedstock_payloads(queryset, overrides=None) -> List[dict]:
+    """Dicts de ``optimize_mix`` desde Feedstock, con max/costo por id."""
+    overrides = overrides or {}
+    rows = []
+    for f in queryset.order_by('id'):
+        extra = overrides.get(f.id, {})
+        rows.append({
+            'id': f.id,
+            'name': f.name,
+            'total_solids': f.total_solids,
+            'volatile_solids': f.volatile_solids,
+            'cn_ratio': f.cn_ratio,
+            'biogas_yield': f.biogas_yield,
+            'max_kg_per_day': extra.get('max_kg_per_day'),
+            'cost_per_kg': extra.get('cost_per_kg'),
+        })
+    return rows
+
+
+def clear_grid_cache():
+    with _grid_lock:
+        _grid_cache.clear()
+
@@ -0,0 +1,204 @@
+"""Motor de recetas: mezcla de varias materias primas (Feedstock/RecipeItem).
+
+Para cada ``Calculation`` se combinan sus ingredientes (kg/día):
+
+- TS (kg/día) = cantidad * TS%; VS (kg/día) = TS * VS% (de TS).
+- C:N de la mezcla: promedio de los C:N ponderado por VS, sólo con los
+  ingredientes que lo tienen cargado.
+- Potencial de biogás A (m3 por día de alimentación) = sum(VS * rendimiento);
+  sin ``biogas_yield`` se usa el de DEFAULTS (Y / fCH4).
+- Lodo (``total_slurry``, kg/día) = alimentación * (1 + water_ratio) y
+  volumen requerido = lodo (densidad 1000 kg/m3) * tiempo de retención.
+- Biogás diario (``total_biogas``): A * G(HRT) / A, la fracción del
+  potencial que la curva de Gompertz (mismos DEFAULTS de cinética, ajustados
+  por temperatura y concentración S) alcanza dentro del tiempo de retención.
+
+La cinética no depende de la materia prima, así que la serie esperada de la
+mezcla es la suma de las de cada ingrediente (A_i por la misma forma).
+
+Todo se calcula con arreglos: los ingredientes de muchos cálculos se
+recorren juntos y se suman por cálculo con ``np.bincount``.
+"""
+from typing import Dict
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .calculators import DEFAULTS, adjust_mu_by_temp, e
+from .models import Calculation, RecipeItem
+
+# kg de lodo por m3
+SLURRY_DENSITY = 1000.0
+RESULT_FIELDS = ('total_biogas', 'total_slurry', 'required_volume')
+
+
+def default_biogas_yield() -> float:
+    return DEFAULTS["Y"] / DEFAULTS["fCH4"] if DEFAULTS["fCH4"] > 0 else DEFAULTS["Y"]
+
+
+def with_ingredients(queryset=None):
+    """Cálculos con sus ingredientes y materias primas en una sola consulta extra."""
+    queryset = queryset if queryset is not None else Calculation.objects.all()
+    return queryset.prefetch_related(
+        Prefetch('ingredients', queryset=RecipeItem.objects.select_related('feedstock').order_by('id'))
+    )
+
+
+def _as_float(values) -> np.ndarray:
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def _item_arrays(calculations):
+    """Arreglos planos de todos los ingredientes y el índice de su cálculo."""
+    rows = [
+        (index, item.daily_amount, item.feedstock.total_solids, item.feedstock.volatile_solids,
+         item.feedstock.cn_ratio, item.feedstock.biogas_yield)
+        for index, calc in enumerate(calculations)
+        for item in calc.ingredients.all()
+    ]
+    if not rows:
+        return None
+    columns = list(zip(*rows))
+    return {
+        'calc': np.array(columns[0], dtype=int),
+        'amount': _as_float(columns[1]),
+        'ts_pct': _as_float(columns[2]),
+        'vs_pct': _as_float(columns[3]),
+        'cn': _as_float(columns[4]),
+        'yield': _as_float(columns[5]),
+    }
+
+
+def blend(calculations) -> Dict[str, np.ndarray]:
+    """Resultados de la mezcla por cálculo (un arreglo por campo, en el orden
+    de ``calculations``, que deben venir de ``with_ingredients``)."""
+    calculations = list(calculations)
+    items = _item_arrays(calculations)
+    if items is None:
+        items = {key: np.array([], dtype=float) for key in ('amount', 'ts_pct', 'vs_pct', 'cn', 'yield')}
+        items['calc'] = np.array([], dtype=int)
+    return blend_items(
+        items,
+        count=len(calculations),
+        retention=np.array([c.retention_time for c in calculations], dtype=float),
+        water_ratio=np.array([c.water_ratio for c in calculations], dtype=float),
+        temperature=np.array([c.temperature for c in calculations], dtype=float),
+    )
+
+
+def blend_items(items, count, retention, water_ratio, temperature) -> Dict[str, np.ndarray]:
+    """Núcleo de ``blend`` sobre arreglos planos de ingredientes.
+
+    ``items``: calc (índice de la mezcla, 0..count-1), amount, ts_pct, vs_pct,
+    cn, yield (NaN = sin dato). ``retention``, ``water_ratio`` y
+    ``temperature`` tienen un valor por mezcla o uno para todas.
+    """
+    n = count
+
+    def per_calc(values):
+        return np.bincount(items['calc'], weights=values, minlength=n)
+
+    ts_kg = items['amount'] * items['ts_pct'] / 100.0
+    vs_kg = ts_kg * items['vs_pct'] / 100.0
+    biogas_yield = np.where(np.isnan(items['yield']), default_biogas_yield(), items['yield'])
+    has_cn = ~np.isnan(items['cn'])
+
+    feed = per_calc(items['amount'])
+    ts = per_calc(ts_kg)
+    vs = per_calc(vs_kg)
+    potential = per_calc(vs_kg * biogas_yield)
+    cn_weight = per_calc(np.where(has_cn, vs_kg, 0.0))
+    cn_sum = per_calc(np.where(has_cn, vs_kg * np.nan_to_num(items['cn']), 0.0))
+
+    slurry = feed * (1.0 + water_ratio)
+    volume = slurry / SLURRY_DENSITY * retention
+    with np.errstate(divide='ignore', invalid='ignore'):
+        S = np.where(volume > 0, vs / volume, 0.0)
+        mu_max = adjust_mu_by_temp(DEFAULTS["mu_max_ref"], DEFAULTS["T_ref"], DEFAULTS["Q10"], temperature)
+        mu_eff = mu_max * S / (DEFAULTS["Ks"] + S)
+        # G(HRT) / A con mu_g = mu_eff * A (no depende de A)
+        fraction = np.exp(-np.exp(mu_eff * e * (DEFAULTS["lag"] - retention) + 1.0))
+        ts_pct = np.where(feed > 0, ts / feed * 100.0, np.nan)
+        cn_ratio = np.where(cn_weight > 0, cn_sum / cn_weight, np.nan)
+
+    return {
+        'feed_kg_per_day': feed,
+        'ts_kg_per_day': ts,
+        'vs_kg_per_day': vs,
+        'ts_pct': ts_pct,
+        'cn_ratio': cn_ratio,
+        'A_biogas_m3': potential,
+        'mu_eff_per_day': mu_eff,
+        'fraction_at_HRT': fraction,
+        'total_biogas': potential * fraction,
+        'total_slurry': slurry,
+        'required_volume': volume,
+    }
+
+
+def _json(value):
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+def calculation_series(calc, max_days: int = 120) -> Dict[str, object]:
+    """Mezcla de un cálculo y su serie esperada (total y por ingrediente)."""
+    calc = with_ingredients(Calculation.objects.filter(pk=calc.pk)).get()
+    result = blend([calc])
+    items = list(calc.ingredients.all())
+    t = np.arange(int(max_days) + 1, dtype=float)
+    k = result['mu_eff_per_day'][0] * e
+    exp_inner = np.exp(k * (DEFAULTS["lag"] - t) + 1.0)
+    shape = np.exp(-exp_inner)  # G(t) / A
+
+    arrays = _item_arrays([calc])
+    if arrays is None:
+        contributions = np.zeros((0,))
+    else:
+        yields = np.where(np.isnan(arrays['yield']), default_biogas_yield(), arrays['yield'])
+        contributions = arrays['amount'] * arrays['ts_pct'] / 100.0 * arrays['vs_pct'] / 100.0 * yields
+    cumulative = contributions[:, None] * shape[None, :]
+    daily = cumulative * (exp_inner * k)[None, :]
+
+    return {
+        'calculation': calc.pk,
+        'blend': {name: _json(values[0]) for name, values in result.items()},
+        'days': t.tolist(),
+        'daily_biogas_m3': daily.sum(axis=0).tolist(),
+        'cumulative_biogas_m3': cumulative.sum(axis=0).tolist(),
+        'ingredients': [
+            {
+                'feedstock': item.feedstock.name,
+                'daily_amount': item.daily_amount,
+                'A_biogas_m3': _json(a),
+                'cumulative_biogas_m3': row.tolist(),
+            }
+            for item, a, row in zip(items, contributions, cumulative)
+        ],
+    }
+
+
+def save_results(calculations, results) -> int:
+    """Guarda total_biogas/total_slurry/required_volume con bulk_update."""
+    calculations = list(calculations)
+    for i, calc in enumerate(calculations):
+        for field in RESULT_FIELDS:
+            setattr(calc, field, _json(results[field][i]))
+    Calculation.objects.bulk_update(calculations, RESULT_FIELDS)
+    return len(calculations)
+
+
+def recompute(queryset=None, chunk_size=None) -> int:
+    """Recalcula y guarda los resultados de los cálculos por bloques (keyset
+    por pk: cada bloque es una consulta más la de sus ingredientes)."""
+    chunk_size = chunk_size or getattr(settings, 'RECIPE_CHUNK_SIZE', 500)
+    queryset = queryset if queryset is not None else Calculation.objects.all()
+    total = 0
+    last_pk = 0
+    while True:
+        chunk = list(with_ingredients(queryset.filter(pk__gt=last_pk)).order_by('pk')[:chunk_size])
+        if not chunk:
+            return total
+        total += save_results(chunk, blend(chunk))
+        last_pk = chunk[-1].pk
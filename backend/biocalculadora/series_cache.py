@@ -0,0 +1,108 @@
+"""Memoización de las series esperadas (estimate_timeseries_for_material).
+
+Una etapa no cambia sus parámetros, así que la curva esperada es siempre la
+misma; las vistas del dashboard y los reportes la pedían en cada llamada.
+Aquí se guarda con una clave formada por las entradas normalizadas y la
+versión del conjunto de parámetros (``params_version``, cambia sola al
+editar ``DEFAULTS`` o ``MATERIAL_PARAMS``).
+
+Dos niveles: un LRU en memoria del proceso (``EXPECTED_SERIES_CACHE_SIZE``
+entradas) y el backend de caché de Django, compartido entre workers si es
+Redis/Memcached. Ambos vencen a los ``EXPECTED_SERIES_CACHE_TTL`` segundos.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import calculators
+
+# Subir al cambiar el cálculo de la serie sin cambiar los parámetros
+SERIES_VERSION = 1
+CACHE_PREFIX = 'biocalc:expected'
+
+_lock = threading.Lock()
+_local: "OrderedDict[str, tuple]" = OrderedDict()
+
+
+def _ttl() -> float:
+    return float(getattr(settings, 'EXPECTED_SERIES_CACHE_TTL', 3600))
+
+
+def _size() -> int:
+    return int(getattr(settings, 'EXPECTED_SERIES_CACHE_SIZE', 256))
+
+
+def params_version() -> str:
+    params = {'defaults': calculators.DEFAULTS, 'materials': calculators.MATERIAL_PARAMS, 'v': SERIES_VERSION}
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def _number(value):
+    # 100, 100.0 y 100.0000000001 comparten entrada
+    return None if value is None else round(float(value), 6)
+
+
+def cache_key(material_type, vs_kg_per_day, reactor_volume_m3, temperature_c,
+              target_fraction=0.95, max_days=120, HRT_days=None) -> str:
+    parts = [
+        # Igual que calculators: sólo minúsculas (" bovino" no es "bovino")
+        str(material_type).lower(),
+        _number(vs_kg_per_day),
+        _number(reactor_volume_m3) if reactor_volume_m3 else None,
+        _number(temperature_c),
+        _number(target_fraction),
+        _number(max_days),
+        _number(HRT_days),
+    ]
+    digest = hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+    return f"{CACHE_PREFIX}:{params_version()}:{digest}"
+
+
+def _copy(series) -> dict:
+    # Los que llaman pueden modificar las listas; la copia cacheada no cambia
+    return {key: list(value) if isinstance(value, list) else (dict(value) if isinstance(value, dict) else value)
+            for key, value in series.items()}
+
+
+def expected_series(material_type, vs_kg_per_day, reactor_volume_m3, temperature_c,
+                    target_fraction=0.95, max_days=120, HRT_days=None) -> dict:
+    """Igual que ``estimate_timeseries_for_material``, pero memoizada."""
+    key = cache_key(material_type, vs_kg_per_day, reactor_volume_m3, temperature_c,
+                    target_fraction, max_days, HRT_days)
+    now = time.monotonic()
+    with _lock:
+        entry = _local.get(key)
+        if entry is not None and entry[0] > now:
+            _local.move_to_end(key)
+            return _copy(entry[1])
+
+    series = cache.get(key)
+    if series is None:
+        series = calculators.estimate_timeseries_for_material(
+            material_type=material_type,
+            vs_kg_per_day=vs_kg_per_day,
+            reactor_volume_m3=reactor_volume_m3,
+            temperature_c=temperature_c,
+            target_fraction=target_fraction,
+            max_days=max_days,
+            HRT_days=HRT_days,
+        )
+        cache.set(key, series, _ttl())
+
+    with _lock:
+        _local[key] = (now + _ttl(), series)
+        _local.move_to_end(key)
+        while len(_local) > _size():
+            _local.popitem(last=False)
+    return _copy(series)
+
+
+def clear():
+    """Vacía la copia local (la compartida vence por TTL o cambio de versión)."""
+    with _lock:
+        _local.clear()
@@ -0,0 +1,362 @@
+import io
+import math
+from unittest import mock
+
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from . import calculators, optimizer, recipes, series_cache
+from .fitting import fit_gompertz
+from .forecast import forecast_bands, percentile_rows
+from .models import Calculation, Feedstock, RecipeItem
+from .calculators import (
+    MATERIAL_PARAMS,
+    estimate,
+    estimate_batch,
+    gompertz_cumulative,
+    gompertz_rate,
+    gompertz_time_to_fraction,
+    estimate_timeseries_for_material,
+    gompertz_curves,
+    material_gompertz_params,
+)
+
+
+def legacy_timeseries(material_type, vs_kg_per_day, reactor_volume_m3, temperature_c,
+                      target_fraction=0.95, max_days=120, HRT_days=None):
+    """Bucle día a día que usaba estimate_timeseries_for_material."""
+    p, A, mu_g, lam = material_gompertz_params(material_type, vs_kg_per_day, reactor_volume_m3, temperature_c, HRT_days)
+    days, daily, cumulative = [], [], []
+    cum = 0.0
+    t = 0.0
+    target = A * target_fraction
+    while t <= max_days and cum < target:
+        rate = max(gompertz_rate(t, A, mu_g, lam), 0.0)
+        cum = max(gompertz_cumulative(t, A, mu_g, lam), 0.0)
+        days.append(t)
+        daily.append(rate)
+        cumulative.append(cum)
+        t += 1.0
+    return {"days": days, "daily_biogas_m3": daily, "cumulative_biogas_m3": cumulative}
+
+
+class VectorizedGompertzTests(SimpleTestCase):
+    CASES = [
+        ("bovino", 100.0, None, 35.0, {}),
+        ("porcino", 250.0, 12.0, 28.0, {}),
+        ("vegetal", 40.0, None, 18.0, {"target_fraction": 0.99}),
+        ("otro", 10.0, None, 35.0, {"max_days": 15}),
+        ("bovino", 100.0, None, 35.0, {"target_fraction": 1.0}),
+        ("bovino", 100.0, None, 35.0, {"max_days": 10.5}),
+        ("bovino", 0.0, None, 35.0, {}),
+    ]
+
+    def test_matches_daily_loop(self):
+        for material, vs, volume, temp, kwargs in self.CASES:
+            with self.subTest(material=material, vs=vs, **kwargs):
+                new = estimate_timeseries_for_material(material, vs, volume, temp, **kwargs)
+                old = legacy_timeseries(material, vs, volume, temp, **kwargs)
+                self.assertEqual(new["days"], old["days"])
+                for key in ("daily_biogas_m3", "cumulative_biogas_m3"):
+                    self.assertEqual(len(new[key]), len(old[key]))
+                    for a, b in zip(new[key], old[key]):
+                        self.assertTrue(math.isclose(a, b, rel_tol=1e-12, abs_tol=1e-15))
+                self.assertIsInstance(new["daily_biogas_m3"][0] if new["days"] else 0.0, float)
+
+    def test_inverse_hits_fraction(self):
+        _p, A, mu_g, lam = material_gompertz_params("bovino", 100.0, None, 35.0)
+        t = gompertz_time_to_fraction(0.95, A, mu_g, lam)
+        self.assertAlmostEqual(gompertz_cumulative(t, A, mu_g, lam), 0.95 * A)
+        self.assertIsNone(gompertz_time_to_fraction(1.0, A, mu_g, lam))
+
+
+class BatchEstimateTests(SimpleTestCase):
+    def test_matches_single_scenario_functions(self):
+        materials = ["bovino", "porcino", "vegetal", "otro", "bovino"]
+        vs = [100.0, 250.0, 40.0, 10.0, 0.0]
+        temps = [35.0, 28.0, None, 20.0, 35.0]
+        hrts = [None, 20.0, 40.0, None, None]
+        volumes = [None, 12.0, None, 3.0, None]
+        batch = estimate_batch(materials, vs, temps, hrts, volumes, target_fraction=0.97,
+                               include_series=True, vs_cost_per_kg=0.1)
+        self.assertEqual(batch["count"], 5)
+        for i, material in enumerate(materials):
+            temp = temps[i] if temps[i] is not None else 35.0
+            with self.subTest(material=material, vs=vs[i]):
+                series = estimate_timeseries_for_material(material, vs[i], volumes[i], temp,
+                                                          target_fraction=0.97, HRT_days=hrts[i])
+                self.assertEqual(batch["results"]["days_to_target"][i], len(series["days"]))
+                for key in ("daily_biogas_m3", "cumulative_biogas_m3"):
+                    for a, b in zip(batch["series"][key][i], series[key]):
+                        self.assertTrue(math.isclose(a, b, rel_tol=1e-12, abs_tol=1e-15))
+                self.assertAlmostEqual(batch["results"]["series_total_biogas_m3"][i], sum(series["daily_biogas_m3"]))
+                if vs[i] == 0.0:
+                    continue
+                single = estimate(vs[i], volumes[i], temp, hrts[i], params=MATERIAL_PARAMS.get(material), vs_cost_per_kg=0.1)
+                for key in ("reactor_volume_m3", "A_biogas_m3", "cumulative_biogas_m3_at_HRT",
+                            "biogas_m3_per_day_estimated", "vs_out_kg_per_day", "biol_volume_m3_per_day",
+                            "total_cost_usd_per_day"):
+                    self.assertTrue(math.isclose(batch["results"][key][i], single[key], rel_tol=1e-12), key)
+
+    def test_grid_endpoint(self):
+        res = APIClient().post("/api/biocalculadora/estimate/batch/", {
+            "grid": {"material_type": ["bovino", "porcino"], "vs_per_day": [50, 100, 150], "temperature": [25, 35]},
+        }, format="json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data["count"], 12)
+        self.assertEqual(res.data["scenarios"]["material_type"][:6], ["bovino"] * 6)
+        self.assertEqual(res.data["scenarios"]["vs_per_day"][:3], [50.0, 50.0, 100.0])
+        self.assertNotIn("series", res.data)
+        self.assertEqual(len(res.data["results"]["A_biogas_m3"]), 12)
+
+        bad = APIClient().post("/api/biocalculadora/estimate/batch/", {"scenarios": [{"material_type": "bovino"}]}, format="json")
+        self.assertEqual(bad.status_code, 400)
+
+    @override_settings(BIOCALC_BATCH_MAX_SCENARIOS=100)
+    def test_oversized_grid_rejected_before_building(self):
+        axis = list(range(40))
+        huge = {name: axis for name in calculators.BATCH_FIELDS}
+        with mock.patch("biocalculadora.views.scenario_grid") as build:
+            res = APIClient().post("/api/biocalculadora/estimate/batch/", {"grid": huge}, format="json")
+            self.assertEqual(res.status_code, 400)
+            self.assertIn("Máximo 100", res.data["detail"])
+            res = APIClient().post("/api/biocalculadora/estimate/batch/", {"grid": {"vs_per_day": 50}}, format="json")
+            self.assertEqual(res.status_code, 400)
+            build.assert_not_called()
+
+    def test_material_table_follows_params(self):
+        temps = np.linspace(0.0, 70.0, 701)
+        none = [None] * len(temps)
+        cols = calculators.material_gompertz_arrays(["porcino"] * len(temps), [100.0] * len(temps), none, temps, none)
+        exact = calculators.adjust_mu_by_temp(0.30, calculators.DEFAULTS["T_ref"], calculators.DEFAULTS["Q10"], temps)
+        self.assertLess(np.max(np.abs(cols["mu_max"] / exact - 1.0)), 1e-13)
+        with mock.patch.dict(calculators.MATERIAL_PARAMS["porcino"], {"mu_max_ref": 0.6}):
+            cols = calculators.material_gompertz_arrays(["porcino", "otro"], [100.0, 100.0], [None] * 2, [35.0, 35.0], [None] * 2)
+            self.assertEqual(cols["mu_max"].tolist(), [0.6, calculators.DEFAULTS["mu_max_ref"]])
+        cols = calculators.material_gompertz_arrays(["PORCINO"], [100.0], [None], [35.0], [None])
+        self.assertEqual(cols["mu_max"].tolist(), [0.30])
+
+
+class ExpectedSeriesCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        series_cache.clear()
+        self.addCleanup(series_cache.clear)
+        patcher = mock.patch.object(calculators, "estimate_timeseries_for_material",
+                                    wraps=calculators.estimate_timeseries_for_material)
+        self.compute = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_computed_once_per_normalized_inputs(self):
+        first = series_cache.expected_series("Bovino", 100, None, 35)
+        second = series_cache.expected_series("bovino", 100.0, 0, 35.0)
+        self.assertEqual(self.compute.call_count, 1)
+        self.assertEqual(first, estimate_timeseries_for_material("bovino", 100.0, None, 35.0))
+        # Copias independientes
+        second["daily_biogas_m3"].append(-1.0)
+        self.assertNotEqual(series_cache.expected_series("bovino", 100, None, 35), second)
+
+        # Otro worker: sin copia local, la toma del backend de caché
+        series_cache.clear()
+        series_cache.expected_series("bovino", 100, None, 35)
+        self.assertEqual(self.compute.call_count, 1)
+
+    def test_key_normalizes_like_the_calculator(self):
+        # El calculador no recorta espacios: " bovino" usa los parámetros por defecto
+        padded = series_cache.expected_series(" bovino", 100, None, 35)
+        self.assertEqual(padded, estimate_timeseries_for_material(" bovino", 100.0, None, 35.0))
+        self.assertNotEqual(padded, series_cache.expected_series("bovino", 100, None, 35))
+        self.assertEqual(self.compute.call_count, 2)
+
+    @override_settings(EXPECTED_SERIES_CACHE_SIZE=2)
+    def test_local_copy_is_bounded_lru(self):
+        for vs in (10, 20, 30):
+            series_cache.expected_series("porcino", vs, None, 30)
+        self.assertEqual(len(series_cache._local), 2)
+
+    def test_parameter_change_invalidates(self):
+        series_cache.expected_series("vegetal", 40, None, 25)
+        with mock.patch.dict(calculators.MATERIAL_PARAMS["vegetal"], {"lag": 4.0}):
+            series = series_cache.expected_series("vegetal", 40, None, 25)
+            self.assertEqual(series["params"]["lag"], 4.0)
+        self.assertEqual(self.compute.call_count, 2)
+
+
+class GompertzFittingTests(SimpleTestCase):
+    def test_recovers_parameters_with_warm_start(self):
+        t = np.arange(1, 25, dtype=float)
+        y, _rate = gompertz_curves(t, 40.0, 3.0, 2.5)
+        y = y + np.random.default_rng(0).normal(0, 0.2, len(t))
+        fit = fit_gompertz(t, y)
+        self.assertTrue(fit["converged"])
+        self.assertAlmostEqual(fit["A"], 40.0, delta=1.0)
+        self.assertAlmostEqual(fit["mu_g"], 3.0, delta=0.2)
+        self.assertAlmostEqual(fit["lam"], 2.5, delta=0.3)
+
+        refit = fit_gompertz(np.append(t, 25.0), np.append(y, y[-1]), initial=fit)
+        self.assertLessEqual(refit["iterations"], fit["iterations"])
+        self.assertIsNone(fit_gompertz([1.0, 2.0], [0.5, 1.0]))
+
+
+class ForecastBandsTests(SimpleTestCase):
+    def test_seeded_bands_are_ordered_and_reproducible(self):
+        first = forecast_bands("bovino", 100.0, None, 35.0, samples=5000, seed=7)
+        again = forecast_bands("bovino", 100.0, None, 35.0, samples=5000, seed=7)
+        other = forecast_bands("bovino", 100.0, None, 35.0, samples=5000, seed=8)
+        self.assertEqual(first["cumulative_biogas_m3"], again["cumulative_biogas_m3"])
+        self.assertNotEqual(first["cumulative_biogas_m3"], other["cumulative_biogas_m3"])
+
+        deterministic = estimate_timeseries_for_material("bovino", 100.0, None, 35.0)
+        self.assertEqual(first["days"], deterministic["days"])
+        bands = first["cumulative_biogas_m3"]
+        for p10, p50, p90 in zip(bands["p10"], bands["p50"], bands["p90"]):
+            self.assertLessEqual(p10, p50)
+            self.assertLessEqual(p50, p90)
+        # La mediana del potencial queda cerca del valor determinístico
+        self.assertAlmostEqual(first["A_biogas_m3"]["p50"], deterministic["A_biogas_m3"], delta=0.05 * deterministic["A_biogas_m3"])
+
+    def test_without_uncertainty_matches_deterministic_curve(self):
+        none = {name: {"sd": 0.0} for name in ("Y", "mu_max_ref", "lag", "temperature")}
+        bands = forecast_bands("porcino", 80.0, None, 30.0, samples=10, uncertainty=none, horizon_days=40)
+        _p, A, mu_g, lam = material_gompertz_params("porcino", 80.0, None, 30.0)
+        expected, _rate = gompertz_curves(np.arange(40.0), A, mu_g, lam)
+        np.testing.assert_allclose(bands["cumulative_biogas_m3"]["p90"], expected, rtol=1e-12)
+
+    def test_percentile_rows_matches_numpy(self):
+        matrix = np.random.default_rng(0).random((4, 999))
+        np.testing.assert_allclose(percentile_rows(matrix, [10, 50, 90]), np.percentile(matrix, [10, 50, 90], axis=1))
+
+    def test_endpoint(self):
+        res = APIClient().post("/api/biocalculadora/forecast/", {
+            "material_type": "vegetal", "vs_per_day": 40, "samples": 1000, "seed": 1,
+            "uncertainty": {"lag": {"dist": "uniform", "sd": 1.0, "min": 0.0}},
+        }, format="json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(res.data["daily_biogas_m3"]), {"p10", "p50", "p90"})
+        bad = APIClient().post("/api/biocalculadora/forecast/", {"vs_per_day": 40, "uncertainty": {"x": {}}}, format="json")
+        self.assertEqual(bad.status_code, 400)
+
+    @override_settings(BIOCALC_FORECAST_MAX_DAYS=200)
+    def test_endpoint_rejects_long_horizon_and_bad_percentiles(self):
+        url = "/api/biocalculadora/forecast/"
+        with mock.patch("biocalculadora.views.forecast_bands") as bands:
+            res = APIClient().post(url, {"vs_per_day": 40, "horizon_days": 100000}, format="json")
+            self.assertEqual(res.status_code, 400)
+            self.assertIn("200", res.data["detail"])
+            bands.assert_not_called()
+        for percentiles in ([10, 150], [-5, 50]):
+            res = APIClient().post(url, {"vs_per_day": 40, "samples": 10, "percentiles": percentiles}, format="json")
+            self.assertEqual(res.status_code, 400, percentiles)
+        res = APIClient().post(url, {"vs_per_day": 40, "samples": 10, "horizon_days": 200, "percentiles": [0, 100]}, format="json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(res.data["days"]), 200)
+
+
+class RecipeEngineTests(TestCase):
+    def setUp(self):
+        self.manure = Feedstock.objects.create(name="Estiércol", total_solids=20.0, volatile_solids=80.0, cn_ratio=20.0, biogas_yield=0.4)
+        self.straw = Feedstock.objects.create(name="Rastrojo", total_solids=90.0, volatile_solids=90.0, cn_ratio=80.0)
+        self.calc = Calculation.objects.create(name="Mezcla", retention_time=30, water_ratio=1.0, temperature=30.0)
+        RecipeItem.objects.create(calculation=self.calc, feedstock=self.manure, daily_amount=100.0)
+        RecipeItem.objects.create(calculation=self.calc, feedstock=self.straw, daily_amount=10.0)
+
+    def test_blend_values(self):
+        result = recipes.blend(recipes.with_ingredients(Calculation.objects.filter(pk=self.calc.pk)))
+        vs_manure, vs_straw = 100 * 0.2 * 0.8, 10 * 0.9 * 0.9
+        self.assertAlmostEqual(result['vs_kg_per_day'][0], vs_manure + vs_straw)
+        self.assertAlmostEqual(result['ts_pct'][0], (20.0 + 9.0) / 110.0 * 100)
+        self.assertAlmostEqual(result['cn_ratio'][0], (vs_manure * 20 + vs_straw * 80) / (vs_manure + vs_straw))
+        self.assertAlmostEqual(result['A_biogas_m3'][0], vs_manure * 0.4 + vs_straw * recipes.default_biogas_yield())
+        self.assertAlmostEqual(result['total_slurry'][0], 220.0)
+        self.assertAlmostEqual(result['required_volume'][0], 0.22 * 30)
+        self.assertTrue(0 < result['fraction_at_HRT'][0] <= 1)
+
+        series = recipes.calculation_series(self.calc)
+        self.assertAlmostEqual(series['cumulative_biogas_m3'][30], result['total_biogas'][0])
+        self.assertAlmostEqual(
+            series['cumulative_biogas_m3'][-1],
+            sum(item['cumulative_biogas_m3'][-1] for item in series['ingredients']),
+        )
+
+    def test_recompute_command_in_chunks(self):
+        empty = Calculation.objects.create(name="Vacía")
+        for i in range(4):
+            calc = Calculation.objects.create(name=f"C{i}", temperature=25.0 + i)
+            RecipeItem.objects.create(calculation=calc, feedstock=self.manure, daily_amount=50.0 * (i + 1))
+        # 3 bloques (cálculos + ingredientes + bulk_update) y la consulta final vacía
+        with self.assertNumQueries(3 * 3 + 1):
+            recipes.recompute(Calculation.objects.exclude(pk=empty.pk), chunk_size=2)
+        call_command('recompute_calculations', chunk_size=3, stdout=io.StringIO())
+        totals = list(Calculation.objects.exclude(pk__in=[self.calc.pk, empty.pk]).order_by('pk').values_list('total_biogas', flat=True))
+        self.assertEqual(len(totals), 4)
+        self.assertTrue(all(a < b for a, b in zip(totals, totals[1:])))
+        empty.refresh_from_db()
+        self.assertEqual(empty.total_biogas, 0.0)
+        self.calc.refresh_from_db()
+        self.assertAlmostEqual(self.calc.required_volume, 6.6)
+
+
+class RecipeOptimizerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        optimizer.clear_grid_cache()
+        self.manure = Feedstock.objects.create(name="Estiércol", total_solids=20.0, volatile_solids=80.0, cn_ratio=20.0, biogas_yield=0.4)
+        self.straw = Feedstock.objects.create(name="Rastrojo", total_solids=90.0, volatile_solids=90.0, cn_ratio=80.0)
+        self.feedstocks = [
+            {**row, 'cost_per_kg': cost}
+            for row, cost in zip(optimizer.feedstock_payloads(Feedstock.objects.all()), (0.01, 0.05))
+        ]
+
+    def test_cheapest_feasible_mix(self):
+        result = optimizer.optimize_mix(self.feedstocks, target_biogas=5.0, volume=20.0, cn_min=20.0, cn_max=30.0)
+        best = result['best']
+        self.assertTrue(result['feasible'])
+        self.assertGreaterEqual(best['total_biogas_m3_per_day'], 5.0)
+        self.assertLessEqual(best['required_volume_m3'], 20.0)
+        self.assertTrue(20.0 <= best['cn_ratio'] <= 30.0)
+        self.assertLess(result['elapsed_ms'], 1000)
+        # El resultado coincide con lo que calcula el motor de recetas
+        calc = Calculation.objects.create(name="Óptima", retention_time=30, water_ratio=1.0, temperature=35.0)
+        for feedstock, row in zip((self.manure, self.straw), best['amounts_kg_per_day']):
+            RecipeItem.objects.create(calculation=calc, feedstock=feedstock, daily_amount=row['kg_per_day'])
+        blend = recipes.blend(recipes.with_ingredients(Calculation.objects.filter(pk=calc.pk)))
+        self.assertAlmostEqual(blend['total_biogas'][0], best['total_biogas_m3_per_day'])
+        # Ninguna alternativa factible es más barata
+        self.assertTrue(all(alt['total_cost_usd_per_day'] >= best['total_cost_usd_per_day'] for alt in result['alternatives']))
+
+    def test_infeasible_and_caches(self):
+        result = optimizer.optimize_mix(self.feedstocks, target_biogas=500.0, volume=20.0)
+        self.assertFalse(result['feasible'])
+        self.assertLess(result['best']['total_biogas_m3_per_day'], 500.0)
+        # Otro objetivo reutiliza la grilla gruesa; la misma consulta, el resultado
+        other = optimizer.optimize_mix(self.feedstocks, target_biogas=4.0, volume=20.0)
+        self.assertTrue(other['coarse_grid_cached'])
+        again = optimizer.optimize_mix(self.feedstocks, target_biogas=4.0, volume=20.0)
+        self.assertTrue(again['cached'])
+        self.assertEqual(again['best'], other['best'])
+
+    def test_truncated_search_is_not_cached(self):
+        truncated = optimizer.optimize_mix(self.feedstocks, target_biogas=5.0, volume=20.0, time_limit=0.0)
+        self.assertTrue(truncated['timed_out'])
+        self.assertEqual(truncated['rounds'], 1)
+        full = optimizer.optimize_mix(self.feedstocks, target_biogas=5.0, volume=20.0, time_limit=5.0)
+        self.assertFalse(full['cached'])
+        self.assertFalse(full['timed_out'])
+        self.assertGreater(full['rounds'], 1)
+        self.assertTrue(optimizer.optimize_mix(self.feedstocks, target_biogas=5.0, volume=20.0, time_limit=0.0)['cached'])
+
+    def test_api(self):
+        client = APIClient()
+        response = client.post('/api/biocalculadora/optimize/', {
+            'feedstocks': [{'id': self.manure.id, 'cost_per_kg': 0.01}, self.straw.id],
+            'target_biogas': 5.0, 'digester_volume': 20.0, 'vs_cost_per_kg': 0.02,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['feedstock'] for row in response.data['best']['amounts_kg_per_day']], [self.manure.id, self.straw.id])
+        response = client.post('/api/biocalculadora/optimize/', {
+            'feedstocks': [9999], 'target_biogas': 5.0, 'digester_volume': 20.0,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
@@ -4,4 +4,8 @@ from . import views
 urlpatterns = [
     path("calculadora/", views.form_view, name="biocalc_form"),
     path("api/biocalculadora/estimate/", views.EstimateBiogasAPIView.as_view(), name="biocalc_estimate_api"),
+    path("api/biocalculadora/estimate/batch/", views.EstimateBatchAPIView.as_view(), name="biocalc_estimate_batch_api"),
+    path("api/biocalculadora/forecast/", views.ForecastAPIView.as_view(), name="biocalc_forecast_api"),
+    path("api/biocalculadora/calculations/<int:calc_id>/", views.CalculationSeriesAPIView.as_view(), name="biocalc_calculation_api"),
+    path("api/biocalculadora/optimize/", views.RecipeOptimizerAPIView.as_view(), name="biocalc_optimize_api"),
 ]
\ No newline at end of file
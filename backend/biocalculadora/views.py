@@ -1,6 +1,12 @@
 from django import forms
-from django.shortcuts import render
-from .calculators import estimate, estimate_timeseries_for_material
+from django.conf import settings
+from django.shortcuts import get_object_or_404, render
+from .calculators import BATCH_FIELDS, estimate, estimate_batch, grid_size, scenario_grid
+from .forecast import forecast_bands
+from .models import Calculation, Feedstock
+from .optimizer import feedstock_payloads, optimize_mix
+from .recipes import calculation_series
+from .series_cache import expected_series
 from .forms import CalcForm
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -58,7 +64,7 @@ class EstimateBiogasAPIView(APIView):
             HRT = float(HRT) if HRT not in (None, '',) else None
             target_fraction = float(data.get('target_fraction', 0.95))
 
-            series = estimate_timeseries_for_material(
+            series = expected_series(
                 material_type=material_type,
                 vs_kg_per_day=vs_per_day,
                 reactor_volume_m3=reactor_volume,
@@ -70,4 +76,165 @@ class EstimateBiogasAPIView(APIView):
         except (ValueError, KeyError) as e:
             return Response({"detail": f"Entrada inválida: {e}"}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            return Response({"detail": f"Error interno: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({"detail": f"Error interno: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def _optional_float(value):
+    return float(value) if value not in (None, '',) else None
+
+
+class EstimateBatchAPIView(APIView):
+    """
+    API: evalúa muchos escenarios en una sola llamada (resultado en columnas).
+    Body: scenarios: [{material_type, vs_per_day, temperature, HRT, reactor_volume}, ...]
+          o grid: {material_type: [...], vs_per_day: [...], temperature: [...], HRT: [...], reactor_volume: [...]}
+          (producto cartesiano). Opcionales: target_fraction, max_days, include_series,
+          vs_cost_per_kg, water_cost_per_m3, water_m3_per_day, additives_cost_per_day.
+    """
+    def post(self, request):
+        try:
+            data = request.data
+            if data.get('grid') is not None:
+                grid = {name: data['grid'].get(name) for name in BATCH_FIELDS}
+                count = grid_size(**grid)
+            else:
+                scenarios = data.get('scenarios') or []
+                if not isinstance(scenarios, list):
+                    raise ValueError("scenarios debe ser una lista")
+                count = len(scenarios)
+            if count == 0:
+                return Response({"detail": "Se requiere scenarios o grid"}, status=status.HTTP_400_BAD_REQUEST)
+            # Se controla antes de armar el producto cartesiano
+            max_scenarios = getattr(settings, 'BIOCALC_BATCH_MAX_SCENARIOS', 5000)
+            if count > max_scenarios:
+                return Response({"detail": f"Máximo {max_scenarios} escenarios por llamada"}, status=status.HTTP_400_BAD_REQUEST)
+            if data.get('grid') is not None:
+                columns = scenario_grid(**grid)
+            else:
+                columns = {name: [sc.get(name) for sc in scenarios] for name in BATCH_FIELDS}
+
+            result = estimate_batch(
+                material_type=[str(m or 'bovino') for m in columns['material_type']],
+                vs_per_day=[float(v) for v in columns['vs_per_day']],
+                temperature=[_optional_float(v) for v in columns['temperature']],
+                HRT=[_optional_float(v) for v in columns['HRT']],
+                reactor_volume=[_optional_float(v) for v in columns['reactor_volume']],
+                target_fraction=float(data.get('target_fraction', 0.95)),
+                max_days=int(data.get('max_days', 120)),
+                include_series=str(data.get('include_series', '')).lower() in ('1', 'true', 'yes'),
+                vs_cost_per_kg=float(data.get('vs_cost_per_kg', 0.0)),
+                water_cost_per_m3=float(data.get('water_cost_per_m3', 0.0)),
+                water_m3_per_day=float(data.get('water_m3_per_day', 0.0)),
+                additives_cost_per_day=float(data.get('additives_cost_per_day', 0.0)),
+            )
+            return Response(result, status=status.HTTP_200_OK)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return Response({"detail": f"Entrada inválida: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({"detail": f"Error interno: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ForecastAPIView(APIView):
+    """
+    API: pronóstico Monte Carlo con bandas de percentiles (P10/P50/P90).
+    Params: material_type, vs_per_day, temperature, reactor_volume (opcional), HRT (opcional),
+            samples (por defecto 10000), seed, horizon_days (hasta BIOCALC_FORECAST_MAX_DAYS),
+            percentiles (lista, entre 0 y 100),
+            uncertainty ({"Y": {"dist": "normal", "cv": 0.15}, ...}, ver forecast.DEFAULT_UNCERTAINTY)
+    """
+    def post(self, request):
+        try:
+            data = request.data
+            samples = int(data.get('samples', 10000))
+            max_samples = getattr(settings, 'BIOCALC_FORECAST_MAX_SAMPLES', 20000)
+            if samples > max_samples:
+                return Response({"detail": f"Máximo {max_samples} muestras"}, status=status.HTTP_400_BAD_REQUEST)
+            seed = data.get('seed')
+            horizon = data.get('horizon_days')
+            horizon = int(horizon) if horizon not in (None, '') else None
+            # La matriz del Monte Carlo es días x muestras
+            max_days = getattr(settings, 'BIOCALC_FORECAST_MAX_DAYS', 365)
+            if horizon is not None and horizon > max_days:
+                return Response({"detail": f"Máximo {max_days} días de horizonte"}, status=status.HTTP_400_BAD_REQUEST)
+            result = forecast_bands(
+                material_type=str(data.get('material_type', 'bovino')).lower(),
+                vs_kg_per_day=float(data.get('vs_per_day')),
+                reactor_volume_m3=_optional_float(data.get('reactor_volume')),
+                temperature_c=float(data.get('temperature', 35.0)),
+                samples=samples,
+                seed=int(seed) if seed not in (None, '') else None,
+                uncertainty=data.get('uncertainty') or None,
+                percentiles=[float(p) for p in data.get('percentiles') or (10, 50, 90)],
+                horizon_days=horizon,
+                HRT_days=_optional_float(data.get('HRT')),
+            )
+            return Response(result, status=status.HTTP_200_OK)
+        except (ValueError, KeyError, TypeError) as e:
+            return Response({"detail": f"Entrada inválida: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({"detail": f"Error interno: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class CalculationSeriesAPIView(APIView):
+    """
+    API: mezcla (TS, VS, C:N, potencial) y serie esperada de un Calculation
+    guardado, total y por ingrediente. Query params: max_days (opcional).
+    """
+    def get(self, request, calc_id):
+        calc = get_object_or_404(Calculation, pk=calc_id)
+        try:
+            max_days = int(request.query_params.get('max_days', 120))
+        except ValueError as e:
+            return Response({"detail": f"Entrada inválida: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(calculation_series(calc, max_days=max_days), status=status.HTTP_200_OK)
+
+
+class RecipeOptimizerAPIView(APIView):
+    """
+    API: mezcla diaria más barata de materias primas que cumple un objetivo.
+    Body: feedstocks: [id, ...] o [{id, max_kg_per_day, cost_per_kg}, ...],
+          target_biogas (m3/día), digester_volume (m3). Opcionales: cn_min, cn_max,
+          retention_time, water_ratio, temperature, vs_cost_per_kg, water_cost_per_m3,
+          additives_cost_per_day, steps (niveles de la grilla), time_limit_ms, alternatives.
+    """
+    def post(self, request):
+        try:
+            data = request.data
+            overrides = {}
+            for entry in data.get('feedstocks') or []:
+                if isinstance(entry, dict):
+                    overrides[int(entry['id'])] = {
+                        'max_kg_per_day': _optional_float(entry.get('max_kg_per_day')),
+                        'cost_per_kg': _optional_float(entry.get('cost_per_kg')),
+                    }
+                else:
+                    overrides[int(entry)] = {}
+            feedstocks = feedstock_payloads(Feedstock.objects.filter(id__in=overrides), overrides)
+            missing = set(overrides) - {f['id'] for f in feedstocks}
+            if not feedstocks or missing:
+                return Response({"detail": f"Materias primas inexistentes o vacías: {sorted(missing)}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            max_time = getattr(settings, 'RECIPE_OPTIMIZER_TIME_LIMIT', 0.8)
+            time_limit = min(float(data.get('time_limit_ms', max_time * 1000.0)) / 1000.0, max_time)
+            result = optimize_mix(
+                feedstocks,
+                target_biogas=float(data.get('target_biogas')),
+                volume=float(data.get('digester_volume')),
+                cn_min=float(data.get('cn_min', 20.0)),
+                cn_max=float(data.get('cn_max', 30.0)),
+                retention=float(data.get('retention_time', 30.0)),
+                water_ratio=float(data.get('water_ratio', 1.0)),
+                temperature=float(data.get('temperature', 35.0)),
+                vs_cost_per_kg=float(data.get('vs_cost_per_kg', 0.0)),
+                water_cost_per_m3=float(data.get('water_cost_per_m3', 0.0)),
+                additives_cost_per_day=float(data.get('additives_cost_per_day', 0.0)),
+                steps=int(data.get('steps', 11)),
+                time_limit=time_limit,
+                alternatives=int(data.get('alternatives', 5)),
+            )
+            return Response(result, status=status.HTTP_200_OK)
+        except (ValueError, KeyError, TypeError) as e:
+            return Response({"detail": f"Entrada inválida: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({"detail": f"Error interno: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
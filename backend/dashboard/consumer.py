@@ -1,130 +1,103 @@
 import asyncio
 import json
-import os
+import zlib
 from channels.generic.websocket import AsyncWebsocketConsumer
-import paho.mqtt.client as mqtt
-from django.utils import timezone
-from .models import FillingStage, SensorReading, Alert
+from .frames import FrameEncoder, check_aggregate, requested_encoding
+from .ingest import get_ingest_service, ingest_embedded
+from .replay import REPLAY_CHANNEL, replay_request
+from .report_jobs import REPORT_GROUP
+from .streams import ALERT_GROUP, StreamOutbox, parse_subscription, requested_groups
+
 
 class MQTTWebSocketConsumer(AsyncWebsocketConsumer):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.mqtt_client = None
-        self._event_loop = None
+    """Reenvía al navegador las lecturas publicadas por el servicio de ingesta.
+
+    No abre conexiones MQTT propias: se une a los grupos de lecturas (ver
+    ``dashboard/streams.py``; ``?stage=<id>`` y ``&sensors=a,b`` filtran) y
+    recibe cada mensaje una sola vez, sin importar cuántas pestañas estén
+    abiertas. Las lecturas salen agrupadas, a lo sumo un frame por tick; con
+    ``{"type": "subscribe", "sensors": [...], "max_rate": 1, "aggregate":
+    "mean"}`` el cliente elige sensores, tasa y agregación por ventana.
+    También recibe alertas y el avance de los trabajos de reportes
+    (``REPORT_GROUP``). Con ``?replay=1`` recibe al conectarse los últimos
+    minutos de lecturas en un solo frame (ver ``dashboard/replay.py``), y
+    con ``?encoding=msgpack|packed`` las lecturas llegan en frames binarios
+    compactos (ver ``dashboard/frames.py``).
+    """
 
     async def connect(self):
-        print("PASO 1: WebSocket intentando conectar...")
         await self.accept()
-        print("PASO 1: WebSocket CONECTADO")
-        
-        self._event_loop = asyncio.get_event_loop()
-        
-        self.mqtt_client = mqtt.Client()
-        self.mqtt_client.on_connect = self._on_mqtt_connect
-        self.mqtt_client.on_message = self._on_mqtt_message
-        
-        try:
-            print("PASO 2: Conectando a MQTT...")
-            broker_host = os.getenv("MQTT_BROKER_HOST", "mosquitto")
-            broker_port = int(os.getenv("MQTT_BROKER_PORT", "1883"))
-            self.mqtt_client.connect(broker_host, broker_port, 60)
-            self.mqtt_client.loop_start()
-            print("PASO 2: MQTT loop iniciado")
-        except Exception as e:
-            print(f"Error MQTT: {e}")
+        self.groups_joined = []
+        self.outbox = StreamOutbox(self._send_frame)
+        self.encoder = FrameEncoder(requested_encoding(self.scope.get('query_string', b'')))
+        if self.encoder.encoding == 'packed':
+            await self._send_to_websocket(self.encoder.schema())
+        if self.channel_layer is None:
+            print("CHANNEL_LAYERS no configurado: el WebSocket no recibirá lecturas")
+            return
+        self.groups_joined = requested_groups(self.scope.get('query_string', b'')) + [ALERT_GROUP, REPORT_GROUP]
+        for group in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        if ingest_embedded():
+            get_ingest_service().ensure_started(asyncio.get_running_loop())
+        request = replay_request(self.scope.get('query_string', b''), self.channel_name)
+        if request is not None:
+            self.replay_compress = request.pop('compress')
+            await self.channel_layer.send(REPLAY_CHANNEL, request)
 
     async def disconnect(self, close_code):
-        print("WebSocket desconectado")
-        if self.mqtt_client:
-            self.mqtt_client.loop_stop()
-
-    def _on_mqtt_connect(self, client, userdata, flags, rc):
-        print(f"PASO 3: Callback MQTT connect, codigo: {rc}")
-        if rc == 0:
-            print("PASO 3: MQTT CONECTADO al broker")
-            client.subscribe("Prueba")
-            print("SUSCRITO al topic 'Prueba'")
-        else:
-            print(f"MQTT connection failed: {rc}")
+        self.outbox.close()
+        if self.channel_layer is not None:
+            for group in self.groups_joined:
+                await self.channel_layer.group_discard(group, self.channel_name)
 
-    def _on_mqtt_message(self, client, userdata, msg):
-        print(f"PASO 4: Mensaje MQTT RECIBIDO - Topic: {msg.topic}")
-        print(f"Payload: {msg.payload}")
-        
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(msg.payload.decode())
-            print(f"JSON parseado: {data}")
-            
-            # Enviar todos los campos numéricos del mensaje MQTT
-            filtered_data = {
-                'type': 'sensor_data'
-            }
-            
-            # Agregar todos los campos numéricos del mensaje MQTT
-            for key, value in data.items():
-                if isinstance(value, (int, float)):
-                    filtered_data[key] = value
+            data = json.loads(text_data or '')
+            if data.get('type') == 'subscribe':
+                subscription = parse_subscription(data)
+                encoding = subscription.pop('encoding') or self.encoder.encoding
+                check_aggregate(encoding, subscription['aggregate'])
+                self.outbox.subscribe(**subscription)
+                if encoding != self.encoder.encoding:
+                    self.encoder = FrameEncoder(encoding, subscription['sensors'] or ())
+                await self._send_to_websocket({'type': 'subscribed', **subscription, 'encoding': encoding})
+                if encoding == 'packed':
+                    await self._send_to_websocket(self.encoder.schema())
+        except (ValueError, AttributeError) as e:
+            await self._send_to_websocket({'type': 'error', 'data': f"Mensaje inválido: {e}"})
 
-            # Persistencia en DB (si hay etapa activa)
-            try:
-                stage = FillingStage.objects.filter(active=True).order_by('-created_at').first()
-                if stage is not None:
-                    pressure = None
-                    if 'presion' in data:
-                        # Los ejemplos vienen en hPa (p.ej. 1006.65)
-                        pressure = float(data.get('presion'))
-                    biol_flow = None
-                    gas_flow = None
-                    # Opcionales: caudalímetros si existen en payload
-                    for k in ['caudal_biol', 'biol_flow']:
-                        if k in data and isinstance(data[k], (int, float)):
-                            biol_flow = float(data[k])
-                            break
-                    for k in ['caudal_gas', 'gas_flow']:
-                        if k in data and isinstance(data[k], (int, float)):
-                            gas_flow = float(data[k])
-                            break
+    async def sensor_message(self, event):
+        self.outbox.put(event['data'], event.get('window'))
 
-                    SensorReading.objects.create(
-                        stage=stage,
-                        timestamp=timezone.now(),
-                        pressure_hpa=pressure,
-                        biol_flow=biol_flow,
-                        gas_flow=gas_flow,
-                        raw_payload=data
-                    )
+    async def replay_batch(self, event):
+        if not self.replay_compress:
+            await self._send_to_websocket(event['data'])
+            return
+        try:
+            await self.send(bytes_data=zlib.compress(json.dumps(event['data']).encode('utf-8')))
+        except Exception as e:
+            print(f"Error enviando WebSocket: {e}")
+
+    async def sensor_alert(self, event):
+        await self._send_to_websocket(event['data'])
 
-                    # Reglas simples de alerta (umbrales)
-                    alerts_to_emit = []
-                    try:
-                        if 'presion' in data:
-                            p = float(data['presion'])
-                            if p < 990 or p > 1015:
-                                a = Alert.objects.create(level='WARN', message='Presión fuera de rango', details={'presion': p})
-                                alerts_to_emit.append({'id': a.id, 'message': a.message, 'level': a.level})
-                        if 'temperatura' in data:
-                            t = float(data['temperatura'])
-                            if t < 20 or t > 45:
-                                a = Alert.objects.create(level='WARN', message='Temperatura fuera de rango', details={'temperatura': t})
-                                alerts_to_emit.append({'id': a.id, 'message': a.message, 'level': a.level})
-                    except Exception as _:
-                        pass
-            except Exception as db_err:
-                print(f"Error guardando lectura de sensor: {db_err}")
+    async def report_job(self, event):
+        await self._send_to_websocket(event['data'])
 
-            print(f"PASO 5: Enviando via WebSocket: {filtered_data}")
-            
-            asyncio.run_coroutine_threadsafe(self._send_to_websocket(filtered_data), self._event_loop)
-            # Emitir alertas si existen
-            for a in alerts_to_emit:
-                asyncio.run_coroutine_threadsafe(self._send_to_websocket({'type': 'alert', **a}), self._event_loop)
-            
+    async def _send_frame(self, frame):
+        """Frame de lecturas en la codificación negociada."""
+        try:
+            for kind, payload in self.encoder.encode(frame):
+                if kind == 'text':
+                    await self.send(text_data=payload)
+                else:
+                    await self.send(bytes_data=payload)
         except Exception as e:
-            print(f"Error: {e}")
+            print(f"Error enviando WebSocket: {e}")
 
     async def _send_to_websocket(self, data):
         try:
             await self.send(text_data=json.dumps(data))
-            print("PASO 6: Mensaje ENVIADO via WebSocket")
         except Exception as e:
             print(f"Error enviando WebSocket: {e}")
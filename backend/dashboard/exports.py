@@ -0,0 +1,193 @@
+"""Exportación de lecturas: CSV en streaming y Parquet.
+
+Las filas se leen en bloques con ``iterator(chunk_size)`` (cursor del lado
+del servidor en PostgreSQL) y se escriben a la respuesta a medida que llegan,
+así que exportar un año de lecturas crudas usa memoria constante y el primer
+byte sale de inmediato.
+
+Granularidades:
+
+- ``raw``: una fila por lectura (``SensorReading``).
+- ``hour`` / ``day``: una fila por etapa e intervalo (``SensorRollup``). Los
+  intervalos se exportan completos: los de los extremos pueden incluir
+  lecturas fuera del rango pedido.
+
+Con ``gzip`` la salida se comprime al vuelo (archivo ``.csv.gz``).
+
+Las lecturas crudas también se exportan a Parquet (``write_parquet``, con
+``pyarrow`` opcional): columnas tipadas, un row group por bloque leído y
+compresión zstd.
+"""
+import csv
+import io
+import zlib
+from datetime import datetime, timedelta, timezone as dt_timezone
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+
+from .models import SensorReading, SensorRollup
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+GRANULARITIES = ('raw', 'hour', 'day')
+
+RAW_COLUMNS = (
+    'timestamp', 'stage_id', 'pressure_hpa', 'temperature_c', 'humidity_pct', 'quality_pct',
+    'gas_flow', 'gas_total_m3', 'gas_rate_m3h', 'gas_rate_lmin', 'biol_flow',
+)
+ROLLUP_COLUMNS = (
+    'bucket_start', 'stage_id', 'gas_m3', 'biol_m3',
+    'pressure_min', 'pressure_max', 'pressure_avg',
+    'temperature_min', 'temperature_max', 'temperature_avg',
+    'count', 'last_reading_at',
+)
+
+
+def _utc(moment) -> datetime:
+    # Las vistas trabajan con instantes naive en UTC (TIME_ZONE = 'UTC')
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=dt_timezone.utc)
+    return moment
+
+
+def export_queryset(granularity, start, end, stage=None):
+    """(columnas, queryset de tuplas) de la granularidad entre dos instantes."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Granularidad inválida: {granularity}")
+    start, end = _utc(start), _utc(end)
+    if granularity == 'raw':
+        columns = RAW_COLUMNS
+        qs = SensorReading.objects.filter(timestamp__gte=start, timestamp__lte=end).order_by('timestamp', 'id')
+    else:
+        columns = ROLLUP_COLUMNS
+        # Incluir el intervalo que contiene ``start``
+        span = timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+        qs = SensorRollup.objects.filter(
+            granularity=granularity, bucket_start__gt=start - span, bucket_start__lte=end,
+        ).order_by('bucket_start', 'stage_id')
+    if stage is not None:
+        qs = qs.filter(stage=stage)
+    return columns, qs.values_list(*columns)
+
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.astimezone(dt_timezone.utc).isoformat()
+    return value
+
+
+def iter_csv(columns, rows, chunk_size=None):
+    """Bloques de texto CSV: primero el encabezado y luego ``chunk_size``
+    filas por bloque."""
+    chunk_size = chunk_size or getattr(settings, 'READING_CHUNK_SIZE', 5000)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, chunk_size))
+        if not batch:
+            return
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_cell(value) for value in row] for row in batch)
+        yield buffer.getvalue()
+
+
+def iter_encoded(chunks, compress=False):
+    """Codifica en UTF-8 y, con ``compress``, en gzip bloque a bloque."""
+    if not compress:
+        for chunk in chunks:
+            yield chunk.encode('utf-8')
+        return
+    gz = zlib.compressobj(wbits=31)  # 16 + 15: formato gzip
+    for chunk in chunks:
+        # SYNC_FLUSH: cada bloque sale completo sin esperar al siguiente
+        yield gz.compress(chunk.encode('utf-8')) + gz.flush(zlib.Z_SYNC_FLUSH)
+    yield gz.flush()
+
+
+async def _aiter(iterator):
+    # El cursor se recorre siempre en el mismo hilo (thread_sensitive)
+    done = object()
+    while True:
+        chunk = await sync_to_async(next, thread_sensitive=True)(iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+
+def streaming_csv_response(request, granularity, start, end, filename, stage=None, compress=False):
+    """``StreamingHttpResponse`` con el CSV de ``export_queryset``.
+
+    En ASGI (daphne) se entrega un iterador asíncrono: con uno síncrono Django
+    lee todo el contenido antes de enviarlo.
+    """
+    columns, rows = export_queryset(granularity, start, end, stage=stage)
+    chunk_size = getattr(settings, 'READING_CHUNK_SIZE', 5000)
+    content = iter_encoded(iter_csv(columns, rows.iterator(chunk_size=chunk_size), chunk_size), compress)
+    if hasattr(request, 'scope'):
+        content = _aiter(content)
+    if compress:
+        response = StreamingHttpResponse(content, content_type='application/gzip')
+        filename = f'{filename}.csv.gz'
+    else:
+        response = StreamingHttpResponse(content, content_type='text/csv; charset=utf-8')
+        filename = f'{filename}.csv'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def wants_gzip(request) -> bool:
+    return request.query_params.get('gzip', '').lower() in ('1', 'true', 'yes')
+
+
+def parquet_schema():
+    """Tipos de ``RAW_COLUMNS`` en Parquet (los nulos se conservan)."""
+    return pa.schema(
+        [('timestamp', pa.timestamp('us', tz='UTC')), ('stage_id', pa.int64())]
+        + [(name, pa.float64()) for name in RAW_COLUMNS[2:]]
+    )
+
+
+def write_parquet(dest, start=None, end=None, stage=None, chunk_size=None, compression='zstd') -> int:
+    """Escribe las lecturas crudas en ``dest`` (ruta o archivo binario).
+
+    Lee por bloques de ``chunk_size`` y escribe cada bloque como un row group,
+    así la memoria no depende del rango. Devuelve la cantidad de lecturas.
+    """
+    if pq is None:
+        raise RuntimeError("pyarrow no está instalado")
+    chunk_size = chunk_size or getattr(settings, 'READING_CHUNK_SIZE', 5000)
+    qs = SensorReading.objects.all()
+    if start is not None:
+        qs = qs.filter(timestamp__gte=_utc(start))
+    if end is not None:
+        qs = qs.filter(timestamp__lte=_utc(end))
+    if stage is not None:
+        qs = qs.filter(stage=stage)
+    rows = qs.order_by('timestamp', 'id').values_list(*RAW_COLUMNS).iterator(chunk_size=chunk_size)
+
+    schema = parquet_schema()
+    total = 0
+    with pq.ParquetWriter(dest, schema, compression=compression) as writer:
+        while True:
+            batch = list(islice(rows, chunk_size))
+            if not batch:
+                break
+            columns = [list(column) for column in zip(*batch)]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema,
+            ))
+            total += len(batch)
+    return total
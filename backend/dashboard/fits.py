@@ -0,0 +1,122 @@
+"""Calibración de la curva de Gompertz de cada etapa con datos reales.
+
+Se ajusta (A, mu_g, lam) al acumulado diario de los rollups, sólo con días
+completos (UTC): el acumulado al cierre del día ``i`` corresponde a
+G(i + 1). El ajuste queda guardado en ``GompertzFit`` y sólo se repite
+cuando hay un día completo nuevo con lecturas nuevas (una etapa cerrada no
+se vuelve a ajustar), partiendo del ajuste anterior (o, en una etapa nueva,
+de lo observado en etapas del mismo material).
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from statistics import median
+
+import numpy as np
+from django.db.models import Max, Sum
+
+from biocalculadora.fitting import fit_gompertz, predict_cumulative
+
+from .models import GompertzFit, SensorRollup
+from .rollups import stage_production_series
+
+
+def _last_complete_day(now=None):
+    return (now or datetime.now(dt_timezone.utc)).date() - timedelta(days=1)
+
+
+def material_prior(material_type, amount_kg, exclude_stage=None):
+    """Parámetros iniciales a partir de los ajustes de otras etapas del mismo
+    material, escalados por la cantidad cargada (None si no hay)."""
+    fits = GompertzFit.objects.filter(material_type=material_type, converged=True)
+    if exclude_stage is not None:
+        fits = fits.exclude(stage=exclude_stage)
+    rows = [(f.A_m3 / f.material_amount_kg, f.mu_g / f.A_m3, f.lag_days)
+            for f in fits if f.material_amount_kg > 0 and f.A_m3 > 0]
+    if not rows or not amount_kg:
+        return None
+    A = median(r[0] for r in rows) * amount_kg
+    return {"A": A, "mu_g": median(r[1] for r in rows) * A, "lam": median(r[2] for r in rows)}
+
+
+def observed_cumulative(stage, last_day):
+    """(t, acumulado) de los días completos de la etapa hasta ``last_day``."""
+    start = stage.created_at
+    end = datetime.combine(last_day, time.max, tzinfo=dt_timezone.utc)
+    if end < start:
+        return np.array([]), np.array([])
+    series = stage_production_series(stage, start, end)
+    return np.asarray(series["days"]) + 1.0, np.asarray(series["cumulative_biogas_m3"])
+
+
+def readings_marker(stage, last_day):
+    """(última lectura, cantidad de lecturas) de la etapa hasta ``last_day``,
+    según los rollups horarios."""
+    end = datetime.combine(last_day, time.max, tzinfo=dt_timezone.utc)
+    totals = SensorRollup.objects.filter(stage=stage, granularity="hour", bucket_start__lte=end).aggregate(
+        last=Max("last_reading_at"), n=Sum("count"),
+    )
+    return totals["last"], totals["n"] or 0
+
+
+def refit_stage(stage, force=False, now=None):
+    """Ajuste vigente de la etapa; lo recalcula sólo si hay días nuevos con
+    lecturas nuevas.
+
+    Devuelve el ``GompertzFit`` o None si todavía no hay datos suficientes.
+    """
+    fit = GompertzFit.objects.filter(stage=stage).first()
+    last_day = _last_complete_day(now)
+    if fit is not None and fit.last_day >= last_day and not force:
+        return fit
+    last_reading_at, n_readings = readings_marker(stage, last_day)
+    if fit is not None and not force and (fit.last_reading_at, fit.n_readings) == (last_reading_at, n_readings):
+        # Sin lecturas nuevas desde el ajuste: no se recalcula ni se escribe
+        return fit
+
+    t, y = observed_cumulative(stage, last_day)
+    if fit is not None:
+        initial = {"A": fit.A_m3, "mu_g": fit.mu_g, "lam": fit.lag_days}
+    else:
+        initial = material_prior(stage.material_type, stage.material_amount_kg, exclude_stage=stage)
+    result = fit_gompertz(t, y, initial=initial)
+    if initial is not None and (result is None or not result["converged"]):
+        # Punto de partida malo: probar desde la estimación inicial de los datos
+        cold = fit_gompertz(t, y)
+        if cold is not None and (result is None or cold["rmse"] < result["rmse"]):
+            result = cold
+    if result is None:
+        return fit
+
+    values = {
+        "material_type": stage.material_type,
+        "material_amount_kg": stage.material_amount_kg,
+        "A_m3": result["A"],
+        "mu_g": result["mu_g"],
+        "lag_days": result["lam"],
+        "rmse": result["rmse"],
+        "n_days": result["n"],
+        "last_day": last_day,
+        "last_reading_at": last_reading_at,
+        "n_readings": n_readings,
+        "iterations": result["iterations"],
+        "converged": result["converged"],
+    }
+    fit, _created = GompertzFit.objects.update_or_create(stage=stage, defaults=values)
+    return fit
+
+
+def fit_payload(fit, horizon_days) -> dict:
+    """Parámetros y acumulado previsto al cierre de cada día (mismo eje que
+    la serie real: día ``i`` -> G(i + 1))."""
+    days = list(range(int(horizon_days)))
+    return {
+        "A_m3": fit.A_m3,
+        "mu_g": fit.mu_g,
+        "lag_days": fit.lag_days,
+        "rmse": fit.rmse,
+        "n_days": fit.n_days,
+        "last_day": fit.last_day.isoformat(),
+        "converged": fit.converged,
+        "fitted_at": fit.fitted_at.isoformat() if fit.fitted_at else None,
+        "days": days,
+        "cumulative_biogas_m3": predict_cumulative([d + 1 for d in days], fit.A_m3, fit.mu_g, fit.lag_days),
+    }
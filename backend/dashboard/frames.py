@@ -0,0 +1,168 @@
+"""Codificación de los frames de lecturas enviados por WebSocket.
+
+El cliente la elige con ``?encoding=`` o en el mensaje ``subscribe``:
+
+- ``json`` (por defecto): texto, como siempre.
+- ``msgpack``: el mismo objeto en MessagePack, frame binario (requiere el
+  paquete ``msgpack``).
+- ``packed``: frame binario de esquema fijo. Los nombres de los sensores se
+  mandan una sola vez en un mensaje ``schema`` (texto JSON, se reenvía sólo
+  cuando aparece un sensor nuevo, que se agrega al final). Cada frame es::
+
+      <BBIIdHH  versión, tipo (1 = sensor_data), etapa (0xFFFFFFFF = ninguna),
+                seq, timestamp (epoch en segundos), lecturas, descartados
+      máscara   ceil(n / 8) bytes, bit i = hay valor para el campo i
+      valores   float32 de los campos presentes, en el orden del esquema
+
+  float32 conserva unos 7 dígitos significativos (p.ej. 1006.65 hPa).
+
+Los mensajes de control (alertas, reportes, errores, historial) siguen
+siendo JSON.
+"""
+import json
+import math
+import struct
+from datetime import datetime
+from urllib.parse import parse_qs
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+PACKED_VERSION = 1
+PACKED_HEADER = struct.Struct('<BBIIdHH')
+KIND_SENSOR_DATA = 1
+NO_STAGE = 0xFFFFFFFF
+_UINT16 = 0xFFFF
+
+
+def available_encodings() -> tuple:
+    return ('json', 'msgpack', 'packed') if msgpack is not None else ('json', 'packed')
+
+
+def requested_encoding(query_string) -> str:
+    """Codificación pedida con ``?encoding=`` (json si falta o no existe)."""
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode('latin-1')
+    encoding = (parse_qs(query_string or '').get('encoding') or ['json'])[0]
+    return encoding if encoding in available_encodings() else 'json'
+
+
+def check_aggregate(encoding, aggregate):
+    # packed sólo lleva un valor por sensor
+    if encoding == 'packed' and aggregate == 'all':
+        raise ValueError("aggregate 'all' no está disponible con encoding packed")
+
+
+def _numeric_fields(message) -> dict:
+    # type() y no isinstance(): deja afuera bool y es más rápido por frame
+    return {k: v for k, v in message.items() if type(v) is float or type(v) is int}
+
+
+def _epoch(timestamp) -> float:
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return math.nan
+
+
+_FLOAT_STRUCTS = {}
+
+
+def _floats(count) -> struct.Struct:
+    packer = _FLOAT_STRUCTS.get(count)
+    if packer is None:
+        packer = _FLOAT_STRUCTS[count] = struct.Struct(f'<{count}f')
+    return packer
+
+
+class FrameEncoder:
+    """Codifica los frames ``sensor_data`` de un cliente.
+
+    ``encode`` devuelve la lista de (``'text'`` | ``'bytes'``, contenido) a
+    enviar en orden: en ``packed`` puede incluir antes un ``schema`` nuevo.
+    """
+
+    def __init__(self, encoding='json', fields=()):
+        if encoding not in available_encodings():
+            raise ValueError(f"encoding debe ser uno de {', '.join(available_encodings())}")
+        self.encoding = encoding
+        self.fields = []
+        self._index = {}
+        self._extend(fields)
+
+    def _extend(self, fields) -> bool:
+        added = False
+        for field in fields:
+            if field not in self._index:
+                self._index[field] = len(self.fields)
+                self.fields.append(field)
+                added = True
+        return added
+
+    def schema(self) -> dict:
+        return {
+            'type': 'schema',
+            'encoding': self.encoding,
+            'version': PACKED_VERSION,
+            'header': PACKED_HEADER.format,
+            'fields': list(self.fields),
+        }
+
+    def encode(self, message: dict, values=None) -> list:
+        """``values``: sensores del frame (por defecto, los campos numéricos)."""
+        if self.encoding == 'json':
+            return [('text', json.dumps(message))]
+        if self.encoding == 'msgpack':
+            return [('bytes', msgpack.packb(message))]
+        values = _numeric_fields(message) if values is None else values
+        out = []
+        if self._extend(values):
+            out.append(('text', json.dumps(self.schema())))
+        out.append(('bytes', self.pack(message, values)))
+        return out
+
+    def pack(self, message: dict, values: dict) -> bytes:
+        meta = message.get('meta') or {}
+        stage = meta.get('stage')
+        header = PACKED_HEADER.pack(
+            PACKED_VERSION,
+            KIND_SENSOR_DATA,
+            NO_STAGE if stage is None else int(stage),
+            int(meta.get('seq') or 0),
+            _epoch(message.get('timestamp')),
+            min(int(meta.get('readings') or 0), _UINT16),
+            min(int(meta.get('dropped') or 0), _UINT16),
+        )
+        index = self._index
+        slots = sorted((index[field], value) for field, value in values.items())
+        mask = 0
+        for i, _value in slots:
+            mask |= 1 << i
+        return b''.join((
+            header,
+            mask.to_bytes((len(self.fields) + 7) // 8, 'little'),
+            _floats(len(slots)).pack(*[value for _i, value in slots]),
+        ))
+
+
+def unpack(frame: bytes, fields) -> dict:
+    """Inversa de ``FrameEncoder.pack`` (pruebas y clientes Python)."""
+    version, kind, stage, seq, timestamp, readings, dropped = PACKED_HEADER.unpack_from(frame)
+    mask_size = (len(fields) + 7) // 8
+    mask = int.from_bytes(frame[PACKED_HEADER.size:PACKED_HEADER.size + mask_size], 'little')
+    names = [field for i, field in enumerate(fields) if mask >> i & 1]
+    values = dict(zip(names, struct.unpack_from(f'<{len(names)}f', frame, PACKED_HEADER.size + mask_size)))
+    return {
+        'version': version,
+        'kind': kind,
+        'stage': None if stage == NO_STAGE else stage,
+        'seq': seq,
+        'timestamp': timestamp,
+        'readings': readings,
+        'dropped': dropped,
+        'values': values,
+    }
@@ -0,0 +1,264 @@
+"""Servicio único de ingesta MQTT.
+
+Mantiene la única suscripción al broker por despliegue: cada mensaje se
+persiste una sola vez y luego se reparte a los WebSockets conectados a través
+de los grupos de Channels de ``dashboard/streams.py`` (agrupado por tick).
+Los consumidores ya no abren conexiones MQTT propias.
+
+Formas de ejecutarlo:
+
+- ``python manage.py mqtt_ingest``: proceso dedicado, uno solo por
+  despliegue. Es el modo por defecto con Redis (``CHANNEL_REDIS_URL``),
+  donde puede haber varios procesos Daphne.
+- Modo embebido (por defecto sin Redis, ``MQTT_INGEST_EMBEDDED``): el
+  proceso Daphne arranca el servicio al conectarse el primer WebSocket y lo
+  mantiene vivo aunque se desconecte. Sólo sirve con un único proceso.
+"""
+import asyncio
+import json
+import os
+import threading
+
+import paho.mqtt.client as mqtt
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+from .ingest_buffer import ReadingBuffer
+from .replay import serve_replay
+from .models import SensorReading, Alert
+from .stage_cache import get_active_stage
+from .streams import ALERT_GROUP, SENSOR_GROUP, StreamPublisher
+
+
+class MQTTIngestService:
+    """Cliente MQTT único que persiste y reparte las lecturas."""
+
+    def __init__(self, broker_host=None, broker_port=None, topic=None):
+        self.broker_host = broker_host or os.getenv("MQTT_BROKER_HOST", "mosquitto")
+        self.broker_port = int(broker_port or os.getenv("MQTT_BROKER_PORT", "1883"))
+        self.topic = topic or os.getenv("MQTT_SENSOR_TOPIC", "Prueba")
+        self.client = None
+        # Loop del servidor ASGI cuando corre embebido; None en proceso dedicado
+        self._event_loop = None
+        self._lock = threading.Lock()
+        # Las lecturas se guardan por lotes fuera del hilo de red de paho
+        self.buffer = ReadingBuffer(on_alerts=self._publish_alerts)
+        # Las lecturas se reparten agrupadas por tick, no una por una
+        self.stream = StreamPublisher(self._group_send_many)
+        self._replay_server = None
+
+    @property
+    def running(self) -> bool:
+        return self.client is not None
+
+    def _build_client(self):
+        client = mqtt.Client()
+        client.on_connect = self._on_mqtt_connect
+        client.on_message = self._on_mqtt_message
+        return client
+
+    def ensure_started(self, event_loop=None):
+        """Arranca el cliente en segundo plano si aún no está corriendo."""
+        with self._lock:
+            if self.client is not None:
+                return
+            self._event_loop = event_loop
+            self.buffer.start()
+            self.stream.start()
+            self._start_replay_server()
+            client = self._build_client()
+            try:
+                client.connect_async(self.broker_host, self.broker_port, 60)
+                client.loop_start()
+            except Exception as e:
+                print(f"Error MQTT: {e}")
+                return
+            self.client = client
+            print(f"Ingesta MQTT iniciada en {self.broker_host}:{self.broker_port} topic '{self.topic}'")
+
+    def run_forever(self):
+        """Bloquea el hilo actual procesando mensajes (comando de gestión)."""
+        with self._lock:
+            self.client = self._build_client()
+        self.buffer.start()
+        self.stream.start()
+        self._start_replay_server()
+        self.client.connect(self.broker_host, self.broker_port, 60)
+        self.client.loop_forever(retry_first_connection=True)
+
+    def stop(self):
+        with self._lock:
+            if self.client is None:
+                return
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.client = None
+            if self._replay_server is not None and hasattr(self._replay_server, 'cancel'):
+                self._replay_server.cancel()
+            self._replay_server = None
+        self.buffer.stop()
+        self.stream.stop()
+
+    def _start_replay_server(self):
+        """Atiende los pedidos de historial (``dashboard/replay.py``): en el loop
+        ASGI si corre embebido, si no en un hilo propio."""
+        channel_layer = get_channel_layer()
+        if channel_layer is None or self._replay_server is not None:
+            return
+        if self._event_loop is not None:
+            self._replay_server = asyncio.run_coroutine_threadsafe(
+                serve_replay(channel_layer, self.stream.replay), self._event_loop,
+            )
+        else:
+            self._replay_server = threading.Thread(
+                target=async_to_sync(serve_replay), args=(channel_layer, self.stream.replay),
+                name='sensor-replay', daemon=True,
+            )
+            self._replay_server.start()
+
+    def _on_mqtt_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            # Re-suscribir en cada reconexión
+            client.subscribe(self.topic)
+            print(f"Ingesta MQTT suscrita al topic '{self.topic}'")
+        else:
+            print(f"MQTT connection failed: {rc}")
+
+    def _on_mqtt_message(self, client, userdata, msg):
+        try:
+            data = json.loads(msg.payload.decode())
+        except Exception as e:
+            print(f"Payload MQTT inválido en '{msg.topic}': {e}")
+            return
+        if not isinstance(data, dict):
+            return
+        self.handle_payload(data)
+
+    def handle_payload(self, data: dict):
+        """Persiste un mensaje ya decodificado y lo reparte a los clientes."""
+        # Enviar todos los campos numéricos del mensaje MQTT
+        filtered_data = {'type': 'sensor_data'}
+        for key, value in data.items():
+            if isinstance(value, (int, float)):
+                filtered_data[key] = value
+
+        try:
+            self.persist(data)
+        except Exception as db_err:
+            print(f"Error guardando lectura de sensor: {db_err}")
+
+        stage = get_active_stage()
+        filtered_data.pop('type')
+        self.stream.add(stage.id if stage is not None else None, filtered_data)
+
+    def persist(self, data: dict) -> bool:
+        """Encola la lectura (y sus alertas) para la etapa activa.
+
+        Las alertas se publican cuando el lote se guarda y ya tienen id.
+        """
+        stage = get_active_stage()
+        if stage is None:
+            return False
+
+        pressure = None
+        if 'presion' in data:
+            # Los ejemplos vienen en hPa (p.ej. 1006.65)
+            pressure = float(data.get('presion'))
+        biol_flow = None
+        gas_flow = None
+        # Opcionales: caudalímetros si existen en payload
+        for k in ['caudal_biol', 'biol_flow']:
+            if k in data and isinstance(data[k], (int, float)):
+                biol_flow = float(data[k])
+                break
+        for k in ['caudal_gas', 'gas_flow']:
+            if k in data and isinstance(data[k], (int, float)):
+                gas_flow = float(data[k])
+                break
+
+        # Con SENSOR_STORE_RAW_PAYLOAD='irregular' sólo se guarda el JSON de los
+        # mensajes que no quedan completos en las columnas tipadas
+        raw_payload = data
+        if getattr(settings, 'SENSOR_STORE_RAW_PAYLOAD', 'always') == 'irregular' and SensorReading.is_well_formed(data):
+            raw_payload = None
+
+        reading = SensorReading(
+            stage=stage,
+            timestamp=timezone.now(),
+            pressure_hpa=pressure,
+            biol_flow=biol_flow,
+            gas_flow=gas_flow,
+            raw_payload=raw_payload,
+            **SensorReading.fields_from_payload(data)
+        )
+
+        # Reglas simples de alerta (umbrales)
+        alerts = []
+        try:
+            if 'presion' in data:
+                p = float(data['presion'])
+                if p < 990 or p > 1015:
+                    alerts.append(Alert(level='WARN', message='Presión fuera de rango', details={'presion': p}))
+            if 'temperatura' in data:
+                t = float(data['temperatura'])
+                if t < 20 or t > 45:
+                    alerts.append(Alert(level='WARN', message='Temperatura fuera de rango', details={'temperatura': t}))
+        except Exception:
+            pass
+        return self.buffer.put(reading, alerts)
+
+    def _publish_alerts(self, alerts):
+        self._group_send_many([
+            (ALERT_GROUP, {'type': 'sensor.alert', 'data': {'type': 'alert', 'id': a.id, 'message': a.message, 'level': a.level}})
+            for a in alerts
+        ])
+
+    def stats(self) -> dict:
+        """Métricas de la ingesta: profundidad de cola y latencia de vaciado."""
+        return {
+            'running': self.running,
+            'broker': f"{self.broker_host}:{self.broker_port}",
+            'topic': self.topic,
+            **self.buffer.stats(),
+        }
+
+    def publish(self, data: dict, group=SENSOR_GROUP):
+        """Envía un mensaje al grupo de WebSockets sin bloquear el hilo MQTT."""
+        self._group_send_many([(group, {'type': 'sensor.message', 'data': data})])
+
+    def _group_send_many(self, messages):
+        """Envía (grupo, evento) en orden; en modo embebido, en el loop ASGI."""
+        channel_layer = get_channel_layer()
+        if channel_layer is None or not messages:
+            return
+
+        async def send_all():
+            for group, event in messages:
+                await channel_layer.group_send(group, event)
+
+        try:
+            if self._event_loop is not None:
+                asyncio.run_coroutine_threadsafe(send_all(), self._event_loop)
+            else:
+                async_to_sync(send_all)()
+        except Exception as e:
+            print(f"Error repartiendo mensaje a WebSockets: {e}")
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_ingest_service() -> MQTTIngestService:
+    """Devuelve la instancia única del servicio para este proceso."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = MQTTIngestService()
+        return _service
+
+
+def ingest_embedded() -> bool:
+    return getattr(settings, 'MQTT_INGEST_EMBEDDED', True)
@@ -0,0 +1,188 @@
+"""Buffer de escritura por lotes para la ingesta de lecturas.
+
+El hilo de red de paho sólo encola; un hilo aparte vacía la cola con
+``bulk_create`` cuando se junta ``batch_size`` filas o pasa
+``flush_interval`` segundos, lo que ocurra primero, y actualiza los rollups
+(``dashboard/rollups.py``) con el mismo lote. Si la base de datos se
+atrasa la cola se llena y ``put`` bloquea al productor (contrapresión hacia
+el broker); pasado ``put_timeout`` la lectura se descarta y se contabiliza.
+
+``bulk_create`` no pasa por ``SensorReading.save()``, así que el vaciado
+repite su control: las lecturas de etapas que ya no están activas (cerradas
+durante el TTL de ``stage_cache`` o vistas desde otro proceso) se descartan.
+"""
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Alert, FillingStage, SensorReading
+from .rollups import update_rollups
+
+
+# Despierta al hilo de vaciado al detenerse
+_STOP = object()
+
+
+class ReadingBuffer:
+    """Cola acotada de lecturas (y sus alertas) con vaciado periódico."""
+
+    def __init__(self, batch_size=None, flush_interval=None, max_queue=None, put_timeout=None, on_alerts=None):
+        self.batch_size = batch_size or getattr(settings, 'INGEST_BATCH_SIZE', 500)
+        self.flush_interval = flush_interval or getattr(settings, 'INGEST_FLUSH_INTERVAL', 1.0)
+        self.max_queue = max_queue or getattr(settings, 'INGEST_MAX_QUEUE', 10000)
+        self.put_timeout = put_timeout if put_timeout is not None else getattr(settings, 'INGEST_PUT_TIMEOUT', 5.0)
+        # Callback con las alertas ya guardadas (con id) tras cada vaciado
+        self.on_alerts = on_alerts
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'rows_flushed': 0,
+            'batches_flushed': 0,
+            'dropped': 0,
+            'closed_stage_dropped': 0,
+            'flush_errors': 0,
+            'rollup_errors': 0,
+            'last_batch_size': 0,
+            'last_flush_ms': None,
+            'avg_flush_ms': None,
+            'max_flush_ms': None,
+            'last_flush_at': None,
+        }
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='reading-buffer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Detiene el hilo tras vaciar lo pendiente."""
+        self._stop.set()
+        try:
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def put(self, reading: SensorReading, alerts=None) -> bool:
+        """Encola una lectura sin guardar. Devuelve False si se descartó."""
+        try:
+            self._queue.put((reading, alerts or []), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            with self._stats_lock:
+                self._stats['dropped'] += 1
+            return False
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            data = dict(self._stats)
+        data.update({
+            'queue_depth': self._queue.qsize(),
+            'max_queue': self.max_queue,
+            'batch_size': self.batch_size,
+            'flush_interval_s': self.flush_interval,
+        })
+        return data
+
+    def _drain(self) -> list:
+        """Espera hasta completar un lote o hasta que venza el intervalo."""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._drain()
+            if batch:
+                self.flush(batch)
+        # Vaciar lo que quede al detenerse
+        while not self._queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is not _STOP:
+                    batch.append(item)
+            if batch:
+                self.flush(batch)
+
+    @staticmethod
+    def _active_stage_readings(readings):
+        """(lecturas a guardar, descartadas): el control de etapa cerrada de
+        ``SensorReading.save()``, con una sola consulta."""
+        stage_ids = {r.stage_id for r in readings if r.stage_id is not None}
+        active = set(FillingStage.objects.filter(id__in=stage_ids, active=True).values_list('id', flat=True))
+        kept = [r for r in readings if r.stage_id is None or r.stage_id in active]
+        return kept, [r for r in readings if r.stage_id is not None and r.stage_id not in active]
+
+    def flush(self, batch: list, retries: int = 3):
+        """Inserta un lote con una sola transacción; reintenta ante errores."""
+        readings = [item[0] for item in batch]
+        alerts = [a for item in batch for a in item[1]]
+        started = time.monotonic()
+        rejected = []
+        for attempt in range(retries):
+            try:
+                with transaction.atomic():
+                    readings, rejected = self._active_stage_readings([item[0] for item in batch])
+                    SensorReading.objects.bulk_create(readings, batch_size=self.batch_size)
+                    if alerts:
+                        Alert.objects.bulk_create(alerts)
+                break
+            except Exception as e:
+                print(f"Error guardando lote de {len(readings)} lecturas (intento {attempt + 1}): {e}")
+                with self._stats_lock:
+                    self._stats['flush_errors'] += 1
+                close_old_connections()
+                if attempt + 1 < retries:
+                    time.sleep(min(2 ** attempt, 5))
+        else:
+            with self._stats_lock:
+                self._stats['dropped'] += len(batch)
+            return
+        if rejected:
+            print(f"Descartadas {len(rejected)} lecturas de etapas cerradas")
+            with self._stats_lock:
+                self._stats['closed_stage_dropped'] += len(rejected)
+
+        try:
+            update_rollups(readings)
+        except Exception as e:
+            # Las lecturas ya están guardadas; rebuild_rollups corrige el resumen
+            print(f"Error actualizando rollups: {e}")
+            with self._stats_lock:
+                self._stats['rollup_errors'] += 1
+            close_old_connections()
+
+        elapsed_ms = (time.monotonic() - started) * 1000.0
+        with self._stats_lock:
+            s = self._stats
+            s['rows_flushed'] += len(readings)
+            s['batches_flushed'] += 1
+            s['last_batch_size'] = len(readings)
+            s['last_flush_ms'] = round(elapsed_ms, 2)
+            s['avg_flush_ms'] = round(elapsed_ms if s['avg_flush_ms'] is None else 0.9 * s['avg_flush_ms'] + 0.1 * elapsed_ms, 2)
+            s['max_flush_ms'] = round(max(elapsed_ms, s['max_flush_ms'] or 0.0), 2)
+            s['last_flush_at'] = time.time()
+
+        if alerts and self.on_alerts:
+            self.on_alerts(alerts)
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from dashboard.models import SensorReading
+
+
+class Command(BaseCommand):
+    help = "Completa las columnas tipadas de SensorReading a partir de raw_payload, por lotes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Lecturas por lote (default: 5000)")
+        parser.add_argument("--stage", type=int, default=None, help="Limitar a una etapa (id)")
+        parser.add_argument("--all", action="store_true", help="Recalcular también filas que ya tienen columnas")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        fields = list(SensorReading.PAYLOAD_COLUMNS) + ["gas_rate_lmin", "gas_keys"]
+
+        qs = SensorReading.objects.filter(raw_payload__has_any_keys=[
+            *SensorReading.PAYLOAD_COLUMNS.values(), "caudal_gas_lmin", "gas_flow_lmin",
+        ])
+        if options["stage"]:
+            qs = qs.filter(stage_id=options["stage"])
+        if not options["all"]:
+            # gas_keys se completa con todo payload: nulo = fila sin procesar
+            qs = qs.filter(gas_keys__isnull=True)
+
+        last_id = 0
+        updated = 0
+        while True:
+            # Paginación por clave primaria: cada lote es una consulta acotada
+            rows = list(qs.filter(id__gt=last_id).order_by("id").values_list("id", "raw_payload")[:chunk_size])
+            if not rows:
+                break
+            batch = []
+            for pk, payload in rows:
+                values = {f: None for f in fields}
+                values.update(SensorReading.fields_from_payload(payload))
+                batch.append(SensorReading(id=pk, **values))
+            with transaction.atomic():
+                SensorReading.objects.bulk_update(batch, fields)
+            updated += len(batch)
+            last_id = rows[-1][0]
+            self.stdout.write(f"{updated} lecturas actualizadas (id <= {last_id})")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfill terminado: {updated} lecturas"))
+        if updated:
+            self.stdout.write("Ejecute rebuild_rollups para recalcular los resúmenes afectados")
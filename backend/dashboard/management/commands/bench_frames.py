@@ -0,0 +1,53 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.frames import FrameEncoder, available_encodings
+
+# Sensores típicos del payload MQTT (ver SensorReading.fields_from_payload)
+SENSORS = ['temperatura', 'presion', 'humedad', 'ph', 'caudal_gas', 'caudal_biol', 'gas_total_m3', 'nivel']
+
+
+def sample_frames(count, sensors, seed=0):
+    """Frames ``sensor_data`` como los que arma StreamOutbox."""
+    rng = random.Random(seed)
+    names = (SENSORS + [f'sensor_{i}' for i in range(len(SENSORS), sensors)])[:sensors]
+    start = datetime(2025, 1, 1, tzinfo=dt_timezone.utc)
+    frames = []
+    for i in range(count):
+        values = {name: round(rng.uniform(0, 1100), 2) for name in names if rng.random() > 0.1}
+        frames.append({
+            'type': 'sensor_data',
+            **values,
+            'timestamp': (start + timedelta(seconds=0.5 * i)).isoformat(),
+            'meta': {'stage': 1, 'readings': rng.randint(1, 5), 'seq': i + 1, 'dropped': 0},
+        })
+    return names, frames
+
+
+class Command(BaseCommand):
+    help = "Compara bytes por frame y CPU de serialización de los frames de WebSocket (json, msgpack, packed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--frames", type=int, default=10000, help="Frames a codificar por encoding")
+        parser.add_argument("--sensors", type=int, default=len(SENSORS), help="Sensores por frame")
+
+    def handle(self, *args, **options):
+        if options["frames"] <= 0 or options["sensors"] <= 0:
+            raise CommandError("--frames y --sensors deben ser positivos")
+        names, frames = sample_frames(options["frames"], options["sensors"])
+        results = []
+        for encoding in available_encodings():
+            encoder = FrameEncoder(encoding, names)
+            started = time.perf_counter()
+            total = sum(len(payload) for frame in frames for _kind, payload in encoder.encode(frame))
+            elapsed = time.perf_counter() - started
+            results.append((encoding, total / len(frames), elapsed / len(frames) * 1e6))
+
+        json_bytes = results[0][1]
+        self.stdout.write(f"{len(frames)} frames, {len(names)} sensores")
+        self.stdout.write(f"{'encoding':<10}{'bytes/frame':>14}{'vs json':>10}{'us/frame':>12}")
+        for encoding, size, micros in results:
+            self.stdout.write(f"{encoding:<10}{size:>14.1f}{size / json_bytes:>10.2f}{micros:>12.2f}")
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard import exports
+from dashboard.models import FillingStage
+
+
+class Command(BaseCommand):
+    help = "Exporta las lecturas crudas a un archivo Parquet (columnas tipadas, zstd)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="Archivo .parquet de salida")
+        parser.add_argument("--stage", type=int, default=None, help="Etapa (id); por defecto todas")
+        parser.add_argument("--start", default=None, help="Primer día (YYYY-MM-DD, UTC)")
+        parser.add_argument("--end", default=None, help="Último día (YYYY-MM-DD, UTC)")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Lecturas por row group (por defecto READING_CHUNK_SIZE)")
+        parser.add_argument("--compression", default="zstd", help="Compresión Parquet (zstd, snappy, gzip, none)")
+
+    def handle(self, *args, **options):
+        if exports.pq is None:
+            raise CommandError("pyarrow no está instalado")
+        try:
+            start = datetime.fromisoformat(options["start"]) if options["start"] else None
+            end = datetime.fromisoformat(options["end"]) + timedelta(days=1) - timedelta(microseconds=1) if options["end"] else None
+        except ValueError as e:
+            raise CommandError(f"Fecha inválida: {e}")
+
+        stage = None
+        if options["stage"]:
+            stage = FillingStage.objects.filter(id=options["stage"]).first()
+            if stage is None:
+                raise CommandError(f"No existe la etapa {options['stage']}")
+
+        total = exports.write_parquet(
+            options["output"], start=start, end=end, stage=stage,
+            chunk_size=options["chunk_size"], compression=options["compression"],
+        )
+        self.stdout.write(self.style.SUCCESS(f"{total} lecturas exportadas a {options['output']}"))
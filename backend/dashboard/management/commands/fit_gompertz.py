@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.fits import refit_stage
+from dashboard.models import FillingStage
+
+
+class Command(BaseCommand):
+    help = "Ajusta la curva de Gompertz de las etapas a su producción real (sólo si hay días nuevos)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stage", type=int, default=None, help="Etapa (id); por defecto las activas")
+        parser.add_argument("--all", action="store_true", help="Incluir etapas cerradas")
+        parser.add_argument("--force", action="store_true", help="Reajustar aunque no haya días nuevos")
+
+    def handle(self, *args, **options):
+        stages = FillingStage.objects.order_by("id")
+        if options["stage"]:
+            stages = stages.filter(id=options["stage"])
+            if not stages.exists():
+                raise CommandError(f"No existe la etapa {options['stage']}")
+        elif not options["all"]:
+            stages = stages.filter(active=True)
+
+        for stage in stages:
+            fit = refit_stage(stage, force=options["force"])
+            if fit is None:
+                self.stdout.write(f"Etapa {stage.id}: datos insuficientes")
+            else:
+                self.stdout.write(
+                    f"Etapa {stage.id}: A={fit.A_m3:.3f} m3 mu_g={fit.mu_g:.3f} m3/día "
+                    f"lag={fit.lag_days:.2f} d rmse={fit.rmse:.3f} ({fit.n_days} días)"
+                )
+        self.stdout.write(self.style.SUCCESS("Ajustes actualizados"))
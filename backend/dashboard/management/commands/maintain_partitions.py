@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.partitions import RETENTION_MODES, apply_retention, ensure_partitions, is_partitioned
+
+
+class Command(BaseCommand):
+    help = "Crea las particiones mensuales futuras de lecturas y aplica la política de retención."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--months-ahead", type=int, default=None, help="Meses a crear por adelantado (por defecto SENSOR_PARTITION_MONTHS_AHEAD)")
+        parser.add_argument("--retention", action="store_true", help="Aplicar también la retención de lecturas crudas")
+        parser.add_argument("--retention-months", type=int, default=None, help="Meses de lecturas crudas a conservar (por defecto SENSOR_RAW_RETENTION_MONTHS)")
+        parser.add_argument("--mode", choices=RETENTION_MODES, default=None, help="compact|drop (por defecto SENSOR_RETENTION_MODE)")
+        parser.add_argument("--dry-run", action="store_true", help="Mostrar qué meses se procesarían sin modificarlos")
+
+    def handle(self, *args, **options):
+        if is_partitioned():
+            created = ensure_partitions(options["months_ahead"])
+            for name in created:
+                self.stdout.write(f"Partición creada: {name}")
+            if not created:
+                self.stdout.write("Particiones al día")
+        else:
+            self.stdout.write("La tabla de lecturas no está particionada (sólo PostgreSQL)")
+
+        if options["retention"]:
+            try:
+                results = apply_retention(options["retention_months"], options["mode"], dry_run=options["dry_run"])
+            except ValueError as e:
+                raise CommandError(str(e))
+            for month, action in results:
+                self.stdout.write(f"{month}: {action}")
+            if not results:
+                self.stdout.write("Sin meses vencidos para la retención")
+        self.stdout.write(self.style.SUCCESS("Mantenimiento terminado"))
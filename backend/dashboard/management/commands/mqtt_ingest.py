@@ -0,0 +1,46 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from dashboard.ingest import MQTTIngestService
+
+
+class Command(BaseCommand):
+    help = "Ejecuta el servicio único de ingesta MQTT (persistencia + reparto a WebSockets)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--broker", default=None, help="Host del broker (por defecto MQTT_BROKER_HOST)")
+        parser.add_argument("--port", type=int, default=None, help="Puerto del broker (por defecto MQTT_BROKER_PORT)")
+        parser.add_argument("--topic", default=None, help="Topic de sensores (por defecto MQTT_SENSOR_TOPIC o 'Prueba')")
+        parser.add_argument("--stats-interval", type=float, default=60.0, help="Segundos entre reportes de métricas (0 = desactivado)")
+
+    def handle(self, *args, **options):
+        service = MQTTIngestService(
+            broker_host=options["broker"],
+            broker_port=options["port"],
+            topic=options["topic"],
+        )
+        self.stdout.write(f"Conectando a {service.broker_host}:{service.broker_port} (topic '{service.topic}')")
+        stop_stats = threading.Event()
+        if options["stats_interval"] > 0:
+            threading.Thread(
+                target=self._report_stats,
+                args=(service, options["stats_interval"], stop_stats),
+                daemon=True,
+            ).start()
+        try:
+            service.run_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("Ingesta detenida")
+        finally:
+            stop_stats.set()
+            service.stop()
+
+    def _report_stats(self, service, interval, stop_event):
+        while not stop_event.wait(interval):
+            s = service.stats()
+            self.stdout.write(
+                f"cola={s['queue_depth']}/{s['max_queue']} guardadas={s['rows_flushed']} "
+                f"descartadas={s['dropped']} etapa_cerrada={s['closed_stage_dropped']} ultimo_lote={s['last_batch_size']} "
+                f"flush_ms(ultimo/prom/max)={s['last_flush_ms']}/{s['avg_flush_ms']}/{s['max_flush_ms']}"
+            )
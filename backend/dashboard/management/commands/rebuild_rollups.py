@@ -0,0 +1,36 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.models import FillingStage
+from dashboard.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = "Recalcula los rollups por hora y por día a partir de las lecturas."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stage", type=int, default=None, help="Etapa (id); por defecto todas")
+        parser.add_argument("--start", default=None, help="Primer día a recalcular (YYYY-MM-DD, UTC)")
+        parser.add_argument("--end", default=None, help="Último día a recalcular (YYYY-MM-DD, UTC)")
+        parser.add_argument("--chunk-size", type=int, default=None, help="Lecturas por lote (por defecto READING_CHUNK_SIZE)")
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options["start"]) if options["start"] else None
+            end = date.fromisoformat(options["end"]) if options["end"] else None
+        except ValueError as e:
+            raise CommandError(f"Fecha inválida: {e}")
+
+        stages = FillingStage.objects.order_by("id")
+        if options["stage"]:
+            stages = stages.filter(id=options["stage"])
+            if not stages.exists():
+                raise CommandError(f"No existe la etapa {options['stage']}")
+
+        total = 0
+        for stage_id in stages.values_list("id", flat=True):
+            count = rebuild_rollups(stage_id, start=start, end=end, chunk_size=options["chunk_size"])
+            total += count
+            self.stdout.write(f"Etapa {stage_id}: {count} lecturas")
+        self.stdout.write(self.style.SUCCESS(f"Rollups recalculados: {total} lecturas"))
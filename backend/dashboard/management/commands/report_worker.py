@@ -0,0 +1,43 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from dashboard.report_jobs import claim_job, requeue_stale, run_job, worker_name
+
+
+class Command(BaseCommand):
+    help = "Procesa la cola de generación de reportes (ReportJob)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Procesar los trabajos pendientes y salir")
+        parser.add_argument("--poll-interval", type=float, default=None, help="Segundos entre consultas a la cola (por defecto REPORT_WORKER_POLL_INTERVAL)")
+        parser.add_argument("--processes", type=int, default=None, help="Procesos para renderizar PDF/Excel/CSV (0 = en este proceso; por defecto REPORT_RENDER_PROCESSES)")
+
+    def handle(self, *args, **options):
+        poll_interval = options["poll_interval"] or getattr(settings, "REPORT_WORKER_POLL_INTERVAL", 2.0)
+        processes = options["processes"]
+        if processes is None:
+            processes = getattr(settings, "REPORT_RENDER_PROCESSES", 3)
+        name = worker_name()
+        pool = ProcessPoolExecutor(max_workers=processes) if processes > 0 else None
+        self.stdout.write(f"Worker de reportes {name} ({processes or 'sin'} procesos de renderizado)")
+        try:
+            while True:
+                close_old_connections()
+                requeue_stale()
+                job = claim_job(name)
+                if job is None:
+                    if options["once"]:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+                run_job(job, pool)
+                self.stdout.write(f"Trabajo {job.id} ({job.kind}): {job.status}")
+        except KeyboardInterrupt:
+            self.stdout.write("Worker detenido")
+        finally:
+            if pool is not None:
+                pool.shutdown()
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0004_practicesession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensorreading',
+            name='gas_rate_lmin',
+            field=models.FloatField(blank=True, help_text='Caudal de gas (L/min), claves caudal_gas_lmin/gas_flow_lmin', null=True),
+        ),
+        migrations.AddField(
+            model_name='sensorreading',
+            name='gas_rate_m3h',
+            field=models.FloatField(blank=True, help_text='Caudal de gas (m3/h), clave caudal_gas', null=True),
+        ),
+        migrations.AddField(
+            model_name='sensorreading',
+            name='gas_total_m3',
+            field=models.FloatField(blank=True, help_text='Acumulado de gas reportado por el sensor (m3)', null=True),
+        ),
+        migrations.AddField(
+            model_name='sensorreading',
+            name='humidity_pct',
+            field=models.FloatField(blank=True, help_text='Humedad (%)', null=True),
+        ),
+        migrations.AddField(
+            model_name='sensorreading',
+            name='quality_pct',
+            field=models.FloatField(blank=True, help_text='Calidad del gas (%)', null=True),
+        ),
+        migrations.AddField(
+            model_name='sensorreading',
+            name='temperature_c',
+            field=models.FloatField(blank=True, help_text='Temperatura (°C)', null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0005_sensorreading_typed_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SensorRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hora'), ('day', 'Día')], max_length=4)),
+                ('bucket_start', models.DateTimeField(help_text='Inicio del intervalo (UTC)')),
+                ('gas_m3', models.FloatField(default=0.0, help_text='Producción de gas en el intervalo (m3)')),
+                ('biol_m3', models.FloatField(default=0.0, help_text='Suma de caudal biol en el intervalo')),
+                ('pressure_min', models.FloatField(blank=True, null=True)),
+                ('pressure_max', models.FloatField(blank=True, null=True)),
+                ('pressure_avg', models.FloatField(blank=True, null=True)),
+                ('pressure_count', models.PositiveIntegerField(default=0)),
+                ('temperature_min', models.FloatField(blank=True, null=True)),
+                ('temperature_max', models.FloatField(blank=True, null=True)),
+                ('temperature_avg', models.FloatField(blank=True, null=True)),
+                ('temperature_count', models.PositiveIntegerField(default=0)),
+                ('count', models.PositiveIntegerField(default=0, help_text='Lecturas en el intervalo')),
+                ('last_reading_at', models.DateTimeField(blank=True, null=True)),
+                ('last_gas_total_m3', models.FloatField(blank=True, null=True)),
+                ('stage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='dashboard.fillingstage')),
+            ],
+            options={
+                'ordering': ['stage', 'granularity', 'bucket_start'],
+                'constraints': [models.UniqueConstraint(fields=('stage', 'granularity', 'bucket_start'), name='unique_rollup_bucket')],
+            },
+        ),
+    ]
@@ -0,0 +1,116 @@
+"""Convierte dashboard_sensorreading en una tabla particionada por mes.
+
+Sólo aplica en PostgreSQL; con otros motores no hace nada y la tabla sigue
+siendo normal (la retención funciona igual, borrando por rango).
+
+Una tabla particionada necesita la clave de partición en la clave primaria,
+así que pasa a ser (id, timestamp). Para el ORM ``id`` sigue siendo la clave
+y sigue siendo única porque sale de una secuencia. Las particiones futuras
+las crea ``manage.py maintain_partitions``; las lecturas fuera de rango
+caen en la partición por defecto.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import migrations
+
+TABLE = 'dashboard_sensorreading'
+OLD = 'dashboard_sensorreading_old'
+SEQUENCE = 'dashboard_sensorreading_part_id_seq'
+MONTHS_AHEAD = 3
+
+
+def _add_month(moment):
+    return moment.replace(year=moment.year + moment.month // 12, month=moment.month % 12 + 1)
+
+
+def _indexes(cursor, table):
+    cursor.execute(
+        "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s",
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def _swap(cursor, create_sql):
+    """Renombra la tabla actual a ``OLD``, crea la nueva con ``create_sql`` y
+    le pasa los índices y las claves foráneas (los datos se copian aparte)."""
+    cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {OLD}')
+    cursor.execute(f'ALTER TABLE {OLD} RENAME CONSTRAINT {TABLE}_pkey TO {OLD}_pkey')
+    cursor.execute(create_sql)
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'",
+        [OLD],
+    )
+    foreign_keys = cursor.fetchall()
+    for name, definition in foreign_keys:
+        cursor.execute(f'ALTER TABLE {OLD} DROP CONSTRAINT {name}')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+    for name, definition in _indexes(cursor, OLD):
+        if name.endswith('_pkey'):
+            continue
+        cursor.execute(f'DROP INDEX {name}')
+        cursor.execute(definition.replace(f' ON {OLD} ', f' ON {TABLE} ').replace(f'.{OLD} ', f'.{TABLE} '))
+
+
+def partition(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT min("timestamp") FROM {TABLE}')
+        first = cursor.fetchone()[0] or datetime.now(dt_timezone.utc)
+
+        _swap(cursor, f'''
+            CREATE TABLE {TABLE} (LIKE {OLD} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+            PARTITION BY RANGE ("timestamp")
+        ''')
+        # Las columnas identity no se heredan en tablas particionadas (< PG 17)
+        cursor.execute(f'CREATE SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id')
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')")
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, "timestamp")')
+
+        month = datetime(first.year, first.month, 1, tzinfo=dt_timezone.utc)
+        now = datetime.now(dt_timezone.utc)
+        last = datetime(now.year, now.month, 1, tzinfo=dt_timezone.utc)
+        for _ in range(MONTHS_AHEAD):
+            last = _add_month(last)
+        while month <= last:
+            upper = _add_month(month)
+            cursor.execute(
+                f'CREATE TABLE {TABLE}_p{month:%Y%m} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)',
+                [month, upper],
+            )
+            month = upper
+        cursor.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT')
+
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {OLD}')
+        cursor.execute(f'DROP TABLE {OLD}')
+        cursor.execute(f"SELECT setval('{SEQUENCE}', COALESCE((SELECT max(id) FROM {TABLE}), 0) + 1, false)")
+
+
+def unpartition(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        _swap(cursor, f'CREATE TABLE {TABLE} (LIKE {OLD} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        cursor.execute(f'ALTER TABLE {TABLE} ALTER COLUMN id DROP DEFAULT')
+        cursor.execute(f'ALTER TABLE {TABLE} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id)')
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {OLD}')
+        # Borra la tabla particionada con sus particiones y la secuencia
+        cursor.execute(f'DROP TABLE {OLD} CASCADE')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence('{TABLE}', 'id'), "
+            f"COALESCE((SELECT max(id) FROM {TABLE}), 0) + 1, false)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0006_sensorrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
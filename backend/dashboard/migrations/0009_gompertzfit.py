@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0008_reportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GompertzFit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('material_type', models.CharField(db_index=True, max_length=20)),
+                ('material_amount_kg', models.FloatField()),
+                ('A_m3', models.FloatField(help_text='Potencial de biogás ajustado (m3)')),
+                ('mu_g', models.FloatField(help_text='Velocidad máxima ajustada (m3/día)')),
+                ('lag_days', models.FloatField(help_text='Fase de latencia ajustada (días)')),
+                ('rmse', models.FloatField(help_text='Error cuadrático medio del ajuste (m3)')),
+                ('n_days', models.PositiveIntegerField(help_text='Días usados en el ajuste')),
+                ('last_day', models.DateField(help_text='Último día completo incluido')),
+                ('iterations', models.PositiveIntegerField(default=0)),
+                ('converged', models.BooleanField(default=False)),
+                ('fitted_at', models.DateTimeField(auto_now=True)),
+                ('stage', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='gompertz_fit', to='dashboard.fillingstage')),
+            ],
+            options={
+                'ordering': ['-fitted_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0009_gompertzfit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gompertzfit',
+            name='last_reading_at',
+            field=models.DateTimeField(blank=True, help_text='Última lectura incluida', null=True),
+        ),
+        migrations.AddField(
+            model_name='gompertzfit',
+            name='n_readings',
+            field=models.PositiveIntegerField(default=0, help_text='Lecturas incluidas'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0010_gompertzfit_readings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sensorreading',
+            name='gas_keys',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Claves de gas del payload (bits GAS_KEY_*)', null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+"""Incorpora a las columnas tipadas y a los rollups las lecturas existentes.
+
+Las vistas de producción y de reportes leen ``SensorRollup``; las lecturas
+guardadas antes de 0005/0006 (o sin ``gas_keys``, 0011) no tienen columnas
+tipadas ni rollups. Esta migración hace en orden lo mismo que:
+
+    python manage.py backfill_reading_columns
+    python manage.py rebuild_rollups
+
+Usa los comandos (y por eso los modelos actuales) y no es atómica: cada lote
+se confirma por separado; si se interrumpe, basta con volver a correr los
+dos comandos en ese orden. Con la base vacía no hace nada.
+"""
+from django.core.management import call_command
+from django.db import migrations
+
+
+def backfill(apps, schema_editor):
+    SensorReading = apps.get_model('dashboard', 'SensorReading')
+    if not SensorReading.objects.exists():
+        return
+    call_command('backfill_reading_columns')
+    call_command('rebuild_rollups')
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('dashboard', '0011_sensorreading_gas_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
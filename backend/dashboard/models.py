@@ -25,6 +25,40 @@ class Report(models.Model):
 	def __str__(self):
 		return f"Reporte {self.report_type} - Llenado #{self.stage.number} ({self.created_at.date()})"
 
+class ReportJob(models.Model):
+	"""Generación de un reporte en segundo plano (``manage.py report_worker``)."""
+	KIND_CHOICES = [
+		("create", "Crear reporte"),
+		("regenerate", "Regenerar reporte"),
+	]
+	STATUS_CHOICES = [
+		("PENDING", "Pendiente"),
+		("RUNNING", "En proceso"),
+		("DONE", "Terminado"),
+		("ERROR", "Error"),
+	]
+	kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="PENDING")
+	user = models.ForeignKey(get_user_model(), on_delete=models.SET_NULL, null=True, blank=True)
+	stage = models.ForeignKey('FillingStage', on_delete=models.CASCADE, null=True, blank=True, related_name='report_jobs')
+	report = models.ForeignKey(Report, on_delete=models.CASCADE, null=True, blank=True, related_name='jobs')
+	params = models.JSONField(default=dict, blank=True, help_text="report_type, observations, inferences")
+	error = models.TextField(blank=True, default="")
+	attempts = models.PositiveSmallIntegerField(default=0)
+	worker = models.CharField(max_length=100, blank=True, default="")
+	created_at = models.DateTimeField(auto_now_add=True)
+	started_at = models.DateTimeField(null=True, blank=True)
+	finished_at = models.DateTimeField(null=True, blank=True)
+
+	class Meta:
+		ordering = ["-created_at"]
+		indexes = [
+			models.Index(fields=["status", "created_at"]),
+		]
+
+	def __str__(self):
+		return f"Trabajo {self.kind} #{self.id} ({self.status})"
+
 class FillingStage(models.Model):
 	MATERIAL_CHOICES = [
 		("bovino", "Desechos bovinos"),
@@ -56,8 +90,37 @@ class SensorReading(models.Model):
 	pressure_hpa = models.FloatField(null=True, blank=True)
 	biol_flow = models.FloatField(null=True, blank=True, help_text="Caudal biol (unidades del sensor)")
 	gas_flow = models.FloatField(null=True, blank=True, help_text="Caudal gas (unidades del sensor)")
+	# Claves frecuentes del payload promovidas a columnas (ver fields_from_payload)
+	gas_total_m3 = models.FloatField(null=True, blank=True, help_text="Acumulado de gas reportado por el sensor (m3)")
+	gas_rate_m3h = models.FloatField(null=True, blank=True, help_text="Caudal de gas (m3/h), clave caudal_gas")
+	gas_rate_lmin = models.FloatField(null=True, blank=True, help_text="Caudal de gas (L/min), claves caudal_gas_lmin/gas_flow_lmin")
+	temperature_c = models.FloatField(null=True, blank=True, help_text="Temperatura (°C)")
+	humidity_pct = models.FloatField(null=True, blank=True, help_text="Humedad (%)")
+	quality_pct = models.FloatField(null=True, blank=True, help_text="Calidad del gas (%)")
+	# Claves de gas presentes en el payload (GAS_KEY_*) aunque su valor no sea
+	# numérico: eligen la regla de la agregación. None = desconocido.
+	gas_keys = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Claves de gas del payload (bits GAS_KEY_*)")
 	raw_payload = models.JSONField(null=True, blank=True)
 
+	# Campo del modelo -> clave del payload MQTT
+	PAYLOAD_COLUMNS = {
+		"gas_total_m3": "gas_total_m3",
+		"gas_rate_m3h": "caudal_gas",
+		"temperature_c": "temperatura",
+		"humidity_pct": "humedad",
+		"quality_pct": "calidad",
+	}
+	# Columnas que sólo lee la agregación de gas (ver _as_gas_float)
+	GAS_COLUMNS = ("gas_total_m3", "gas_rate_m3h")
+	GAS_KEY_TOTAL = 1  # gas_total_m3
+	GAS_KEY_RATE = 2  # caudal_gas
+	GAS_KEY_RATE_LMIN = 4  # caudal_gas_lmin / gas_flow_lmin
+	# Claves que quedan representadas en columnas
+	KNOWN_PAYLOAD_KEYS = frozenset({
+		"presion", "caudal_biol", "biol_flow", "caudal_gas", "gas_flow",
+		"gas_total_m3", "caudal_gas_lmin", "gas_flow_lmin", "temperatura", "humedad", "calidad",
+	})
+
 	class Meta:
 		indexes = [
 			models.Index(fields=["timestamp"]),
@@ -67,12 +130,134 @@ class SensorReading(models.Model):
 	def __str__(self):
 		return f"{self.timestamp} stage={self.stage_id}"
 
+	@staticmethod
+	def _as_float(value):
+		# null o inválido -> None
+		if value is None:
+			return None
+		try:
+			return float(value)
+		except (TypeError, ValueError):
+			return None
+
+	@staticmethod
+	def _as_gas_float(value):
+		# Columnas de gas: la conversión que usaban las vistas, float(v or 0.0),
+		# de la que depende la paridad de la agregación; inválido -> None
+		try:
+			return float(value or 0.0)
+		except (TypeError, ValueError):
+			return None
+
+	@classmethod
+	def fields_from_payload(cls, payload) -> dict:
+		"""Valores de las columnas tipadas a partir de un payload MQTT."""
+		if not isinstance(payload, dict):
+			return {}
+		fields = {}
+		for field, key in cls.PAYLOAD_COLUMNS.items():
+			if key in payload:
+				convert = cls._as_gas_float if field in cls.GAS_COLUMNS else cls._as_float
+				fields[field] = convert(payload[key])
+		if "caudal_gas_lmin" in payload or "gas_flow_lmin" in payload:
+			fields["gas_rate_lmin"] = cls._as_gas_float(payload.get("caudal_gas_lmin") or payload.get("gas_flow_lmin"))
+		fields["gas_keys"] = (
+			(cls.GAS_KEY_TOTAL if "gas_total_m3" in payload else 0)
+			| (cls.GAS_KEY_RATE if "caudal_gas" in payload else 0)
+			| (cls.GAS_KEY_RATE_LMIN if "caudal_gas_lmin" in payload or "gas_flow_lmin" in payload else 0)
+		)
+		return fields
+
+	@classmethod
+	def is_well_formed(cls, payload) -> bool:
+		"""True si todo el payload queda en columnas (claves conocidas y numéricas)."""
+		return isinstance(payload, dict) and all(
+			key in cls.KNOWN_PAYLOAD_KEYS and isinstance(value, (int, float)) and not isinstance(value, bool)
+			for key, value in payload.items()
+		)
+
+	def fill_from_payload(self):
+		"""Completa las columnas tipadas vacías desde raw_payload."""
+		for field, value in self.fields_from_payload(self.raw_payload).items():
+			if getattr(self, field) is None:
+				setattr(self, field, value)
+
 	def save(self, *args, **kwargs):
-		if self.stage and not self.stage.active:
+		self.fill_from_payload()
+		from .stage_cache import active_stage_id
+		# La etapa activa (en caché) es válida sin releer stage.active
+		if self.stage_id is not None and self.stage_id != active_stage_id() and not self.stage.active:
 			raise Exception("No se pueden guardar lecturas en una etapa cerrada.")
 		super().save(*args, **kwargs)
 
 
+class SensorRollup(models.Model):
+	"""Resumen por hora o por día de las lecturas de una etapa.
+
+	Se mantiene al ingresar lecturas (ver ``dashboard/rollups.py``) y se
+	reconstruye con ``manage.py rebuild_rollups``.
+	"""
+	GRANULARITY_CHOICES = [
+		("hour", "Hora"),
+		("day", "Día"),
+	]
+	stage = models.ForeignKey(FillingStage, on_delete=models.CASCADE, related_name="rollups")
+	granularity = models.CharField(max_length=4, choices=GRANULARITY_CHOICES)
+	bucket_start = models.DateTimeField(help_text="Inicio del intervalo (UTC)")
+	gas_m3 = models.FloatField(default=0.0, help_text="Producción de gas en el intervalo (m3)")
+	biol_m3 = models.FloatField(default=0.0, help_text="Suma de caudal biol en el intervalo")
+	pressure_min = models.FloatField(null=True, blank=True)
+	pressure_max = models.FloatField(null=True, blank=True)
+	pressure_avg = models.FloatField(null=True, blank=True)
+	pressure_count = models.PositiveIntegerField(default=0)
+	temperature_min = models.FloatField(null=True, blank=True)
+	temperature_max = models.FloatField(null=True, blank=True)
+	temperature_avg = models.FloatField(null=True, blank=True)
+	temperature_count = models.PositiveIntegerField(default=0)
+	count = models.PositiveIntegerField(default=0, help_text="Lecturas en el intervalo")
+	# Estado del acumulador de gas al cierre del intervalo, para continuar
+	last_reading_at = models.DateTimeField(null=True, blank=True)
+	last_gas_total_m3 = models.FloatField(null=True, blank=True)
+
+	class Meta:
+		ordering = ["stage", "granularity", "bucket_start"]
+		constraints = [
+			models.UniqueConstraint(fields=["stage", "granularity", "bucket_start"], name="unique_rollup_bucket"),
+		]
+
+	def __str__(self):
+		return f"{self.granularity} {self.bucket_start:%Y-%m-%d %H:%M} stage={self.stage_id}"
+
+
+class GompertzFit(models.Model):
+	"""Parámetros de Gompertz ajustados a la producción real de una etapa.
+
+	Los calcula ``dashboard/fits.py`` con los días completos de los rollups;
+	se reajusta partiendo de estos valores cuando hay días nuevos con
+	lecturas nuevas (``last_reading_at`` / ``n_readings``).
+	"""
+	stage = models.OneToOneField(FillingStage, on_delete=models.CASCADE, related_name="gompertz_fit")
+	material_type = models.CharField(max_length=20, db_index=True)
+	material_amount_kg = models.FloatField()
+	A_m3 = models.FloatField(help_text="Potencial de biogás ajustado (m3)")
+	mu_g = models.FloatField(help_text="Velocidad máxima ajustada (m3/día)")
+	lag_days = models.FloatField(help_text="Fase de latencia ajustada (días)")
+	rmse = models.FloatField(help_text="Error cuadrático medio del ajuste (m3)")
+	n_days = models.PositiveIntegerField(help_text="Días usados en el ajuste")
+	last_day = models.DateField(help_text="Último día completo incluido")
+	last_reading_at = models.DateTimeField(null=True, blank=True, help_text="Última lectura incluida")
+	n_readings = models.PositiveIntegerField(default=0, help_text="Lecturas incluidas")
+	iterations = models.PositiveIntegerField(default=0)
+	converged = models.BooleanField(default=False)
+	fitted_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		ordering = ["-fitted_at"]
+
+	def __str__(self):
+		return f"Ajuste {self.material_type} stage={self.stage_id} A={self.A_m3:.2f}"
+
+
 class ActuatorCommand(models.Model):
 	ACTION_CHOICES = [
 		("OPEN", "Abrir"),
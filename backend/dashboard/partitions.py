@@ -0,0 +1,193 @@
+"""Particiones mensuales de SensorReading y política de retención.
+
+En PostgreSQL la tabla está particionada por mes (migración 0007).
+``ensure_partitions`` crea por adelantado las particiones de los próximos
+meses y mueve a la suya las filas que hayan caído en la partición por
+defecto.
+
+La retención trabaja por mes completo (UTC), sólo sobre meses anteriores a
+``SENSOR_RAW_RETENTION_MONTHS`` y sólo si los rollups por hora cubren todas
+sus lecturas:
+
+- ``drop``: elimina las lecturas del mes (DROP de la partición).
+- ``compact``: las reemplaza por una lectura por etapa y hora tomada del
+  rollup: gas del intervalo en ``gas_flow``, biol en ``biol_flow`` y
+  promedios de presión y temperatura. ``rebuild_rollups`` sobre un mes
+  compactado reproduce la producción por hora, pero no el acumulado del
+  sensor (``gas_total_m3``) al cierre del mes.
+
+Con otros motores la misma política se aplica con DELETE por rango.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min, Sum
+
+from .models import SensorReading, SensorRollup
+
+TABLE = SensorReading._meta.db_table
+DEFAULT_PARTITION = f'{TABLE}_default'
+# raw_payload de las lecturas generadas al compactar
+COMPACTED_PAYLOAD = {'rollup': 'hour'}
+RETENTION_MODES = ('compact', 'drop')
+
+
+def month_start(moment) -> datetime:
+    return datetime(moment.year, moment.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, n) -> datetime:
+    index = month.year * 12 + month.month - 1 + n
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month) -> str:
+    return f'{TABLE}_p{month:%Y%m}'
+
+
+def is_partitioned() -> bool:
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [TABLE])
+        return cursor.fetchone() is not None
+
+
+def existing_partitions() -> set:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [TABLE],
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
+def create_partition(month) -> bool:
+    """Crea la partición de un mes. Devuelve False si ya existía.
+
+    Las filas del mes que estén en la partición por defecto se mueven a la
+    nueva (PostgreSQL no permite crearla mientras estén ahí).
+    """
+    name = partition_name(month)
+    if name in existing_partitions():
+        return False
+    bounds = [month, add_months(month, 1)]
+    in_range = '"timestamp" >= %s AND "timestamp" < %s'
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f'SELECT count(*) FROM {DEFAULT_PARTITION} WHERE {in_range}', bounds)
+        pending = cursor.fetchone()[0]
+        if pending:
+            cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+        cursor.execute(f'CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)', bounds)
+        if pending:
+            cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {DEFAULT_PARTITION} WHERE {in_range}', bounds)
+            cursor.execute(f'DELETE FROM {DEFAULT_PARTITION} WHERE {in_range}', bounds)
+            cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+    return True
+
+
+def ensure_partitions(months_ahead=None, now=None) -> list:
+    """Crea las particiones del mes actual y los ``months_ahead`` siguientes,
+    y las de los meses que tengan filas en la partición por defecto."""
+    if not is_partitioned():
+        return []
+    if months_ahead is None:
+        months_ahead = getattr(settings, 'SENSOR_PARTITION_MONTHS_AHEAD', 3)
+    current = month_start(now or datetime.now(dt_timezone.utc))
+    months = {add_months(current, n) for n in range(months_ahead + 1)}
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT DISTINCT date_trunc('month', \"timestamp\" AT TIME ZONE 'UTC') FROM {DEFAULT_PARTITION}"
+        )
+        months.update(month_start(row[0]) for row in cursor.fetchall())
+    return [partition_name(month) for month in sorted(months) if create_partition(month)]
+
+
+def _month_readings(month):
+    return SensorReading.objects.filter(timestamp__gte=month, timestamp__lt=add_months(month, 1))
+
+
+def is_compacted(month) -> bool:
+    readings = _month_readings(month)
+    return readings.exists() and not readings.exclude(raw_payload__rollup=COMPACTED_PAYLOAD['rollup']).exists()
+
+
+def rollups_cover(month) -> bool:
+    """True si los rollups por hora del mes suman todas sus lecturas."""
+    summarized = SensorRollup.objects.filter(
+        granularity='hour', bucket_start__gte=month, bucket_start__lt=add_months(month, 1),
+    ).aggregate(total=Sum('count'))['total'] or 0
+    return summarized == _month_readings(month).count()
+
+
+def _delete_month(month, drop_partition=False):
+    name = partition_name(month)
+    if is_partitioned() and name in existing_partitions():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE {name}' if drop_partition else f'TRUNCATE {name}')
+    else:
+        _month_readings(month).delete()
+
+
+def compact_month(month) -> int:
+    """Reemplaza las lecturas del mes por una por etapa y hora (del rollup)."""
+    rollups = SensorRollup.objects.filter(
+        granularity='hour', bucket_start__gte=month, bucket_start__lt=add_months(month, 1),
+    ).order_by('stage_id', 'bucket_start')
+    rows = [
+        SensorReading(
+            stage_id=r.stage_id,
+            # Último instante de la hora: conserva el dt de la lectura siguiente
+            timestamp=r.last_reading_at or r.bucket_start,
+            gas_flow=r.gas_m3,
+            biol_flow=r.biol_m3,
+            pressure_hpa=r.pressure_avg,
+            temperature_c=r.temperature_avg,
+            raw_payload=dict(COMPACTED_PAYLOAD),
+        )
+        for r in rollups
+    ]
+    with transaction.atomic():
+        _delete_month(month)
+        # bulk_create: sin save() ni señales, los rollups ya tienen estos datos
+        SensorReading.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def apply_retention(retention_months=None, mode=None, dry_run=False, now=None) -> list:
+    """Aplica la política a los meses vencidos. Devuelve [(mes, acción)]."""
+    if retention_months is None:
+        retention_months = getattr(settings, 'SENSOR_RAW_RETENTION_MONTHS', 0)
+    mode = mode or getattr(settings, 'SENSOR_RETENTION_MODE', 'compact')
+    if mode not in RETENTION_MODES:
+        raise ValueError(f"Modo de retención inválido: {mode}")
+    if not retention_months:
+        return []
+
+    cutoff = add_months(month_start(now or datetime.now(dt_timezone.utc)), -retention_months)
+    first = SensorReading.objects.filter(timestamp__lt=cutoff).aggregate(first=Min('timestamp'))['first']
+    if first is None:
+        return []
+
+    results = []
+    month = month_start(first)
+    while month < cutoff:
+        label = f'{month:%Y-%m}'
+        if not _month_readings(month).exists():
+            pass
+        elif is_compacted(month) and mode == 'compact':
+            results.append((label, 'ya compactado'))
+        elif not is_compacted(month) and not rollups_cover(month):
+            results.append((label, 'omitido: rollups incompletos (ejecute rebuild_rollups)'))
+        elif dry_run:
+            results.append((label, f'{mode} (simulado)'))
+        elif mode == 'drop':
+            with transaction.atomic():
+                _delete_month(month, drop_partition=True)
+            results.append((label, 'eliminado'))
+        else:
+            results.append((label, f'compactado a {compact_month(month)} lecturas'))
+        month = add_months(month, 1)
+    return results
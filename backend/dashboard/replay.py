@@ -0,0 +1,176 @@
+"""Historial reciente de lecturas en vivo para repetir al conectarse.
+
+Lo mantiene el lado de la ingesta (``StreamPublisher``): cada tick agrupado
+se guarda, con un número de secuencia, en un anillo por etapa de tamaño fijo
+(``SENSOR_REPLAY_MINUTES`` de ticks) con una columna float64 por sensor.
+Así el dashboard dibuja los últimos minutos apenas se conecta, sin consultar
+Postgres, y al reconectarse pide sólo lo posterior a la última secuencia que
+vio.
+
+Los consumidores piden el historial por el canal ``REPLAY_CHANNEL`` (sirve
+igual con la ingesta embebida o en otro proceso con Redis) y lo reciben como
+un único mensaje ``replay.batch``. Las secuencias valen dentro de una
+``epoch``: si la ingesta se reinició, la epoch cambia y se manda todo.
+"""
+import math
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs
+
+import numpy as np
+from django.conf import settings
+
+REPLAY_CHANNEL = "sensor_replay"
+
+
+def replay_minutes() -> float:
+    return float(getattr(settings, 'SENSOR_REPLAY_MINUTES', 10))
+
+
+class StageRing:
+    """Anillo de ticks de una etapa: seq, t (epoch en segundos) y valores."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        self.t = np.zeros(capacity, dtype=np.float64)
+        self.values = np.full((capacity, 0), np.nan, dtype=np.float64)
+        self.columns = {}
+        self.head = 0
+        self.count = 0
+        # Secuencia más nueva que se pisó al dar la vuelta
+        self.evicted_seq = 0
+
+    def append(self, seq: int, t: float, values: dict):
+        new = [sensor for sensor in values if sensor not in self.columns]
+        if new:
+            for sensor in new:
+                self.columns[sensor] = len(self.columns)
+            grown = np.full((self.capacity, len(self.columns)), np.nan, dtype=np.float64)
+            grown[:, :self.values.shape[1]] = self.values
+            self.values = grown
+        row = self.head
+        if self.count == self.capacity:
+            self.evicted_seq = int(self.seq[row])
+        self.seq[row] = seq
+        self.t[row] = t
+        self.values[row] = np.nan
+        for sensor, value in values.items():
+            self.values[row, self.columns[sensor]] = value
+        self.head = (row + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    @property
+    def last_t(self) -> float:
+        return float(self.t[(self.head - 1) % self.capacity]) if self.count else 0.0
+
+    def select(self, since_seq=None, min_t=None, sensors=None):
+        """Ticks (de más viejo a más nuevo) con seq > since_seq y t >= min_t,
+        y si faltan ticks posteriores a since_seq (pisados o vencidos)."""
+        order = np.arange(self.head - self.count, self.head) % self.capacity
+        newer = self.seq[order] > since_seq if since_seq is not None else np.ones(len(order), dtype=bool)
+        recent = self.t[order] >= min_t if min_t is not None else np.ones(len(order), dtype=bool)
+        rows = order[newer & recent]
+        missed = since_seq is not None and (self.evicted_seq > since_seq or bool((newer & ~recent).any()))
+        names = [s for s in self.columns if sensors is None or s in sensors]
+        block = self.values[np.ix_(rows, [self.columns[s] for s in names])]
+        # Sensores sin ningún valor en el tramo no se envían
+        present = ~np.isnan(block).all(axis=0) if len(rows) else np.zeros(len(names), dtype=bool)
+        return {
+            'seq': self.seq[rows].tolist(),
+            't': self.t[rows].tolist(),
+            'values': {
+                name: [None if math.isnan(v) else v for v in block[:, j].tolist()]
+                for j, name in enumerate(names) if present[j]
+            },
+        }, missed
+
+
+class ReplayBuffer:
+    """Anillos por etapa con los ticks de los últimos ``minutes`` minutos."""
+
+    def __init__(self, tick: float, minutes=None):
+        self.minutes = replay_minutes() if minutes is None else float(minutes)
+        self.capacity = max(int(math.ceil(self.minutes * 60.0 / tick)) + 1, 1)
+        self.epoch = uuid.uuid4().hex[:12]
+        self.last_seq = 0
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def record(self, seq: int, stage_id, values: dict, t=None):
+        t = time.time() if t is None else t
+        with self._lock:
+            ring = self._rings.get(stage_id)
+            if ring is None:
+                ring = self._rings[stage_id] = StageRing(self.capacity)
+            ring.append(seq, t, values)
+            self.last_seq = seq
+            # Etapas sin datos dentro de la ventana (p.ej. ya cerradas)
+            for other in [k for k, r in self._rings.items() if r.last_t < t - self.minutes * 60.0]:
+                del self._rings[other]
+
+    def snapshot(self, stages=None, sensors=None, since=None, epoch=None, now=None) -> dict:
+        """Historial para un cliente. ``since`` sólo se respeta si ``epoch``
+        coincide; si ya salió del anillo, ``gap`` indica que falta un tramo."""
+        now = time.time() if now is None else now
+        resume = since is not None and epoch == self.epoch
+        with self._lock:
+            batches = []
+            gap = since is not None and not resume
+            for stage_id, ring in self._rings.items():
+                if stages is not None and stage_id not in stages:
+                    continue
+                data, missed = ring.select(since if resume else None, now - self.minutes * 60.0, sensors)
+                gap = gap or missed
+                batches.append({'stage': stage_id, **data})
+            return {
+                'type': 'replay',
+                'epoch': self.epoch,
+                'last_seq': self.last_seq,
+                'gap': gap,
+                'stages': batches,
+            }
+
+
+def replay_request(query_string, reply_channel):
+    """Pedido de historial según la query del WebSocket, o None si no lo pide.
+
+    ``?replay=1`` (comprimido con zlib, frame binario) o ``?replay=json``;
+    ``&since=<seq>&epoch=<epoch>`` al reconectarse. ``stage`` y ``sensors``
+    filtran igual que los grupos.
+    """
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode('latin-1')
+    params = {k: v[0] for k, v in parse_qs(query_string or '').items()}
+    mode = params.get('replay', '0')
+    if mode in ('', '0', 'false'):
+        return None
+    since = params.get('since', '')
+    stage = params.get('stage', '')
+    return {
+        'type': 'replay.request',
+        'reply_channel': reply_channel,
+        'stage': int(stage) if stage.isdigit() else None,
+        'sensors': [s for s in params.get('sensors', '').split(',') if s] or None,
+        'since': int(since) if since.isdigit() else None,
+        'epoch': params.get('epoch'),
+        'compress': mode != 'json',
+    }
+
+
+async def serve_replay(channel_layer, replay: ReplayBuffer):
+    """Atiende los pedidos ``replay.request`` de ``REPLAY_CHANNEL``."""
+    while True:
+        try:
+            request = await channel_layer.receive(REPLAY_CHANNEL)
+            stage = request.get('stage')
+            snapshot = replay.snapshot(
+                stages=None if stage is None else {int(stage)},
+                sensors=set(request['sensors']) if request.get('sensors') else None,
+                since=request.get('since'),
+                epoch=request.get('epoch'),
+            )
+            await channel_layer.send(request['reply_channel'], {'type': 'replay.batch', 'data': snapshot})
+        except Exception as e:
+            print(f"Error atendiendo pedido de historial: {e}")
@@ -0,0 +1,98 @@
+"""Caché en disco de reportes generados, direccionada por contenido.
+
+Cada archivo se guarda en ``MEDIA_ROOT/report_cache/`` con un nombre que es
+el hash de todo lo que determina su contenido (etapa y sus parámetros,
+última lectura, día, formato y ``TEMPLATE_VERSION``). Si nada de eso cambió
+el archivo se sirve tal cual, sin recalcular; el mismo hash sirve de ETag.
+
+El tamaño total se limita a ``REPORT_CACHE_MAX_BYTES``: al superarlo se
+borran los archivos usados hace más tiempo (LRU por fecha de modificación,
+que se actualiza en cada acierto).
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+
+# Subir al cambiar el contenido o formato de los reportes cacheados
+TEMPLATE_VERSION = 1
+
+
+def cache_dir() -> str:
+    return os.path.join(settings.MEDIA_ROOT, 'report_cache')
+
+
+def cache_key(**parts) -> str:
+    parts['template_version'] = TEMPLATE_VERSION
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _path(key, ext) -> str:
+    return os.path.join(cache_dir(), f'{key}.{ext}')
+
+
+def get(key, ext):
+    """Ruta del archivo cacheado o None; marca el archivo como usado."""
+    path = _path(key, ext)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def put(key, ext, data: bytes) -> str:
+    """Guarda el archivo de forma atómica y aplica el límite de tamaño."""
+    os.makedirs(cache_dir(), exist_ok=True)
+    path = _path(key, ext)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir(), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    evict(keep=path)
+    return path
+
+
+def get_or_render(key, ext, render):
+    """Ruta del archivo; ``render()`` (-> bytes) sólo se llama si no está."""
+    return get(key, ext) or put(key, ext, render())
+
+
+def evict(max_bytes=None, keep=None) -> int:
+    """Borra los archivos menos usados hasta quedar bajo ``max_bytes``.
+    Devuelve la cantidad de bytes liberados."""
+    if max_bytes is None:
+        max_bytes = getattr(settings, 'REPORT_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+    try:
+        entries = [entry for entry in os.scandir(cache_dir()) if entry.is_file() and not entry.name.endswith('.tmp')]
+    except FileNotFoundError:
+        return 0
+    files = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _mtime, size, _path in files)
+    freed = 0
+    for _mtime, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        freed += size
+    return freed
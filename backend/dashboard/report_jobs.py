@@ -0,0 +1,226 @@
+"""Cola de generación de reportes respaldada por la base de datos.
+
+Las vistas sólo crean un ``ReportJob`` y responden 202; el proceso
+``manage.py report_worker`` toma los trabajos pendientes con
+``SELECT ... FOR UPDATE SKIP LOCKED`` (varios workers no se pisan y no hace
+falta un broker externo), calcula las series, renderiza PDF, Excel y CSV en
+paralelo en un pool de procesos y avisa por WebSocket al terminar.
+"""
+import os
+import socket
+from datetime import datetime, timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils import timezone
+
+from biocalculadora.series_cache import expected_series
+
+from .models import Report, ReportJob
+from .report_render import RENDERERS
+from .rollups import stage_production_series
+
+# Grupo de Channels al que se unen los WebSockets de /ws/mqtt/
+REPORT_GROUP = "report_jobs"
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(kind, *, stage=None, report=None, user=None, **params) -> ReportJob:
+    job = ReportJob.objects.create(
+        kind=kind,
+        stage=stage if stage is not None else getattr(report, 'stage', None),
+        report=report,
+        user=user if user is not None and user.is_authenticated else None,
+        params=params,
+    )
+    notify(job)
+    return job
+
+
+def claim_job(worker=None):
+    """Marca como RUNNING el trabajo pendiente más antiguo y lo devuelve."""
+    with transaction.atomic():
+        job = (
+            ReportJob.objects.select_for_update(skip_locked=True)
+            .filter(status='PENDING')
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = 'RUNNING'
+        job.started_at = timezone.now()
+        job.attempts += 1
+        job.worker = worker or worker_name()
+        job.save(update_fields=['status', 'started_at', 'attempts', 'worker'])
+    return job
+
+
+def requeue_stale(timeout=None, max_attempts=None) -> int:
+    """Devuelve a la cola los trabajos RUNNING de un worker que murió."""
+    timeout = timeout or getattr(settings, 'REPORT_JOB_TIMEOUT', 600)
+    max_attempts = max_attempts or getattr(settings, 'REPORT_JOB_MAX_ATTEMPTS', 3)
+    stale = ReportJob.objects.filter(status='RUNNING', started_at__lt=timezone.now() - timedelta(seconds=timeout))
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status='ERROR', error='Tiempo de generación agotado', finished_at=timezone.now(),
+    )
+    return stale.update(status='PENDING') + failed
+
+
+def build_context(stage, report_type, inferences=None, observations='') -> dict:
+    """Series y totales del reporte en datos planos (para ``report_render``)."""
+    series = expected_series(
+        material_type=stage.material_type,
+        vs_kg_per_day=stage.material_amount_kg,
+        reactor_volume_m3=None,
+        temperature_c=stage.temperature_c,
+    )
+    start_time = stage.created_at
+    end_time = datetime.now()
+    actual = stage_production_series(stage, start_time, end_time)
+    days_actual = actual['days']
+    daily_actual = actual['daily_biogas_m3']
+
+    expected_daily = list(series.get('daily_biogas_m3', [0.0] * len(days_actual)))
+    # Igualar longitudes por seguridad
+    if len(expected_daily) < len(days_actual):
+        expected_daily = expected_daily + [0.0] * (len(days_actual) - len(expected_daily))
+    elif len(expected_daily) > len(days_actual):
+        expected_daily = expected_daily[:len(days_actual)]
+
+    production_estimated = float(sum(expected_daily))
+    production_real = float(sum(daily_actual))
+
+    # Inferencias en base a datos (simple comparativa %)
+    diff = production_real - production_estimated
+    perc = (diff / production_estimated * 100.0) if production_estimated > 0 else 0.0
+    trend = "por encima" if diff > 0 else ("por debajo" if diff < 0 else "igual a")
+    inferences_text = inferences or (
+        f"La producción real ({production_real:.2f} m3) está {trend} de la estimada ({production_estimated:.2f} m3) en {abs(perc):.1f}%."
+    )
+
+    return {
+        'stage': {
+            'number': stage.number,
+            'material_type': stage.material_type,
+            'material_amount_kg': stage.material_amount_kg,
+            'temperature_c': stage.temperature_c,
+        },
+        'report_type': report_type,
+        'start_date': start_time.date().isoformat(),
+        'days': days_actual,
+        'expected_daily': expected_daily,
+        'daily_actual': daily_actual,
+        'cumulative_actual': actual['cumulative_biogas_m3'],
+        'production_estimated': production_estimated,
+        'production_real': production_real,
+        'inferences': inferences_text,
+        'observations': observations or '',
+    }
+
+
+def render_files(ctx, pool=None) -> dict:
+    """{formato: bytes}; con ``pool`` los formatos se generan en paralelo."""
+    if pool is None:
+        return {name: render(ctx) for name, (render, _ext) in RENDERERS.items()}
+    futures = {name: pool.submit(render, ctx) for name, (render, _ext) in RENDERERS.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def run_job(job, pool=None):
+    """Ejecuta un trabajo ya reclamado y deja su estado final guardado."""
+    try:
+        params = job.params or {}
+        if job.kind == 'regenerate':
+            report = job.report
+            if report is None:
+                raise ValueError("El reporte a regenerar ya no existe")
+            stage = report.stage
+            # Si no hay inferencias u observaciones, se generan de nuevo
+            ctx = build_context(stage, report.report_type, report.inferences, report.observations)
+            report.production_estimated = ctx['production_estimated']
+            report.production_real = ctx['production_real']
+            report.inferences = ctx['inferences']
+        else:
+            stage = job.stage
+            if stage is None:
+                raise ValueError("La etapa del reporte ya no existe")
+            report_type = params.get('report_type', 'normal')
+            ctx = build_context(stage, report_type, params.get('inferences'), params.get('observations', ''))
+            # Un reintento reutiliza el reporte que guardó el intento anterior
+            report = job.report or Report(user=job.user, stage=stage, report_type=report_type)
+            report.observations = ctx['observations']
+            report.inferences = ctx['inferences']
+            report.production_estimated = ctx['production_estimated']
+            report.production_real = ctx['production_real']
+
+        # Se renderiza antes de guardar: si falla no queda un Report sin archivos
+        files = render_files(ctx, pool)
+        with transaction.atomic():
+            report.save()
+            for name, (_render, ext) in RENDERERS.items():
+                if files.get(name):
+                    getattr(report, f'file_{name}').save(f"reporte_{report.id}.{ext}", ContentFile(files[name]), save=False)
+            report.save()
+            job.report = report
+            job.save(update_fields=['report'])
+
+            # Si es final, cerrar la etapa
+            if job.kind == 'create' and report.report_type == 'final' and stage.active:
+                stage.active = False
+                stage.save()
+
+        job.status = 'DONE'
+        job.error = ''
+    except Exception as e:
+        print(f"Error generando reporte (trabajo {job.id}): {e}")
+        job.status = 'ERROR'
+        job.error = str(e)
+        # Descarta el reporte de un guardado revertido
+        job.refresh_from_db(fields=['report'])
+    job.finished_at = timezone.now()
+    job.save(update_fields=['report', 'status', 'error', 'finished_at'])
+    notify(job)
+    return job
+
+
+def job_payload(job) -> dict:
+    report = job.report
+    payload = {
+        'job_id': job.id,
+        'kind': job.kind,
+        'status': job.status,
+        'report_id': report.id if report else None,
+        'stage_id': job.stage_id,
+        'error': job.error or None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'status_url': f"/api/dashboard/report/jobs/{job.id}/",
+    }
+    for name in RENDERERS:
+        has_file = report is not None and bool(getattr(report, f'file_{name}'))
+        payload[f'{name}_url'] = f"/api/dashboard/report/download/{report.id}/{name}/" if has_file else None
+    if job.stage is not None:
+        payload['stage_active'] = job.stage.active
+    return payload
+
+
+def notify(job):
+    """Publica el estado del trabajo a los WebSockets conectados."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(REPORT_GROUP, {
+            'type': 'report.job',
+            'data': {'type': 'report_job', **job_payload(job)},
+        })
+    except Exception as e:
+        print(f"Error notificando trabajo de reporte: {e}")
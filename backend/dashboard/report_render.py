@@ -0,0 +1,213 @@
+"""Renderizado de los archivos de un reporte (PDF, Excel y CSV).
+
+Las funciones ``render_*`` no usan Django: reciben un contexto con datos
+planos (ver ``report_jobs.build_context``) y devuelven bytes, así el worker
+de reportes puede generar los tres formatos en paralelo en un
+``ProcessPoolExecutor``.
+"""
+import io
+from datetime import datetime
+from types import SimpleNamespace
+
+import pandas as pd
+try:
+    from reportlab.pdfgen import canvas
+    # Estilos bonitos con Platypus
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib import colors
+    from reportlab.lib.units import cm
+except ImportError:
+    canvas = None
+    SimpleDocTemplate = None
+
+REPORT_TYPE_LABELS = {
+    'normal': 'Reporte regular',
+    'final': 'Reporte final de producción',
+}
+
+
+# Utilidad: construir PDF con mejor estética usando ReportLab Platypus
+def build_pretty_report_pdf(*, stage, report_type_label: str, production_estimated: float, production_real: float, inferences_text: str, observations_text: str) -> bytes:
+    if SimpleDocTemplate is None:
+        # Si no hay reportlab, no podemos construir PDF bonito
+        return b""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        leftMargin=2*cm,
+        rightMargin=2*cm,
+        topMargin=2*cm,
+        bottomMargin=2*cm,
+        title="Reporte Biogestor ULSA"
+    )
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(name='TitleCenter', parent=styles['Title'], alignment=1, textColor=colors.HexColor('#1b5e20')))
+    styles.add(ParagraphStyle(name='SectionHeader', parent=styles['Heading4'], textColor=colors.HexColor('#2e7d32')))
+    styles.add(ParagraphStyle(name='Meta', parent=styles['Normal'], textColor=colors.HexColor('#424242')))
+    story = []
+
+    # Título
+    story.append(Paragraph('Sistema Biogestor ULSA', styles['TitleCenter']))
+    story.append(Paragraph(report_type_label, styles['Meta']))
+    story.append(Spacer(1, 12))
+
+    # Tabla de resumen
+    resumen_data = [
+        ['Etapa', f"#{stage.number}"],
+        ['Material', stage.material_type],
+        ['Cantidad (kg)', f"{stage.material_amount_kg}"],
+        ['Temperatura (°C)', f"{stage.temperature_c}"],
+        ['Producción estimada (m3)', f"{production_estimated:.2f}"],
+        ['Producción real (m3)', f"{production_real:.2f}"],
+    ]
+    tbl = Table(resumen_data, colWidths=[6*cm, 9*cm])
+    tbl.setStyle(TableStyle([
+        ('BACKGROUND', (0,0), (0,-1), colors.HexColor('#f1f8e9')),
+        ('TEXTCOLOR', (0,0), (0,-1), colors.HexColor('#2e7d32')),
+        ('FONTNAME', (0,0), (-1,-1), 'Helvetica'),
+        ('FONTSIZE', (0,0), (-1,-1), 10),
+        ('BOX', (0,0), (-1,-1), 0.5, colors.HexColor('#c8e6c9')),
+        ('INNERGRID', (0,0), (-1,-1), 0.25, colors.HexColor('#c8e6c9')),
+        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+        ('LEFTPADDING', (0,0), (-1,-1), 6),
+        ('RIGHTPADDING', (0,0), (-1,-1), 6),
+        ('TOPPADDING', (0,0), (-1,-1), 4),
+        ('BOTTOMPADDING', (0,0), (-1,-1), 4),
+    ]))
+    story.append(tbl)
+    story.append(Spacer(1, 16))
+
+    # Inferencias
+    story.append(Paragraph('Inferencias', styles['SectionHeader']))
+    story.append(Spacer(1, 6))
+    story.append(Paragraph(inferences_text or '-', styles['Normal']))
+    story.append(Spacer(1, 14))
+
+    # Comentarios
+    story.append(Paragraph('Comentarios', styles['SectionHeader']))
+    story.append(Spacer(1, 6))
+    story.append(Paragraph(observations_text or '-', styles['Normal']))
+    story.append(Spacer(1, 14))
+
+    # Pie de página simple (fecha)
+    ts = datetime.now().strftime('%Y-%m-%d %H:%M')
+    story.append(Paragraph(f"Generado: {ts}", styles['Meta']))
+
+    doc.build(story)
+    pdf_bytes = buffer.getvalue()
+    buffer.close()
+    return pdf_bytes
+
+
+def report_type_label(report_type: str) -> str:
+    return REPORT_TYPE_LABELS.get(report_type, REPORT_TYPE_LABELS['final'])
+
+
+def data_frame(ctx: dict) -> pd.DataFrame:
+    """Serie diaria esperada vs real del reporte."""
+    days = ctx['days']
+    expected_daily = ctx['expected_daily']
+    df = pd.DataFrame({
+        'Día': days,
+        'Fecha': pd.date_range(start=ctx['start_date'], periods=len(days)) if days else pd.Series([], dtype='datetime64[ns]'),
+        'Producción Esperada (m3/día)': expected_daily,
+        'Producción Real (m3/día)': ctx['daily_actual'],
+        'Acumulado Real (m3)': ctx['cumulative_actual'],
+    })
+    df['Acumulado Esperado (m3)'] = pd.Series(expected_daily).cumsum() if len(expected_daily) else 0.0
+    return df
+
+
+def render_excel(ctx: dict) -> bytes:
+    """Excel con portada (Resumen) y hoja de datos."""
+    stage = ctx['stage']
+    excel_buffer = io.BytesIO()
+    # Usar engine por defecto de pandas; reduce dependencias
+    with pd.ExcelWriter(excel_buffer) as writer:
+        cover = pd.DataFrame({
+            'Campo': ['Sistema', 'Tipo de reporte', 'Etapa', 'Material', 'Cantidad (kg)', 'Temperatura (°C)', 'Producción estimada (m3)', 'Producción real (m3)', 'Inferencias', 'Comentarios'],
+            'Valor': [
+                'Sistema Biogestor ULSA',
+                report_type_label(ctx['report_type']),
+                f"#{stage['number']}",
+                stage['material_type'],
+                stage['material_amount_kg'],
+                stage['temperature_c'],
+                round(ctx['production_estimated'], 2),
+                round(ctx['production_real'], 2),
+                ctx['inferences'],
+                ctx['observations'],
+            ]
+        })
+        cover.to_excel(writer, index=False, sheet_name='Resumen')
+        data_frame(ctx).to_excel(writer, index=False, sheet_name='Datos')
+    return excel_buffer.getvalue()
+
+
+def render_csv(ctx: dict) -> bytes:
+    csv_buffer = io.StringIO()
+    data_frame(ctx).to_csv(csv_buffer, index=False)
+    return csv_buffer.getvalue().encode('utf-8')
+
+
+def render_pdf(ctx: dict) -> bytes:
+    """PDF de resumen; vacío si ReportLab no está instalado."""
+    return build_pretty_report_pdf(
+        stage=SimpleNamespace(**ctx['stage']),
+        report_type_label=report_type_label(ctx['report_type']),
+        production_estimated=ctx['production_estimated'],
+        production_real=ctx['production_real'],
+        inferences_text=ctx['inferences'],
+        observations_text=ctx['observations'],
+    )
+
+
+def comparison_frame(ctx: dict) -> pd.DataFrame:
+    """Tabla del reporte actual vs esperado (``CurrentReportAPIView``)."""
+    days = ctx['days']
+    return pd.DataFrame({
+        'Día': days,
+        'Fecha': pd.date_range(start=ctx['start_date'], periods=len(days)),
+        'Producción Esperada (m3)': ctx['expected_daily'],
+        'Producción Real (m3)': ctx['daily_actual'],
+        'Acumulado Real (m3)': ctx['cumulative_actual'],
+    })
+
+
+def render_comparison_excel(ctx: dict) -> bytes:
+    output = io.BytesIO()
+    # Usar engine por defecto de pandas (openpyxl normalmente)
+    with pd.ExcelWriter(output) as writer:
+        comparison_frame(ctx).to_excel(writer, index=False, sheet_name='Reporte')
+    return output.getvalue()
+
+
+def render_comparison_pdf(ctx: dict) -> bytes:
+    if canvas is None:
+        return b""
+    df = comparison_frame(ctx)
+    output = io.BytesIO()
+    c = canvas.Canvas(output)
+    c.setFont("Helvetica", 14)
+    c.drawString(50, 800, f"Reporte de Producción Actual vs Esperada - Llenado #{ctx['stage']['number']}")
+    c.setFont("Helvetica", 10)
+    y = 780
+    for i, row in df.iterrows():
+        c.drawString(50, y, f"Día {int(row['Día'])} | Fecha: {row['Fecha'].date()} | Esperada: {row['Producción Esperada (m3)']:.2f} | Real: {row['Producción Real (m3)']:.2f} | Acumulado: {row['Acumulado Real (m3)']:.2f}")
+        y -= 16
+        if y < 50:
+            c.showPage()
+            y = 800
+    c.save()
+    return output.getvalue()
+
+
+# Formato -> (función, extensión del archivo)
+RENDERERS = {
+    'pdf': (render_pdf, 'pdf'),
+    'excel': (render_excel, 'xlsx'),
+    'csv': (render_csv, 'csv'),
+}
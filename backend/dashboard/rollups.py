@@ -0,0 +1,340 @@
+"""Resúmenes (rollups) por hora y por día de las lecturas de cada etapa.
+
+Las vistas de producción y reportes leen ``SensorRollup`` en lugar de
+recorrer todas las lecturas de la etapa, así que su costo depende del
+número de días y no del tiempo que lleve corriendo el llenado.
+
+Los rollups por hora se actualizan de forma incremental al guardar cada lote
+de lecturas (``update_rollups``); los diarios se recalculan a partir de las
+horas del día afectado. La producción de gas de cada lectura sale del mismo
+``GasAccumulator`` que usa ``aggregation``, cuyo estado (último acumulado y
+último instante) queda guardado en el rollup de la última hora para
+continuar en el siguiente lote. Si llegan lecturas con fecha anterior a la
+última procesada se recalculan sólo los días afectados con ``rebuild_rollups``.
+
+Las lecturas guardadas antes de existir los rollups se incorporan con la
+migración 0012 (``backfill_reading_columns`` y luego ``rebuild_rollups``).
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+import pandas as pd
+from django.db import IntegrityError, transaction
+from django.db.models import Min
+
+from .aggregation import GAS_FIELDS, GasAccumulator, _positive, columns_from_rows, iter_columns, project_daily, to_us
+from .models import SensorReading, SensorRollup
+
+ROLLUP_FIELDS = GAS_FIELDS + ('biol_flow', 'pressure_hpa', 'temperature_c')
+STAT_FIELDS = (
+    'gas_m3', 'biol_m3',
+    'pressure_min', 'pressure_max', 'pressure_avg', 'pressure_count',
+    'temperature_min', 'temperature_max', 'temperature_avg', 'temperature_count',
+    'count', 'last_reading_at', 'last_gas_total_m3',
+)
+_US_PER_HOUR = 3_600_000_000
+
+# Cómo se combinan las columnas de dos intervalos consecutivos
+_REGROUP = {
+    'gas_m3': 'sum',
+    'biol_m3': 'sum',
+    'pressure_min': 'min',
+    'pressure_max': 'max',
+    'pressure_sum': 'sum',
+    'pressure_count': 'sum',
+    'temperature_min': 'min',
+    'temperature_max': 'max',
+    'temperature_sum': 'sum',
+    'temperature_count': 'sum',
+    'count': 'sum',
+    'last_ts_us': 'max',
+    'last_total': 'last',
+}
+
+
+def _hour_start(hour_index) -> datetime:
+    return datetime.fromtimestamp(int(hour_index) * 3600, tz=dt_timezone.utc)
+
+
+def _floor_day(moment) -> datetime:
+    hour = int(to_us([moment])[0] // _US_PER_HOUR)
+    return _hour_start(hour - hour % 24)
+
+
+def _value(x):
+    return None if x is None or (isinstance(x, float) and np.isnan(x)) else float(x)
+
+
+def hourly_frame(cols, acc: GasAccumulator) -> pd.DataFrame:
+    """Agrega por hora un bloque de lecturas ordenadas y avanza ``acc``.
+
+    El índice es el número de hora desde epoch; las columnas son las de
+    ``_REGROUP``, así que varios bloques se combinan con ``regroup``.
+    """
+    prior_total = acc.last_total
+    gas = acc.deltas(cols)
+    ts = cols['ts_us']
+    # Último acumulado conocido al cierre de cada lectura
+    total = pd.Series(cols['gas_total_m3']).ffill()
+    if prior_total is not None:
+        total = total.fillna(prior_total)
+    df = pd.DataFrame({
+        'hour': ts // _US_PER_HOUR,
+        'gas': gas,
+        'biol': _positive(cols['biol_flow']),
+        'pressure': cols['pressure_hpa'],
+        'temperature': cols['temperature_c'],
+        'ts_us': ts,
+        'total': total.to_numpy(),
+    })
+    return df.groupby('hour', sort=True).agg(
+        gas_m3=('gas', 'sum'),
+        biol_m3=('biol', 'sum'),
+        pressure_min=('pressure', 'min'),
+        pressure_max=('pressure', 'max'),
+        pressure_sum=('pressure', 'sum'),
+        pressure_count=('pressure', 'count'),
+        temperature_min=('temperature', 'min'),
+        temperature_max=('temperature', 'max'),
+        temperature_sum=('temperature', 'sum'),
+        temperature_count=('temperature', 'count'),
+        count=('ts_us', 'size'),
+        last_ts_us=('ts_us', 'max'),
+        last_total=('total', 'last'),
+    )
+
+
+def regroup(frame: pd.DataFrame, keys) -> pd.DataFrame:
+    """Combina filas de ``hourly_frame`` con la misma clave (hora o día)."""
+    return frame.groupby(keys, sort=True).agg(_REGROUP)
+
+
+def _stats_from_rollup(rollup) -> dict:
+    stats = {name: getattr(rollup, name) for name in ('gas_m3', 'biol_m3', 'count')}
+    for metric in ('pressure', 'temperature'):
+        n = getattr(rollup, f'{metric}_count')
+        avg = getattr(rollup, f'{metric}_avg')
+        stats[f'{metric}_min'] = getattr(rollup, f'{metric}_min')
+        stats[f'{metric}_max'] = getattr(rollup, f'{metric}_max')
+        stats[f'{metric}_sum'] = avg * n if n and avg is not None else 0.0
+        stats[f'{metric}_count'] = n
+    stats['last_ts_us'] = int(to_us([rollup.last_reading_at])[0]) if rollup.last_reading_at else None
+    stats['last_total'] = rollup.last_gas_total_m3
+    return stats
+
+
+def _combine(a, b) -> dict:
+    """Estadísticas de dos intervalos consecutivos (``b`` posterior a ``a``)."""
+    if a is None:
+        return b
+    out = {}
+    for name, how in _REGROUP.items():
+        x, y = _value(a[name]), _value(b[name])
+        if x is None or y is None:
+            out[name] = y if x is None else x
+        elif how == 'sum':
+            out[name] = x + y
+        elif how == 'min':
+            out[name] = min(x, y)
+        elif how == 'max':
+            out[name] = max(x, y)
+        else:
+            out[name] = y
+    return out
+
+
+def _apply(rollup, stats):
+    rollup.gas_m3 = _value(stats['gas_m3']) or 0.0
+    rollup.biol_m3 = _value(stats['biol_m3']) or 0.0
+    for metric in ('pressure', 'temperature'):
+        n = int(stats[f'{metric}_count'] or 0)
+        setattr(rollup, f'{metric}_min', _value(stats[f'{metric}_min']))
+        setattr(rollup, f'{metric}_max', _value(stats[f'{metric}_max']))
+        setattr(rollup, f'{metric}_avg', stats[f'{metric}_sum'] / n if n else None)
+        setattr(rollup, f'{metric}_count', n)
+    rollup.count = int(stats['count'] or 0)
+    last_ts = _value(stats['last_ts_us'])
+    rollup.last_reading_at = (
+        datetime.fromtimestamp(0, tz=dt_timezone.utc) + timedelta(microseconds=int(last_ts))
+        if last_ts is not None else None
+    )
+    rollup.last_gas_total_m3 = _value(stats['last_total'])
+    return rollup
+
+
+def _build(stage_id, granularity, frame, hours_per_bucket=1) -> list:
+    return [
+        _apply(
+            SensorRollup(stage_id=stage_id, granularity=granularity, bucket_start=_hour_start(key * hours_per_bucket)),
+            row,
+        )
+        for key, row in zip(frame.index, frame.to_dict('records'))
+    ]
+
+
+def _accumulator_from(rollup) -> GasAccumulator:
+    acc = GasAccumulator()
+    if rollup is not None:
+        acc.last_total = rollup.last_gas_total_m3
+        if rollup.last_reading_at is not None:
+            acc.last_ts_us = int(to_us([rollup.last_reading_at])[0])
+    return acc
+
+
+def _last_hour(stage_id, before=None):
+    qs = SensorRollup.objects.filter(stage_id=stage_id, granularity='hour')
+    if before is not None:
+        qs = qs.filter(bucket_start__lt=before)
+    return qs.order_by('-bucket_start').first()
+
+
+def _refresh_days(stage_id, day_indexes):
+    """Recalcula los rollups diarios a partir de los de cada hora."""
+    for day in sorted(day_indexes):
+        start = _hour_start(day * 24)
+        hours = SensorRollup.objects.filter(
+            stage_id=stage_id, granularity='hour',
+            bucket_start__gte=start, bucket_start__lt=start + timedelta(days=1),
+        ).order_by('bucket_start')
+        stats = None
+        for hour in hours:
+            stats = _combine(stats, _stats_from_rollup(hour))
+        if stats is None:
+            SensorRollup.objects.filter(stage_id=stage_id, granularity='day', bucket_start=start).delete()
+            continue
+        rollup = SensorRollup.objects.filter(stage_id=stage_id, granularity='day', bucket_start=start).first()
+        if rollup is not None:
+            _apply(rollup, stats).save()
+            continue
+        try:
+            with transaction.atomic():
+                _apply(SensorRollup(stage_id=stage_id, granularity='day', bucket_start=start), stats).save()
+        except IntegrityError:
+            # Creado a la vez por otro vaciado: se reescribe con estas horas
+            rollup = SensorRollup.objects.select_for_update().get(stage_id=stage_id, granularity='day', bucket_start=start)
+            _apply(rollup, stats).save()
+
+
+def _merge_hours(stage_id, frame):
+    """Suma ``frame`` a los rollups por hora existentes o crea los que faltan."""
+    buckets = [_hour_start(h) for h in frame.index]
+    existing = {
+        r.bucket_start: r
+        for r in SensorRollup.objects.select_for_update().filter(
+            stage_id=stage_id, granularity='hour', bucket_start__in=buckets,
+        )
+    }
+    created, updated = [], []
+    for bucket, stats in zip(buckets, frame.to_dict('records')):
+        rollup = existing.get(bucket)
+        if rollup is None:
+            created.append(_apply(SensorRollup(stage_id=stage_id, granularity='hour', bucket_start=bucket), stats))
+        else:
+            updated.append(_apply(rollup, _combine(_stats_from_rollup(rollup), stats)))
+    SensorRollup.objects.bulk_create(created)
+    if updated:
+        SensorRollup.objects.bulk_update(updated, STAT_FIELDS)
+
+
+def update_rollups(readings):
+    """Incorpora a los rollups lecturas ya guardadas (de una o varias etapas)."""
+    by_stage = {}
+    for reading in readings:
+        if reading.stage_id is not None:
+            by_stage.setdefault(reading.stage_id, []).append(reading)
+
+    for stage_id, items in by_stage.items():
+        items.sort(key=lambda r: r.timestamp)
+        cols = columns_from_rows([tuple(getattr(r, f) for f in ROLLUP_FIELDS) for r in items], ROLLUP_FIELDS)
+        with transaction.atomic():
+            acc = _accumulator_from(_last_hour(stage_id))
+            if acc.last_ts_us is not None and cols['ts_us'][0] < acc.last_ts_us:
+                # Lecturas atrasadas: el estado del acumulador ya avanzó, se
+                # recalculan sólo sus días (ya guardadas, entran solas). Los
+                # días siguientes conservan sus rollups; `rebuild_rollups`
+                # completo los reajusta si hiciera falta.
+                last_late = items[int(np.flatnonzero(cols['ts_us'] < acc.last_ts_us)[-1])].timestamp
+                rebuild_rollups(stage_id, start=items[0].timestamp, end=last_late)
+                rebuilt_until = _floor_day(last_late) + timedelta(days=1)
+                items = [r for r in items if r.timestamp >= rebuilt_until]
+                if not items:
+                    continue
+                cols = columns_from_rows([tuple(getattr(r, f) for f in ROLLUP_FIELDS) for r in items], ROLLUP_FIELDS)
+                acc = _accumulator_from(_last_hour(stage_id))
+            frame = hourly_frame(cols, acc)
+            try:
+                with transaction.atomic():
+                    _merge_hours(stage_id, frame)
+            except IntegrityError:
+                # Otro vaciado creó la misma hora entre la consulta y el
+                # insert: ya existe, así que se suma como actualización
+                _merge_hours(stage_id, frame)
+            _refresh_days(stage_id, {int(h) // 24 for h in frame.index})
+
+
+def rebuild_rollups(stage_id, start=None, end=None, chunk_size=None) -> int:
+    """Recalcula desde las lecturas los rollups de una etapa.
+
+    ``start``/``end`` limitan el recálculo a días completos (UTC); el
+    acumulador de gas continúa desde el rollup de la hora anterior a
+    ``start``. Sin ``start`` se parte de la primera lectura que exista, así
+    se conservan los rollups de meses cuyas lecturas ya eliminó la
+    retención (ver ``dashboard/partitions.py``). Devuelve la cantidad de
+    lecturas procesadas.
+    """
+    readings = SensorReading.objects.filter(stage_id=stage_id)
+    rollups = SensorRollup.objects.filter(stage_id=stage_id)
+    if start is None:
+        start = readings.aggregate(first=Min('timestamp'))['first']
+        if start is None:
+            return 0
+    start = _floor_day(start)
+    readings = readings.filter(timestamp__gte=start)
+    rollups = rollups.filter(bucket_start__gte=start)
+    if end is not None:
+        end = _floor_day(end) + timedelta(days=1)
+        readings = readings.filter(timestamp__lt=end)
+        rollups = rollups.filter(bucket_start__lt=end)
+
+    with transaction.atomic():
+        acc = _accumulator_from(_last_hour(stage_id, before=start))
+        frames = [
+            hourly_frame(cols, acc)
+            for cols in iter_columns(readings, ROLLUP_FIELDS, chunk_size=chunk_size)
+        ]
+
+        rollups.delete()
+        if not frames:
+            return 0
+        hours = pd.concat(frames)
+        # Un bloque puede terminar a mitad de una hora
+        hours = regroup(hours, hours.index)
+        days = regroup(hours, hours.index // 24)
+        SensorRollup.objects.bulk_create(
+            _build(stage_id, 'hour', hours) + _build(stage_id, 'day', days, hours_per_bucket=24),
+            batch_size=1000,
+        )
+        return int(hours['count'].sum())
+
+
+def daily_production(start_date, end_date, stage=None) -> dict:
+    """Producción diaria {'YYYY-MM-DD': m3} desde los rollups diarios.
+
+    Sin ``stage`` se suman todas las etapas. Sólo incluye días con lecturas.
+    """
+    qs = SensorRollup.objects.filter(
+        granularity='day', bucket_start__date__gte=start_date, bucket_start__date__lte=end_date,
+    )
+    if stage is not None:
+        qs = qs.filter(stage=stage)
+    daily_map = {}
+    for bucket_start, gas_m3 in qs.order_by('bucket_start').values_list('bucket_start', 'gas_m3'):
+        key = bucket_start.astimezone(dt_timezone.utc).date().isoformat()
+        daily_map[key] = daily_map.get(key, 0.0) + gas_m3
+    return daily_map
+
+
+def stage_production_series(stage, start_time, end_time) -> dict:
+    """Serie real (días, diaria, acumulada) de una etapa entre dos instantes."""
+    start_date, end_date = start_time.date(), end_time.date()
+    return project_daily(daily_production(start_date, end_date, stage=stage), start_date, end_date)
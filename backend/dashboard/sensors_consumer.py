@@ -1,22 +1,158 @@
 import json
 import asyncio
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from datetime import datetime
+from .frames import FrameEncoder, check_aggregate, requested_encoding
+from .ingest import get_ingest_service, ingest_embedded
+from .models import SensorReading
+from .stage_cache import get_active_stage
+from .streams import ALERT_GROUP, StreamOutbox, latest_values, parse_subscription, requested_groups, sensor_values
+
+# Gráficos que ofrece ws/sensors/; sus ids son también los campos del
+# esquema de los frames "packed" (se define en el mensaje sensor_list)
+SENSOR_CHARTS = [
+    {
+        "id": "temperature",
+        "title": "Temperatura",
+        "description": "Temperatura del biodigestor en tiempo real",
+        "unit": "°C",
+        "color": "#26a69a",
+        "icon": "fas fa-thermometer-half",
+        "status": "Estable"
+    },
+    {
+        "id": "ph",
+        "title": "Nivel de pH",
+        "description": "Seguimiento de la acidez/alcalinidad",
+        "unit": "pH",
+        "color": "#42a5f5",
+        "icon": "fas fa-flask",
+        "status": "Neutro"
+    },
+    {
+        "id": "pressure",
+        "title": "Presión de Gas",
+        "description": "Niveles de presión dentro del biodigestor",
+        "unit": "bar",
+        "color": "#ffa726",
+        "icon": "fas fa-tachometer-alt",
+        "status": "Óptima"
+    },
+    {
+        "id": "gas_production",
+        "title": "Producción de Biogás",
+        "description": "Volumen de biogás generado por día",
+        "unit": "m³/día",
+        "color": "#7e57c2",
+        "icon": "fas fa-gas-pump",
+        "status": "Alta"
+    },
+    {
+        "id": "humidity",
+        "title": "Humedad",
+        "description": "Nivel de humedad del sustrato",
+        "unit": "%",
+        "color": "#66bb6a",
+        "icon": "fas fa-tint",
+        "status": "Normal"
+    }
+]
+
+# Gráfico -> (clave del payload MQTT, factor de conversión a su unidad)
+CHART_SOURCES = {
+    "temperature": ("temperatura", 1.0),
+    "ph": ("ph", 1.0),
+    "pressure": ("presion", 0.001),  # hPa -> bar
+    "gas_production": ("caudal_gas", 24.0),  # m3/h -> m3/día
+    "humidity": ("humedad", 1.0),
+}
+
+
+def chart_values(values: dict) -> dict:
+    """Valores del payload expresados con los ids y unidades de SENSOR_CHARTS;
+    los sensores sin gráfico pasan con su nombre."""
+    charted = {}
+    for chart_id, (key, factor) in CHART_SOURCES.items():
+        if key in values:
+            charted[chart_id] = values[key] * factor
+    sources = {key for key, _factor in CHART_SOURCES.values()}
+    charted.update((k, v) for k, v in values.items() if k not in sources)
+    return charted
+
+
+def chart_window(window: dict) -> dict:
+    """Como ``chart_values`` para el ``window`` [n, suma, mín, máx] del publicador."""
+    charted = {}
+    for chart_id, (key, factor) in CHART_SOURCES.items():
+        if key in window:
+            n, total, low, high = window[key][:4]
+            charted[chart_id] = [n, total * factor, low * factor, high * factor]
+    sources = {key for key, _factor in CHART_SOURCES.values()}
+    charted.update((k, v) for k, v in window.items() if k not in sources)
+    return charted
+
+
+# Columnas de SensorReading -> clave del payload, para sembrar la caché
+# cuando la lectura no guardó raw_payload
+SEED_COLUMNS = {**SensorReading.PAYLOAD_COLUMNS, "pressure_hpa": "presion"}
+
+
+def _last_reading_values():
+    """Payload de la última lectura guardada de la etapa activa (o None)."""
+    stage = get_active_stage()
+    if stage is None:
+        return None
+    reading = SensorReading.objects.filter(stage_id=stage.id).order_by('-timestamp').first()
+    if reading is None:
+        return None
+    values = dict(reading.raw_payload or {}) if isinstance(reading.raw_payload, dict) else {}
+    for field, key in SEED_COLUMNS.items():
+        if getattr(reading, field) is not None:
+            values[key] = getattr(reading, field)
+    return values, reading.timestamp.isoformat()
+
 
 class SensorsWebSocketConsumer(AsyncWebsocketConsumer):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.sensor_groups = {}
+    """Gráficos de sensores (``ws/sensors/``) alimentados por el stream en vivo.
+
+    Igual que ``MQTTWebSocketConsumer`` se une a los grupos de lecturas de
+    ``dashboard/streams.py`` (``?stage=<id>`` filtra) en lugar de generar
+    datos propios; las claves del payload se traducen a los ids y unidades
+    de ``SENSOR_CHARTS``. El ``currentValue`` de cada gráfico sale de
+    ``latest_values``, la caché en memoria del último valor recibido.
+    """
 
     async def connect(self):
         await self.accept()
         print("WebSocket de sensores conectado")
-        
+        self.groups_joined = []
+        # Las lecturas pasan por la ventana del cliente (sensores, tasa, agregación)
+        self.outbox = StreamOutbox(self.send_sensor_data)
+        # Codificación de los frames (?encoding=json|msgpack|packed)
+        self.encoder = FrameEncoder(
+            requested_encoding(self.scope.get('query_string', b'')), [chart["id"] for chart in SENSOR_CHARTS],
+        )
+        if not latest_values.seeded:
+            await self.seed_latest_values()
+
         await self.send_sensor_list()
-        
-        asyncio.create_task(self.simulate_sensor_data())
+
+        if self.channel_layer is None:
+            print("CHANNEL_LAYERS no configurado: el WebSocket no recibirá lecturas")
+            return
+        self.groups_joined = requested_groups(self.scope.get('query_string', b'')) + [ALERT_GROUP]
+        for group in self.groups_joined:
+            await self.channel_layer.group_add(group, self.channel_name)
+        if ingest_embedded():
+            get_ingest_service().ensure_started(asyncio.get_running_loop())
 
     async def disconnect(self, close_code):
+        # Cancela el frame pendiente; no queda ninguna tarea del cliente viva
+        self.outbox.close()
+        if self.channel_layer is not None:
+            for group in self.groups_joined:
+                await self.channel_layer.group_discard(group, self.channel_name)
         print("WebSocket de sensores desconectado")
 
     async def receive(self, text_data):
@@ -27,78 +163,65 @@ class SensorsWebSocketConsumer(AsyncWebsocketConsumer):
             if message_type == 'request_sensor_list':
                 await self.send_sensor_list()
             elif message_type == 'subscribe':
-                sensor_id = data.get('sensor_id')
-                await self.subscribe_to_sensor(sensor_id)
+                await self.subscribe_to_sensor(data)
             
         except json.JSONDecodeError:
             await self.send_error("Formato JSON inválido")
 
+    async def sensor_message(self, event):
+        data = event['data']
+        latest_values.update(data)
+        frame = {**chart_values(sensor_values(data)), 'timestamp': data.get('timestamp'), 'meta': data.get('meta', {})}
+        window = event.get('window')
+        self.outbox.put(frame, chart_window(window) if window else None)
+
+    async def sensor_alert(self, event):
+        try:
+            await self.send(text_data=json.dumps(event['data']))
+        except Exception as e:
+            print(f"Error enviando WebSocket: {e}")
+
+    async def seed_latest_values(self):
+        """Siembra la caché con la última lectura guardada (una vez por proceso)."""
+        try:
+            last = await database_sync_to_async(_last_reading_values)()
+        except Exception as e:
+            print(f"Error leyendo la última lectura: {e}")
+            return
+        if last is None:
+            latest_values.seed({})
+        else:
+            latest_values.seed(*last)
+
     async def send_sensor_list(self):
+        current, _timestamp = latest_values.snapshot()
+        current = chart_values(current)
         sensor_list = {
             "type": "sensor_list",
-            "charts": [
-                {
-                    "id": "temperature",
-                    "title": "Temperatura",
-                    "description": "Temperatura del biodigestor en tiempo real",
-                    "unit": "°C",
-                    "color": "#26a69a",
-                    "icon": "fas fa-thermometer-half",
-                    "currentValue": 37.5,
-                    "status": "Estable"
-                },
-                {
-                    "id": "ph",
-                    "title": "Nivel de pH",
-                    "description": "Seguimiento de la acidez/alcalinidad",
-                    "unit": "pH",
-                    "color": "#42a5f5",
-                    "icon": "fas fa-flask",
-                    "currentValue": 7.1,
-                    "status": "Neutro"
-                },
-                {
-                    "id": "pressure",
-                    "title": "Presión de Gas",
-                    "description": "Niveles de presión dentro del biodigestor",
-                    "unit": "bar",
-                    "color": "#ffa726",
-                    "icon": "fas fa-tachometer-alt",
-                    "currentValue": 1.1,
-                    "status": "Óptima"
-                },
-                {
-                    "id": "gas_production",
-                    "title": "Producción de Biogás",
-                    "description": "Volumen de biogás generado por día",
-                    "unit": "m³/día",
-                    "color": "#7e57c2",
-                    "icon": "fas fa-gas-pump",
-                    "currentValue": 23,
-                    "status": "Alta"
-                },
-                {
-                    "id": "humidity",
-                    "title": "Humedad",
-                    "description": "Nivel de humedad del sustrato",
-                    "unit": "%",
-                    "color": "#66bb6a",
-                    "icon": "fas fa-tint",
-                    "currentValue": 65,
-                    "status": "Normal"
-                }
-            ]
+            "charts": [{**chart, "currentValue": current.get(chart["id"])} for chart in SENSOR_CHARTS],
+            "encoding": self.encoder.encoding,
+            "fields": list(self.encoder.fields),
         }
         
         await self.send(text_data=json.dumps(sensor_list))
 
-    async def send_sensor_data(self, sensor_data):
+    async def send_sensor_data(self, frame):
         message = {
             "type": "sensor_data",
-            "data": sensor_data,
-            "timestamp": datetime.now().isoformat()
+            "data": sensor_values(frame),
+            "timestamp": frame.get('timestamp') or datetime.now().isoformat(),
+            "meta": frame.get('meta', {}),
         }
-        await self.send(text_data=json.dumps(message))
+        if 'window' in frame:
+            message['window'] = frame['window']
+        try:
+            for kind, payload in self.encoder.encode(message, values=message["data"]):
+                if kind == 'text':
+                    await self.send(text_data=payload)
+                else:
+                    await self.send(bytes_data=payload)
+        except Exception as e:
+            print(f"Error enviando WebSocket: {e}")
 
     async def send_error(self, error_message):
         message = {
@@ -107,26 +230,26 @@ class SensorsWebSocketConsumer(AsyncWebsocketConsumer):
         }
         await self.send(text_data=json.dumps(message))
 
-    async def subscribe_to_sensor(self, sensor_id):
-        print(f"Suscripto al sensor: {sensor_id}")
-
-    async def simulate_sensor_data(self):
-        import random
-        
-        while True:
-            try:
-                sensor_data = {
-                    "temperature": 37.5 + (random.random() - 0.5) * 0.5,
-                    "ph": 7.1 + (random.random() - 0.5) * 0.1,
-                    "pressure": 1.1 + (random.random() - 0.5) * 0.05,
-                    "gas_production": 23 + (random.random() - 0.5) * 2,
-                    "humidity": 65 + (random.random() - 0.5) * 5,
-                    "Calidad": 65 + (random.random() - 0.5) * 5
-                }
-                
-                await self.send_sensor_data(sensor_data)
-                await asyncio.sleep(2)
-                
-            except Exception as e:
-                print(f"Error en simulación de datos: {e}")
-                await asyncio.sleep(5)
\ No newline at end of file
+    async def subscribe_to_sensor(self, data):
+        """``{"type": "subscribe", "sensors": [...], "max_rate": 1, "aggregate": "mean"}``;
+        con sólo ``sensor_id`` agrega ese sensor a los ya suscriptos (si
+        recibía todos, sigue recibiendo todos)."""
+        try:
+            subscription = parse_subscription(data)
+            encoding = subscription.pop('encoding') or self.encoder.encoding
+            check_aggregate(encoding, subscription['aggregate'])
+        except ValueError as e:
+            await self.send_error(str(e))
+            return
+        if data.get('sensors') is None and subscription['sensors']:
+            # sensor_id suma a la suscripción; sólo "sensors" la reduce
+            if self.outbox.sensors is None:
+                subscription['sensors'] = None
+            else:
+                subscription['sensors'] = sorted(self.outbox.sensors | set(subscription['sensors']))
+        self.outbox.subscribe(**subscription)
+        await self.send(text_data=json.dumps({"type": "subscribed", **subscription, "encoding": encoding}))
+        if encoding != self.encoder.encoding:
+            # El nuevo esquema se anuncia con sensor_list
+            self.encoder = FrameEncoder(encoding, [chart["id"] for chart in SENSOR_CHARTS])
+            await self.send_sensor_list()
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import FillingStage, SensorReading
+from .rollups import update_rollups
+from .stage_cache import invalidate_active_stage
+
+
+@receiver(post_save, sender=FillingStage)
+@receiver(post_delete, sender=FillingStage)
+def invalidar_etapa_activa(sender, instance, **kwargs):
+    # Crear, cerrar o borrar una etapa puede cambiar cuál es la activa
+    invalidate_active_stage()
+
+
+@receiver(post_save, sender=SensorReading)
+def actualizar_rollups(sender, instance, created, **kwargs):
+    # La ingesta usa bulk_create (sin señales) y actualiza los rollups por lote;
+    # esto cubre lecturas guardadas una a una (admin, shell)
+    if created:
+        update_rollups([instance])
@@ -0,0 +1,80 @@
+"""Caché de la etapa (llenado) activa.
+
+La ingesta de cada mensaje y cada sondeo del dashboard necesitan la etapa
+activa; en lugar de consultar la base de datos cada vez se guarda en memoria
+del proceso. Las señales de ``FillingStage`` (ver ``dashboard/signals.py``)
+la invalidan al crear, cerrar o borrar una etapa.
+
+Otros procesos (p.ej. ``mqtt_ingest``) no reciben esas señales, así que la
+copia local expira tras ``ACTIVE_STAGE_CACHE_TTL`` segundos. Con
+``ACTIVE_STAGE_CACHE_SHARED`` activo la etapa se comparte además a través
+del backend de caché de Django, que sí se invalida entre procesos si es
+compartido (Redis, Memcached).
+"""
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import FillingStage
+
+CACHE_KEY = 'dashboard:active_stage'
+# Marcador para distinguir "no hay etapa activa" de "no está en caché"
+_NO_STAGE = 'none'
+
+_lock = threading.Lock()
+_state = {'loaded': False, 'stage': None, 'expires': 0.0, 'generation': 0}
+
+
+def _ttl() -> float:
+    return float(getattr(settings, 'ACTIVE_STAGE_CACHE_TTL', 5.0))
+
+
+def _shared() -> bool:
+    return getattr(settings, 'ACTIVE_STAGE_CACHE_SHARED', False)
+
+
+def _load():
+    if _shared():
+        cached = cache.get(CACHE_KEY)
+        if cached is not None:
+            return None if cached == _NO_STAGE else cached
+    stage = FillingStage.objects.filter(active=True).order_by('-created_at').first()
+    if _shared():
+        cache.set(CACHE_KEY, stage if stage is not None else _NO_STAGE, _ttl() * 12)
+    return stage
+
+
+def get_active_stage():
+    """Devuelve la etapa activa más reciente (o None) usando la caché.
+
+    Se entrega una copia para que quien la modifique (p.ej. al cerrarla) no
+    altere la instancia compartida entre hilos.
+    """
+    now = time.monotonic()
+    with _lock:
+        if _state['loaded'] and now < _state['expires']:
+            stage = _state['stage']
+            return copy.copy(stage) if stage is not None else None
+        generation = _state['generation']
+
+    stage = _load()
+    with _lock:
+        # Si se invalidó mientras se consultaba, no guardar un valor viejo
+        if _state['generation'] == generation:
+            _state.update(loaded=True, stage=stage, expires=now + _ttl())
+    return copy.copy(stage) if stage is not None else None
+
+
+def active_stage_id():
+    stage = get_active_stage()
+    return stage.id if stage is not None else None
+
+
+def invalidate_active_stage():
+    with _lock:
+        _state.update(loaded=False, stage=None, expires=0.0, generation=_state['generation'] + 1)
+    if _shared():
+        cache.delete(CACHE_KEY)
@@ -0,0 +1,383 @@
+"""Reparto de lecturas en vivo a los WebSockets por grupos de Channels.
+
+Grupos:
+
+- ``SENSOR_GROUP``: todas las lecturas (dashboard sin filtros).
+- ``stage_group(id)``: las lecturas de una etapa.
+- ``sensor_group(id, sensor)``: un solo sensor de una etapa.
+- ``ALERT_GROUP``: alertas; se envían al momento, sin agrupar.
+
+La ingesta no reparte cada lectura por separado: ``StreamPublisher`` junta
+las de cada tick (``SENSOR_STREAM_TICK`` segundos) y envía un mensaje por
+grupo con el último valor de cada sensor. Del lado del consumidor,
+``StreamOutbox`` vuelve a fusionar lo que llega a un mismo cliente, así una
+ráfaga sale como un único frame por cliente y por tick aunque el cliente
+esté en varios grupos. Cada cliente puede además pedir (mensaje
+``subscribe``, ver ``parse_subscription``) sólo algunos sensores, una tasa
+máxima y el valor de la ventana que quiere (último, media, mín., máx.).
+
+Con un solo proceso Daphne alcanza la capa en memoria; para varios workers
+detrás de nginx (o ``manage.py mqtt_ingest`` aparte) hace falta la de Redis
+(``CHANNEL_REDIS_URL``).
+"""
+import asyncio
+import re
+import threading
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.utils import timezone
+
+from .frames import available_encodings
+from .replay import ReplayBuffer
+
+SENSOR_GROUP = "sensor_stream"
+ALERT_GROUP = "sensor_alerts"
+
+# Los nombres de grupo sólo admiten ASCII alfanumérico, guiones, guiones
+# bajos y puntos (y menos de 100 caracteres)
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+def tick_seconds() -> float:
+    return float(getattr(settings, 'SENSOR_STREAM_TICK', 0.5))
+
+
+def pending_frames() -> int:
+    return int(getattr(settings, 'SENSOR_STREAM_MAX_PENDING', 2))
+
+
+def stage_group(stage_id) -> str:
+    return f"sensor_stage_{int(stage_id)}"
+
+
+def sensor_group(stage_id, sensor) -> str:
+    return f"{stage_group(stage_id)}.{_UNSAFE.sub('_', str(sensor))[:60]}"
+
+
+def requested_groups(query_string) -> list:
+    """Grupos de datos según la query del WebSocket (``?stage=3&sensors=a,b``).
+
+    Sin etapa: ``SENSOR_GROUP``; con etapa: su grupo o, si se piden
+    sensores, uno por sensor.
+    """
+    if isinstance(query_string, bytes):
+        query_string = query_string.decode('latin-1')
+    params = parse_qs(query_string or '')
+    stage = (params.get('stage') or [''])[0]
+    if not stage.isdigit():
+        return [SENSOR_GROUP]
+    sensors = [s for value in params.get('sensors', []) for s in value.split(',') if s]
+    if sensors:
+        return [sensor_group(stage, s) for s in dict.fromkeys(sensors)]
+    return [stage_group(stage)]
+
+
+def sensor_values(frame) -> dict:
+    """Campos numéricos (sensores) de un frame ``sensor_data``."""
+    return {k: v for k, v in frame.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+
+
+def _accumulate(window, sensor, n, total, low, high, last):
+    stats = window.get(sensor)
+    if stats is None:
+        window[sensor] = [n, total, low, high, last]
+    else:
+        stats[0] += n
+        stats[1] += total
+        stats[2] = min(stats[2], low)
+        stats[3] = max(stats[3], high)
+        stats[4] = last
+
+
+AGGREGATES = ('last', 'mean', 'min', 'max', 'all')
+
+
+def parse_subscription(data: dict) -> dict:
+    """Normaliza un mensaje ``subscribe`` del cliente.
+
+    ``{"type": "subscribe", "sensors": ["temperatura", ...], "max_rate": 1,
+    "aggregate": "mean", "encoding": "packed"}``: ``sensors`` vacío = todos;
+    ``max_rate`` en frames por segundo (acotado por el tick); ``aggregate``
+    entre AGGREGATES; ``encoding`` (opcional) ver ``dashboard/frames.py``.
+    """
+    sensors = data.get('sensors')
+    if sensors is None and data.get('sensor_id') is not None:
+        sensors = [data['sensor_id']]
+    if isinstance(sensors, str):
+        sensors = [s for s in sensors.split(',') if s]
+    if sensors is not None and not isinstance(sensors, list):
+        raise ValueError("sensors debe ser una lista")
+    max_rate = data.get('max_rate')
+    max_rate = float(max_rate) if max_rate not in (None, '') else None
+    if max_rate is not None and max_rate <= 0:
+        raise ValueError("max_rate debe ser positivo")
+    aggregate = data.get('aggregate') or 'last'
+    if aggregate not in AGGREGATES:
+        raise ValueError(f"aggregate debe ser uno de {', '.join(AGGREGATES)}")
+    encoding = data.get('encoding') or None
+    if encoding is not None and encoding not in available_encodings():
+        raise ValueError(f"encoding debe ser uno de {', '.join(available_encodings())}")
+    return {
+        'sensors': [str(s) for s in sensors] if sensors else None,
+        'max_rate': max_rate,
+        'aggregate': aggregate,
+        'encoding': encoding,
+    }
+
+
+class StreamPublisher:
+    """Junta las lecturas de cada tick y las envía una vez por grupo.
+
+    ``send`` recibe la lista de (grupo, evento) de cada tick; lo llama un
+    hilo propio, igual que el vaciado de ``ReadingBuffer``. Cada tick lleva
+    un número de secuencia (``meta.seq``) y queda en ``replay``.
+    """
+
+    def __init__(self, send, tick=None):
+        self.send = send
+        self.tick = tick or tick_seconds()
+        self.replay = ReplayBuffer(self.tick)
+        self.seq = 0
+        self._lock = threading.Lock()
+        # etapa (o None) -> (valores, lecturas agrupadas)
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, stage_id, values: dict):
+        """Agrega una lectura (sólo los campos numéricos) al tick en curso."""
+        with self._lock:
+            window, count = self._pending.get(stage_id, ({}, 0))
+            for sensor, value in values.items():
+                _accumulate(window, sensor, 1, value, value, value, value)
+            self._pending[stage_id] = (window, count + 1)
+
+    def take(self) -> list:
+        """Mensajes (grupo, evento) de lo acumulado; vacía el tick.
+
+        El frame lleva el último valor de cada sensor (lo que ya mostraba el
+        dashboard); ``window`` del evento, [n, suma, mín, máx] por sensor,
+        para que cada cliente pueda agregar por su cuenta.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if pending:
+                self.seq += 1
+            seq = self.seq
+        now = timezone.now()
+        timestamp = now.isoformat()
+        messages = []
+        for stage_id, (window, count) in pending.items():
+            meta = {'stage': stage_id, 'readings': count, 'seq': seq, 'epoch': self.replay.epoch}
+            values = {sensor: stats[4] for sensor, stats in window.items()}
+            self.replay.record(seq, stage_id, values, now.timestamp())
+            stats = {sensor: stats[:4] for sensor, stats in window.items()}
+            event = {
+                'type': 'sensor.message',
+                'data': {'type': 'sensor_data', **values, 'timestamp': timestamp, 'meta': meta},
+                'window': stats,
+            }
+            messages.append((SENSOR_GROUP, event))
+            if stage_id is None:
+                continue
+            messages.append((stage_group(stage_id), event))
+            for sensor, value in values.items():
+                messages.append((sensor_group(stage_id, sensor), {
+                    'type': 'sensor.message',
+                    'data': {'type': 'sensor_data', sensor: value, 'timestamp': timestamp, 'meta': meta},
+                    'window': {sensor: stats[sensor]},
+                }))
+        return messages
+
+    def flush(self) -> int:
+        messages = self.take()
+        if messages:
+            try:
+                self.send(messages)
+            except Exception as e:
+                print(f"Error repartiendo lecturas a WebSockets: {e}")
+        return len(messages)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sensor-stream', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.tick):
+            self.flush()
+
+
+class LatestValues:
+    """Último valor de cada sensor visto por este proceso.
+
+    Lo alimentan los consumidores con los frames que reciben del stream (la
+    ingesta puede estar en otro proceso) y sirve para el ``currentValue`` de
+    los gráficos apenas se conecta un cliente. Mientras no llegó ningún frame
+    se puede sembrar con la última lectura guardada (``seed``).
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._timestamp = None
+        self.seeded = False
+        self._lock = threading.Lock()
+
+    def update(self, frame: dict):
+        values = sensor_values(frame)
+        with self._lock:
+            self._values.update(values)
+            self._timestamp = frame.get('timestamp') or self._timestamp
+            self.seeded = True
+
+    def seed(self, values: dict, timestamp=None):
+        """Valores iniciales; no pisa los que ya llegaron por el stream."""
+        with self._lock:
+            self._values = {**sensor_values(values), **self._values}
+            self._timestamp = self._timestamp or timestamp
+            self.seeded = True
+
+    def snapshot(self) -> tuple:
+        with self._lock:
+            return dict(self._values), self._timestamp
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+            self._timestamp = None
+            self.seeded = False
+
+
+latest_values = LatestValues()
+
+
+class StreamOutbox:
+    """Lecturas pendientes de un cliente, agregadas por ventana.
+
+    Sale a lo sumo un frame por intervalo (el tick o ``1 / max_rate``, el
+    mayor) con los sensores suscriptos y el valor ``aggregate`` de la
+    ventana. Tras un período sin envíos se espera sólo una décima de tick, lo
+    justo para juntar los mensajes de los demás grupos del mismo tick.
+
+    Los frames pasan por una cola acotada (``max_pending``, por defecto
+    ``SENSOR_STREAM_MAX_PENDING``) que vacía una sola tarea, así que hay un
+    único envío a la vez. Si la cola está llena (cliente lento), la ventana
+    sigue acumulando y el frame que tocaba se descarta (``meta.dropped``).
+    """
+
+    def __init__(self, send, tick=None, max_pending=None):
+        # Corrutina que envía un frame al socket
+        self._send = send
+        self.tick = tick or tick_seconds()
+        self.max_pending = max_pending or pending_frames()
+        self.sensors = None
+        self.aggregate = 'last'
+        self.interval = self.tick
+        self._window = {}
+        self._meta = {}
+        self._readings = 0
+        self._dropped = 0
+        self._timestamp = None
+        self._task = None
+        self._queue = asyncio.Queue(self.max_pending)
+        self._sender = None
+        self._last_sent = None
+
+    def subscribe(self, sensors=None, max_rate=None, aggregate='last'):
+        """Aplica una suscripción (ver ``parse_subscription``)."""
+        self.sensors = set(sensors) if sensors else None
+        self.aggregate = aggregate
+        self.interval = max(self.tick, 1.0 / max_rate) if max_rate else self.tick
+        if self.sensors is not None:
+            for sensor in list(self._window):
+                if sensor not in self.sensors:
+                    del self._window[sensor]
+
+    def put(self, frame: dict, window=None):
+        """Agrega un frame ``sensor_data`` (y su ``window`` si viene del
+        publicador) a la ventana en curso."""
+        values = sensor_values(frame)
+        if self.sensors is not None:
+            values = {k: v for k, v in values.items() if k in self.sensors}
+            if not values:
+                return
+        for sensor, value in values.items():
+            stats = (window or {}).get(sensor)
+            if stats is None:
+                _accumulate(self._window, sensor, 1, value, value, value, value)
+            else:
+                _accumulate(self._window, sensor, stats[0], stats[1], stats[2], stats[3], value)
+        meta = frame.get('meta') or {}
+        self._readings += meta.get('readings', 1)
+        self._meta = meta
+        self._timestamp = frame.get('timestamp')
+        self._schedule()
+
+    def _schedule(self):
+        if self._task is not None:
+            return
+        loop = asyncio.get_running_loop()
+        gather = self.tick / 10.0
+        delay = gather if self._last_sent is None else max(self._last_sent + self.interval - loop.time(), gather)
+        self._task = loop.create_task(self._flush_after(delay))
+
+    def frame(self) -> dict:
+        """Frame de la ventana en curso según ``aggregate``; la vacía."""
+        window, self._window = self._window, {}
+        frame = {'type': 'sensor_data'}
+        for sensor, (n, total, low, high, last) in window.items():
+            frame[sensor] = {'last': last, 'all': last, 'mean': total / n, 'min': low, 'max': high}[self.aggregate]
+        if self.aggregate == 'all':
+            frame['window'] = {
+                sensor: {'n': n, 'mean': total / n, 'min': low, 'max': high}
+                for sensor, (n, total, low, high, _last) in window.items()
+            }
+        frame['timestamp'] = self._timestamp
+        frame['meta'] = {**self._meta, 'readings': self._readings, 'dropped': self._dropped}
+        self._readings = 0
+        self._dropped = 0
+        return frame
+
+    async def _flush_after(self, delay):
+        await asyncio.sleep(delay)
+        self._task = None
+        if not self._window:
+            return
+        loop = asyncio.get_running_loop()
+        self._last_sent = loop.time()
+        if self._queue.full():
+            # Los frames anteriores siguen sin salir: éste queda en la ventana
+            self._dropped += 1
+            self._schedule()
+            return
+        self._queue.put_nowait(self.frame())
+        if self._sender is None:
+            self._sender = loop.create_task(self._drain())
+
+    async def _drain(self):
+        """Única tarea que envía: saca los frames de la cola de a uno."""
+        while True:
+            frame = await self._queue.get()
+            try:
+                await self._send(frame)
+            except Exception as e:
+                print(f"Error enviando frame: {e}")
+
+    def close(self):
+        """Cancela el envío pendiente (al desconectarse el cliente)."""
+        for task in (self._task, self._sender):
+            if task is not None:
+                task.cancel()
+        self._task = self._sender = None
+        self._queue = asyncio.Queue(self.max_pending)
+        self._window = {}
@@ -1,3 +1,1146 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import math
+import os
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from unittest import mock, skipIf
+from rest_framework.test import APIClient
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+
+from . import exports, fits, frames, replay, report_cache, report_jobs, report_render, streams
+from .consumer import MQTTWebSocketConsumer
+from .ingest import MQTTIngestService
+from .ingest_buffer import ReadingBuffer
+from .sensors_consumer import SensorsWebSocketConsumer
+from .aggregation import GasAccumulator, columns_from_rows, daily_gas_production, gas_columns, project_daily
+from .models import Alert, FillingStage, GompertzFit, Report, ReportJob, SensorReading, SensorRollup
+from .partitions import apply_retention
+from .rollups import daily_production, rebuild_rollups, stage_production_series, update_rollups
+from .stage_cache import get_active_stage, invalidate_active_stage
+from usuarios.models import Perfil, Permisos
+
+
+def legacy_daily_map(readings):
+    """Bucle por lectura que usaban las vistas antes de ``aggregation``."""
+    daily_map = {}
+    last_total_gas = None
+    last_ts = None
+    for r in readings:
+        ts = r.timestamp
+        payload = r.raw_payload or {}
+        delta = 0.0
+        if isinstance(payload, dict) and 'gas_total_m3' in payload:
+            try:
+                total = float(payload.get('gas_total_m3') or 0.0)
+                if last_total_gas is not None:
+                    delta = max(0.0, total - last_total_gas)
+                last_total_gas = total
+            except Exception:
+                pass
+        elif isinstance(payload, dict) and ('caudal_gas' in payload or 'caudal_gas_lmin' in payload or 'gas_flow_lmin' in payload):
+            try:
+                if 'caudal_gas' in payload:
+                    rate = float(payload.get('caudal_gas') or 0.0)
+                else:
+                    lmin = float(payload.get('caudal_gas_lmin') or payload.get('gas_flow_lmin') or 0.0)
+                    rate = lmin * 0.06
+                if last_ts is not None:
+                    dt_hours = max(0.0, (ts - last_ts).total_seconds() / 3600.0)
+                    delta = max(0.0, rate * dt_hours)
+            except Exception:
+                pass
+        elif r.gas_flow is not None:
+            try:
+                delta = max(0.0, float(r.gas_flow))
+            except Exception:
+                pass
+        last_ts = ts
+        if delta > 0:
+            key = ts.date().isoformat()
+            daily_map[key] = daily_map.get(key, 0.0) + delta
+    return daily_map
+
+
+def legacy_projection(daily_map, start_date, end_date):
+    days_actual, daily_actual, cumulative_actual = [], [], []
+    cum = 0.0
+    day_cursor = start_date
+    while day_cursor <= end_date:
+        val = daily_map.get(day_cursor.isoformat(), 0.0)
+        days_actual.append(float((day_cursor - start_date).days))
+        daily_actual.append(val)
+        cum += val
+        cumulative_actual.append(cum)
+        day_cursor = day_cursor + timedelta(days=1)
+    return days_actual, daily_actual, cumulative_actual
+
+
+def make_stage(**kwargs):
+    values = {'number': 1, 'people': 'test', 'material_type': 'bovino', 'material_amount_kg': 100.0, 'material_humidity_pct': 80.0}
+    values.update(kwargs)
+    return FillingStage.objects.create(**values)
+
+
+class IngestServiceTests(TestCase):
+    def setUp(self):
+        invalidate_active_stage()
+        self.stage = make_stage()
+        self.service = MQTTIngestService()
+        self.service.buffer = ReadingBuffer(flush_interval=0.01, on_alerts=self.service._publish_alerts)
+
+    def _flush(self):
+        self.service.buffer.flush(self.service.buffer._drain())
+
+    def test_payload_stored_once_with_alerts(self):
+        self.service.handle_payload({'temperatura': 50.0, 'presion': 1000.0, 'humedad': 60.0, 'nota': 'x'})
+        with mock.patch.object(self.service, '_group_send_many') as send:
+            self._flush()
+        reading = SensorReading.objects.get()
+        self.assertEqual((reading.stage_id, reading.temperature_c, reading.pressure_hpa, reading.humidity_pct),
+                         (self.stage.id, 50.0, 1000.0, 60.0))
+        alert = Alert.objects.get()
+        self.assertEqual(alert.message, 'Temperatura fuera de rango')
+        # La alerta sale a los WebSockets ya con id
+        group, event = send.call_args.args[0][0]
+        self.assertEqual((group, event['data']['id']), (streams.ALERT_GROUP, alert.id))
+        frame = dict(self.service.stream.take())[streams.SENSOR_GROUP]['data']
+        self.assertEqual((frame['temperatura'], frame['meta']['stage']), (50.0, self.stage.id))
+        self.assertNotIn('nota', frame)
+
+    def test_invalid_payload_is_ignored(self):
+        for payload in (b'{temperatura: 30', b'[1, 2]', b'\xff'):
+            self.service._on_mqtt_message(None, None, SimpleNamespace(topic='Prueba', payload=payload))
+        self.assertEqual(self.service.buffer.stats()['queue_depth'], 0)
+        self.assertEqual(self.service.stream.take(), [])
+
+    def test_no_active_stage_is_not_stored(self):
+        FillingStage.objects.filter(id=self.stage.id).update(active=False)
+        invalidate_active_stage()
+        self.assertFalse(self.service.persist({'temperatura': 30.0}))
+        self.assertEqual(self.service.buffer.stats()['queue_depth'], 0)
+
+
+class ReadingBufferTests(TransactionTestCase):
+    # Transaccional: el vaciado corre en su propio hilo (y conexión)
+
+    def setUp(self):
+        invalidate_active_stage()
+        self.stage = make_stage()
+
+    def _reading(self, stage=None, minutes=0):
+        return SensorReading(stage=stage or self.stage, timestamp=timezone.now() + timedelta(minutes=minutes), temperature_c=30.0)
+
+    def test_batches_through_bulk_create_and_stop_flushes_rest(self):
+        buffer = ReadingBuffer(batch_size=2, flush_interval=30.0)
+        with mock.patch.object(SensorReading.objects, 'bulk_create', wraps=SensorReading.objects.bulk_create) as bulk:
+            buffer.start()
+            for i in range(5):
+                self.assertTrue(buffer.put(self._reading(minutes=i), [Alert(level='WARN', message='x')] if i == 0 else None))
+            for _ in range(200):
+                if buffer.stats()['rows_flushed'] == 4:
+                    break
+                time.sleep(0.01)
+            # El quinto espera el intervalo (30 s); stop() lo guarda sin esperar
+            started = time.monotonic()
+            buffer.stop()
+            self.assertLess(time.monotonic() - started, 5.0)
+        self.assertEqual([len(c.args[0]) for c in bulk.call_args_list], [2, 2, 1])
+        self.assertEqual(SensorReading.objects.count(), 5)
+        self.assertEqual(Alert.objects.count(), 1)
+        self.assertEqual(buffer.stats()['batches_flushed'], 3)
+
+    def test_full_queue_blocks_then_drops(self):
+        buffer = ReadingBuffer(max_queue=1, put_timeout=0.05)
+        self.assertTrue(buffer.put(self._reading()))
+        started = time.monotonic()
+        self.assertFalse(buffer.put(self._reading()))
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+        self.assertEqual((buffer.stats()['dropped'], buffer.stats()['queue_depth']), (1, 1))
+
+    def test_failed_batch_dropped_after_retries(self):
+        buffer = ReadingBuffer()
+        batch = [(self._reading(minutes=i), []) for i in range(3)]
+        with mock.patch.object(SensorReading.objects, 'bulk_create', side_effect=DatabaseError('caída')), \
+                mock.patch('dashboard.ingest_buffer.time.sleep') as sleep:
+            buffer.flush(batch, retries=3)
+        stats = buffer.stats()
+        self.assertEqual((stats['dropped'], stats['flush_errors'], stats['rows_flushed']), (3, 3, 0))
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(SensorReading.objects.count(), 0)
+
+    def test_readings_of_closed_stage_are_not_stored(self):
+        buffer = ReadingBuffer()
+        closed = make_stage(number=2)
+        FillingStage.objects.filter(id=closed.id).update(active=False)
+        buffer.flush([(self._reading(closed), []), (self._reading(minutes=1), [])])
+        self.assertEqual(list(SensorReading.objects.values_list('stage_id', flat=True)), [self.stage.id])
+        self.assertEqual(buffer.stats()['closed_stage_dropped'], 1)
+
+
+@override_settings(ACTIVE_STAGE_CACHE_TTL=300.0)
+class ActiveStageCacheTests(TestCase):
+    def setUp(self):
+        invalidate_active_stage()
+
+    def test_invalidated_on_create_close_and_delete(self):
+        self.assertIsNone(get_active_stage())
+        first = make_stage()
+        self.assertEqual(get_active_stage().id, first.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_active_stage().id, first.id)
+        second = make_stage(number=2)
+        self.assertEqual(get_active_stage().id, second.id)
+        second.active = False
+        second.save()
+        self.assertEqual(get_active_stage().id, first.id)
+        first.delete()
+        self.assertIsNone(get_active_stage())
+
+    def test_close_does_not_overwrite_newer_edits(self):
+        user = User.objects.create_user('cierre', password='x')
+        client = APIClient()
+        client.force_authenticate(user)
+        stage = make_stage(people='antes')
+        self.assertEqual(get_active_stage().people, 'antes')
+        # Editada por otra vía sin invalidar la caché: la copia queda vieja
+        FillingStage.objects.filter(id=stage.id).update(people='después')
+        res = client.post('/api/dashboard/fillings/close-current/')
+        self.assertEqual(res.status_code, 200)
+        stage.refresh_from_db()
+        self.assertEqual((stage.active, stage.people), (False, 'después'))
+        self.assertIsNone(get_active_stage())
+        self.assertEqual(client.post('/api/dashboard/fillings/close-current/').status_code, 404)
+
+
+class GasAggregationParityTests(TestCase):
+    def setUp(self):
+        invalidate_active_stage()
+        self.stage = FillingStage.objects.create(
+            number=1, people='test', material_type='bovino',
+            material_amount_kg=100.0, material_humidity_pct=80.0,
+        )
+        self.t0 = datetime(2025, 3, 1, 22, 0, tzinfo=dt_timezone.utc)
+
+    def add(self, minutes, payload=None, gas_flow=None):
+        return SensorReading.objects.create(
+            stage=self.stage,
+            timestamp=self.t0 + timedelta(minutes=minutes),
+            gas_flow=gas_flow,
+            raw_payload=payload,
+        )
+
+    def assertParity(self, qs=None):
+        qs = qs if qs is not None else SensorReading.objects.filter(stage=self.stage)
+        expected = legacy_daily_map(qs.order_by('timestamp'))
+        actual = daily_gas_production(qs)
+        self.assertEqual(list(actual.keys()), list(expected.keys()))
+        for key, value in expected.items():
+            self.assertAlmostEqual(actual[key], value, places=9, msg=key)
+        return actual
+
+    def test_empty_queryset(self):
+        self.assertEqual(daily_gas_production(SensorReading.objects.none()), {})
+
+    def test_cumulative_totals_with_resets(self):
+        for i, total in enumerate([10.0, 10.5, 11.25, 3.0, 4.0, 4.0, 6.5]):
+            self.add(i * 45, {'gas_total_m3': total})
+        actual = self.assertParity()
+        self.assertEqual(len(actual), 2)
+
+    def test_flow_rates_are_integrated_across_days(self):
+        self.add(0, {'caudal_gas': 1.2})
+        self.add(30, {'caudal_gas': 0.8})
+        self.add(95, {'caudal_gas_lmin': 15.0})
+        self.add(140, {'gas_flow_lmin': 12.0})
+        self.add(200, {'caudal_gas_lmin': 0, 'gas_flow_lmin': 9.0})
+        self.add(260, {'caudal_gas': None})
+        self.add(320, {'caudal_gas': '0.5'})
+        self.assertParity()
+
+    def test_model_gas_flow_increments(self):
+        self.add(0, None, gas_flow=0.2)
+        self.add(10, {'presion': 1000.0}, gas_flow=0.3)
+        self.add(20, {}, gas_flow=-1.0)
+        self.add(30, {'temperatura': 35.0})
+        self.assertParity()
+
+    def test_mixed_sources_and_invalid_values(self):
+        self.add(0, {'gas_total_m3': 5.0})
+        self.add(15, {'caudal_gas': 2.0})
+        self.add(30, {'gas_total_m3': 'n/a'})
+        self.add(45, {'gas_total_m3': 5.75})
+        self.add(60, {'caudal_gas_lmin': 'x', 'gas_flow_lmin': 4.0})
+        self.add(75, {'gas_total_m3': None})
+        self.add(90, {'gas_total_m3': 6.0, 'caudal_gas': 9.0})
+        self.add(105, None, gas_flow=0.4)
+        self.add(120, {'caudal_gas_lmin': 20.0})
+        self.assertParity()
+
+    def test_present_but_invalid_key_keeps_its_rule(self):
+        self.add(0, {'gas_total_m3': 5.0})
+        # Clave presente con valor no numérico: regla del acumulado, suma 0
+        self.add(30, {'gas_total_m3': 'n/a', 'caudal_gas': 5})
+        self.add(60, {'caudal_gas': 5})
+        self.add(90, {'caudal_gas': 'x', 'caudal_gas_lmin': 10.0})
+        self.add(120, {'gas_total_m3': 6.0})
+        actual = self.assertParity()
+        self.assertAlmostEqual(sum(actual.values()), 2.5 + 1.0)
+
+    def test_null_values_are_not_zero(self):
+        fields = SensorReading.fields_from_payload(
+            {'temperatura': None, 'humedad': 'x', 'calidad': '70', 'gas_total_m3': None},
+        )
+        self.assertEqual((fields['temperature_c'], fields['humidity_pct'], fields['quality_pct']), (None, None, 70.0))
+        # El acumulado de gas conserva float(v or 0.0) para la agregación
+        self.assertEqual(fields['gas_total_m3'], 0.0)
+        self.add(0, {'temperatura': 30.0})
+        self.add(10, {'temperatura': None})
+        rollup = SensorRollup.objects.get(stage=self.stage, granularity='hour')
+        self.assertEqual((rollup.temperature_min, rollup.temperature_avg, rollup.temperature_count), (30.0, 30.0, 1))
+
+    def test_chunked_feed_matches_single_pass(self):
+        payloads = [{'gas_total_m3': 1.0 + 0.1 * i} if i % 3 else {'caudal_gas': 0.5 + i} for i in range(40)]
+        for i, payload in enumerate(payloads):
+            self.add(i * 50, payload)
+        single = self.assertParity()
+
+        rows = list(
+            SensorReading.objects.filter(stage=self.stage).order_by('timestamp')
+            .values_list('id', flat=True)
+        )
+        acc = GasAccumulator()
+        for start in range(0, len(rows), 7):
+            chunk = SensorReading.objects.filter(id__in=rows[start:start + 7])
+            acc.feed(gas_columns(chunk))
+        for chunked in (acc.daily_map(), daily_gas_production(SensorReading.objects.all(), chunk_size=7)):
+            self.assertEqual(list(chunked.keys()), list(single.keys()))
+            for key, value in single.items():
+                self.assertAlmostEqual(chunked[key], value, places=9)
+
+    def test_projection_matches_legacy(self):
+        for i in range(6):
+            self.add(i * 300, {'gas_total_m3': float(i * i)})
+        daily_map = daily_gas_production(SensorReading.objects.all())
+        start = self.t0.date() - timedelta(days=2)
+        end = self.t0.date() + timedelta(days=3)
+        expected = legacy_projection(daily_map, start, end)
+        actual = project_daily(daily_map, start, end)
+        self.assertEqual(actual['days'], expected[0])
+        self.assertEqual(actual['daily_biogas_m3'], expected[1])
+        for a, b in zip(actual['cumulative_biogas_m3'], expected[2]):
+            self.assertAlmostEqual(a, b, places=9)
+
+    def test_columns_from_empty_rows(self):
+        self.assertIsNone(columns_from_rows([]))
+
+    def test_backfill_populates_typed_columns(self):
+        # bulk_create no pasa por save(): simula filas previas a las columnas
+        SensorReading.objects.bulk_create([
+            SensorReading(stage=self.stage, timestamp=self.t0 + timedelta(minutes=i * 20), raw_payload=payload)
+            for i, payload in enumerate([
+                {'gas_total_m3': 2.0, 'temperatura': 35.5},
+                {'caudal_gas': 1.5, 'humedad': 60},
+                {'gas_flow_lmin': 10.0},
+                {'gas_total_m3': 2.5, 'calidad': '70'},
+            ])
+        ])
+        self.assertEqual(daily_gas_production(SensorReading.objects.all()), {})
+        call_command('backfill_reading_columns', chunk_size=2, stdout=io.StringIO())
+        first = SensorReading.objects.order_by('timestamp').first()
+        self.assertEqual((first.gas_total_m3, first.temperature_c), (2.0, 35.5))
+        self.assertEqual(SensorReading.objects.filter(gas_rate_lmin=10.0).count(), 1)
+        self.assertEqual(SensorReading.objects.filter(quality_pct=70.0).count(), 1)
+        self.assertParity()
+
+
+class SensorRollupTests(TestCase):
+    def setUp(self):
+        invalidate_active_stage()
+        self.stage = FillingStage.objects.create(
+            number=1, people='test', material_type='bovino',
+            material_amount_kg=100.0, material_humidity_pct=80.0,
+        )
+        self.t0 = datetime(2025, 3, 1, 21, 10, tzinfo=dt_timezone.utc)
+
+    def reading(self, minutes, **fields):
+        return SensorReading(stage=self.stage, timestamp=self.t0 + timedelta(minutes=minutes), **fields)
+
+    def sample(self):
+        out = []
+        for i in range(60):
+            fields = {'pressure_hpa': 1000.0 + i, 'temperature_c': 30.0 + (i % 7), 'biol_flow': 0.1 * (i % 3)}
+            if i % 4 == 0:
+                fields['gas_total_m3'] = 2.0 + 0.3 * i
+            elif i % 4 == 1:
+                fields['gas_rate_m3h'] = 0.5 + 0.01 * i
+            elif i % 4 == 2:
+                fields['gas_rate_lmin'] = 8.0
+            else:
+                fields['gas_flow'] = 0.05
+            out.append(self.reading(i * 13, **fields))
+        return out
+
+    def rollup_values(self, granularity):
+        return list(
+            SensorRollup.objects.filter(stage=self.stage, granularity=granularity)
+            .order_by('bucket_start')
+            .values_list('bucket_start', 'gas_m3', 'biol_m3', 'pressure_min', 'pressure_max',
+                         'pressure_avg', 'temperature_avg', 'count', 'last_gas_total_m3')
+        )
+
+    def assertMatchesRaw(self):
+        expected = daily_gas_production(SensorReading.objects.filter(stage=self.stage))
+        actual = daily_production(date(2025, 1, 1), date(2025, 12, 31), stage=self.stage)
+        # Los rollups incluyen también días con lecturas pero sin producción
+        for key, value in actual.items():
+            self.assertAlmostEqual(value, expected.get(key, 0.0), places=9, msg=key)
+        self.assertLessEqual(set(expected), set(actual))
+
+    def assertRowsAlmostEqual(self, rows_a, rows_b):
+        self.assertEqual(len(rows_a), len(rows_b))
+        for a, b in zip(rows_a, rows_b):
+            self.assertEqual(a[0], b[0])
+            for x, y in zip(a[1:], b[1:]):
+                if x is None or y is None:
+                    self.assertEqual(x, y)
+                else:
+                    self.assertAlmostEqual(x, y, places=9)
+
+    def test_batched_updates_match_raw_and_rebuild(self):
+        readings = self.sample()
+        for start in range(0, len(readings), 9):
+            batch = readings[start:start + 9]
+            SensorReading.objects.bulk_create(batch)
+            update_rollups(batch)
+        self.assertMatchesRaw()
+        hours, days = self.rollup_values('hour'), self.rollup_values('day')
+        self.assertEqual(sum(row[7] for row in days), len(readings))
+
+        self.assertEqual(rebuild_rollups(self.stage.id, chunk_size=7), len(readings))
+        self.assertRowsAlmostEqual(self.rollup_values('hour'), hours)
+        self.assertRowsAlmostEqual(self.rollup_values('day'), days)
+
+    def test_hour_stats(self):
+        SensorReading.objects.bulk_create([
+            self.reading(0, pressure_hpa=1000.0, temperature_c=30.0),
+            self.reading(5, pressure_hpa=1010.0),
+            self.reading(10, pressure_hpa=990.0, temperature_c=34.0, biol_flow=0.5),
+        ])
+        update_rollups(list(SensorReading.objects.filter(stage=self.stage)))
+        hour = SensorRollup.objects.get(stage=self.stage, granularity='hour')
+        self.assertEqual((hour.pressure_min, hour.pressure_max, hour.count), (990.0, 1010.0, 3))
+        self.assertAlmostEqual(hour.pressure_avg, 1000.0)
+        self.assertEqual((hour.temperature_avg, hour.temperature_count), (32.0, 2))
+        self.assertAlmostEqual(hour.biol_m3, 0.5)
+
+    def test_late_readings_trigger_rebuild(self):
+        readings = self.sample()
+        late = readings[5::6]
+        on_time = [r for r in readings if r not in late]
+        SensorReading.objects.bulk_create(on_time)
+        update_rollups(on_time)
+        SensorReading.objects.bulk_create(late)
+        update_rollups(late)
+        self.assertMatchesRaw()
+
+    def test_late_readings_rebuild_only_their_days(self):
+        readings = self.sample()
+        late = [readings[3], readings[7]]
+        on_time = [r for r in readings[:40] if r not in late]
+        SensorReading.objects.bulk_create(on_time)
+        update_rollups(on_time)
+        # Atrasadas del 1/3 junto con lecturas nuevas del 2/3 en el mismo lote
+        batch = late + readings[40:]
+        SensorReading.objects.bulk_create(batch)
+        with mock.patch('dashboard.rollups.rebuild_rollups', wraps=rebuild_rollups) as rebuild:
+            update_rollups(batch)
+        rebuild.assert_called_once_with(self.stage.id, start=late[0].timestamp, end=late[-1].timestamp)
+        self.assertMatchesRaw()
+        self.assertEqual(sum(row[7] for row in self.rollup_values('day')), len(readings))
+
+    def test_concurrent_hour_insert_is_retried_as_update(self):
+        readings = self.sample()[:4]
+        SensorReading.objects.bulk_create(readings)
+        bucket = datetime(2025, 3, 1, 21, tzinfo=dt_timezone.utc)
+        # Otro vaciado crea la misma hora después de que esta consulta no la encontró
+        SensorRollup.objects.create(stage=self.stage, granularity='hour', bucket_start=bucket, count=1, gas_m3=0.25)
+        original = SensorRollup.objects.select_for_update
+        calls = []
+
+        def racing_select(*args, **kwargs):
+            calls.append(1)
+            return SensorRollup.objects.none() if len(calls) == 1 else original(*args, **kwargs)
+
+        with mock.patch.object(SensorRollup.objects, 'select_for_update', side_effect=racing_select):
+            update_rollups(readings)
+        self.assertEqual(len(calls), 2)
+        hour = SensorRollup.objects.get(stage=self.stage, granularity='hour', bucket_start=bucket)
+        self.assertEqual(hour.count, 1 + len(readings))
+        self.assertEqual(SensorRollup.objects.get(stage=self.stage, granularity='day').count, 1 + len(readings))
+
+    def test_migration_backfills_existing_readings(self):
+        from importlib import import_module
+        from django.apps import apps
+        # Lecturas previas a las columnas tipadas: sólo raw_payload, sin rollups
+        SensorReading.objects.bulk_create([
+            SensorReading(stage=self.stage, timestamp=self.t0 + timedelta(minutes=10 * i),
+                          raw_payload={'gas_total_m3': 1.0 + i, 'presion': 1000})
+            for i in range(4)
+        ])
+        self.assertFalse(SensorRollup.objects.exists())
+        with mock.patch('sys.stdout', io.StringIO()):
+            import_module('dashboard.migrations.0012_backfill_rollups').backfill(apps, None)
+        self.assertEqual(SensorReading.objects.filter(gas_total_m3__isnull=True).count(), 0)
+        self.assertAlmostEqual(sum(daily_production(date(2025, 3, 1), date(2025, 3, 1), stage=self.stage).values()), 3.0)
+
+    def test_single_saves_update_rollups(self):
+        for reading in self.sample()[:12]:
+            reading.save()
+        self.assertMatchesRaw()
+
+    def test_rebuild_range_keeps_other_days(self):
+        readings = self.sample()
+        SensorReading.objects.bulk_create(readings)
+        update_rollups(readings)
+        days = self.rollup_values('day')
+        call_command('rebuild_rollups', stage=self.stage.id, start='2025-03-02', end='2025-03-02', stdout=io.StringIO())
+        self.assertRowsAlmostEqual(self.rollup_values('day'), days)
+
+    def test_stage_series_from_rollups(self):
+        readings = self.sample()
+        SensorReading.objects.bulk_create(readings)
+        update_rollups(readings)
+        series = stage_production_series(self.stage, self.t0, self.t0 + timedelta(days=3))
+        self.assertEqual(len(series['days']), 4)
+        raw = daily_gas_production(SensorReading.objects.filter(stage=self.stage))
+        self.assertAlmostEqual(series['cumulative_biogas_m3'][-1], sum(raw.values()), places=9)
+
+
+class RetentionPolicyTests(TestCase):
+    def setUp(self):
+        invalidate_active_stage()
+        self.stage = FillingStage.objects.create(
+            number=1, people='test', material_type='bovino',
+            material_amount_kg=100.0, material_humidity_pct=80.0,
+        )
+        self.now = datetime(2025, 6, 15, tzinfo=dt_timezone.utc)
+        readings = [
+            SensorReading(
+                stage=self.stage,
+                timestamp=datetime(2025, 3, 31, 20, 0, tzinfo=dt_timezone.utc) + timedelta(minutes=20 * i),
+                gas_rate_m3h=0.6, pressure_hpa=1000.0 + i, temperature_c=35.0,
+            )
+            for i in range(30)
+        ]
+        SensorReading.objects.bulk_create(readings)
+        update_rollups(readings)
+        self.days = list(SensorRollup.objects.filter(granularity='day').values_list('bucket_start', 'gas_m3'))
+
+    def assertDaysUnchanged(self):
+        days = list(SensorRollup.objects.filter(granularity='day').values_list('bucket_start', 'gas_m3'))
+        self.assertEqual([d[0] for d in days], [d[0] for d in self.days])
+        for (_, gas), (_, expected) in zip(days, self.days):
+            self.assertAlmostEqual(gas, expected, places=9)
+
+    def test_compact_keeps_hourly_production(self):
+        results = apply_retention(retention_months=2, mode='compact', now=self.now)
+        self.assertEqual([month for month, _ in results], ['2025-03'])
+        march = SensorReading.objects.filter(timestamp__lt=datetime(2025, 4, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(march.count(), SensorRollup.objects.filter(
+            granularity='hour', bucket_start__lt=datetime(2025, 4, 1, tzinfo=dt_timezone.utc)).count())
+        # Abril no está vencido
+        self.assertEqual(SensorReading.objects.filter(raw_payload__isnull=True).count(), 30 - 12)
+        self.assertEqual(apply_retention(retention_months=2, mode='compact', now=self.now), [('2025-03', 'ya compactado')])
+
+        rebuild_rollups(self.stage.id)
+        self.assertDaysUnchanged()
+
+    def test_drop_keeps_rollups(self):
+        apply_retention(retention_months=2, mode='drop', now=self.now)
+        self.assertEqual(SensorReading.objects.count(), 30 - 12)
+        rebuild_rollups(self.stage.id)
+        self.assertDaysUnchanged()
+
+    def test_incomplete_rollups_are_skipped(self):
+        SensorRollup.objects.filter(granularity='hour', bucket_start=datetime(2025, 3, 31, 21, tzinfo=dt_timezone.utc)).delete()
+        results = apply_retention(retention_months=2, mode='drop', now=self.now)
+        self.assertTrue(results[0][1].startswith('omitido'))
+        self.assertEqual(SensorReading.objects.count(), 30)
+
+    def test_disabled_by_default(self):
+        self.assertEqual(apply_retention(now=self.now), [])
+
+
+class ReportJobTests(TestCase):
+    def setUp(self):
+        invalidate_active_stage()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.stage = FillingStage.objects.create(
+            number=3, people='test', material_type='bovino',
+            material_amount_kg=100.0, material_humidity_pct=80.0,
+        )
+        self.client = APIClient()
+
+    def run_worker(self):
+        call_command('report_worker', once=True, processes=0, stdout=io.StringIO())
+
+    def test_create_returns_202_and_worker_renders_files(self):
+        res = self.client.post('/api/dashboard/report/create/', {'report_type': 'final', 'observations': 'obs'}, format='json')
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(res.data['status'], 'PENDING')
+        self.assertIsNone(res.data['pdf_url'])
+        self.assertFalse(Report.objects.exists())
+
+        self.run_worker()
+        job = self.client.get(res.data['status_url']).data
+        self.assertEqual(job['status'], 'DONE')
+        report = Report.objects.get(id=job['report_id'])
+        self.assertEqual(report.observations, 'obs')
+        for name in ('pdf', 'excel', 'csv'):
+            self.assertEqual(job[f'{name}_url'], f"/api/dashboard/report/download/{report.id}/{name}/")
+        self.assertTrue(report.file_csv.read().startswith('Día'.encode('utf-8')))
+        # Reporte final: la etapa queda cerrada
+        self.assertFalse(job['stage_active'])
+        self.assertFalse(FillingStage.objects.get(id=self.stage.id).active)
+
+    def test_regenerate_is_queued(self):
+        report = Report.objects.create(stage=self.stage, report_type='normal', inferences='previa')
+        res = self.client.post(f'/api/dashboard/report/regenerate/{report.id}/')
+        self.assertEqual(res.status_code, 202)
+        self.run_worker()
+        job = ReportJob.objects.get(id=res.data['job_id'])
+        self.assertEqual(job.status, 'DONE')
+        report.refresh_from_db()
+        self.assertEqual(report.inferences, 'previa')
+        self.assertTrue(report.file_excel)
+
+    def test_claim_skips_running_and_requeues_stale(self):
+        first = report_jobs.enqueue('create', stage=self.stage, report_type='normal')
+        second = report_jobs.enqueue('create', stage=self.stage, report_type='normal')
+        self.assertEqual(report_jobs.claim_job('w1').id, first.id)
+        self.assertEqual(report_jobs.claim_job('w2').id, second.id)
+        self.assertIsNone(report_jobs.claim_job('w3'))
+        ReportJob.objects.filter(id=first.id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(report_jobs.requeue_stale(timeout=60), 1)
+        self.assertEqual(report_jobs.claim_job('w3').id, first.id)
+
+    def test_failed_job_reports_error(self):
+        job = report_jobs.enqueue('regenerate', stage=self.stage)
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'ERROR')
+        self.assertTrue(job.error)
+
+    def test_render_failure_leaves_no_report_and_retry_reuses_it(self):
+        job = report_jobs.enqueue('create', stage=self.stage, report_type='normal')
+        for _attempt in range(2):
+            report_jobs.claim_job('w1')
+            job.refresh_from_db()
+            with mock.patch.object(report_jobs, 'render_files', side_effect=RuntimeError('sin memoria')):
+                report_jobs.run_job(job)
+            job.refresh_from_db()
+            self.assertEqual(job.status, 'ERROR')
+            self.assertIsNone(job.report)
+            ReportJob.objects.filter(id=job.id).update(status='PENDING')
+        self.assertFalse(Report.objects.exists())
+
+        # Un trabajo que ya guardó su reporte (el worker murió después) lo reutiliza
+        report = Report.objects.create(stage=self.stage, report_type='normal')
+        ReportJob.objects.filter(id=job.id).update(report=report)
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.report_id), ('DONE', report.id))
+        self.assertEqual(Report.objects.count(), 1)
+        report.refresh_from_db()
+        self.assertTrue(report.file_pdf)
+
+    def test_render_in_process_pool(self):
+        ctx = report_jobs.build_context(self.stage, 'normal')
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            files = report_jobs.render_files(ctx, pool)
+        self.assertEqual(files['csv'], report_jobs.render_files(ctx)['csv'])
+        self.assertTrue(files['excel'].startswith(b'PK'))
+
+
+class CurrentReportCacheTests(TestCase):
+    def setUp(self):
+        invalidate_active_stage()
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.stage = FillingStage.objects.create(
+            number=4, people='test', material_type='bovino',
+            material_amount_kg=100.0, material_humidity_pct=80.0,
+        )
+        SensorReading.objects.create(stage=self.stage, timestamp=timezone.now(), gas_total_m3=1.0)
+        user = User.objects.create_user('lector', password='x')
+        Perfil.objects.update_or_create(user=user, defaults={'aprobado': True, 'permisos': Permisos.objects.create(VerDashboard=True)})
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.renders = 0
+        original = report_render.render_comparison_excel
+
+        def counting(ctx):
+            self.renders += 1
+            return original(ctx)
+        patcher = mock.patch.object(report_render, 'render_comparison_excel', counting)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get(self, **headers):
+        return self.client.get('/api/dashboard/report/current/', {'format': 'excel'}, **headers)
+
+    def test_cached_file_is_reused_and_etag_honored(self):
+        first = self.get()
+        self.assertEqual(first.status_code, 200)
+        body = b''.join(first.streaming_content)
+        self.assertTrue(body.startswith(b'PK'))
+        second = self.get()
+        self.assertEqual(b''.join(second.streaming_content), body)
+        self.assertEqual(second['ETag'], first['ETag'])
+        self.assertEqual(self.renders, 1)
+
+        not_modified = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(self.renders, 1)
+
+    def test_new_reading_changes_key(self):
+        first = self.get()
+        SensorReading.objects.create(stage=self.stage, timestamp=timezone.now(), gas_total_m3=2.0)
+        second = self.get(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(self.renders, 2)
+
+    def test_evicts_least_recently_used(self):
+        old = report_cache.put('a', 'csv', b'x' * 10)
+        os.utime(report_cache.put('b', 'csv', b'x' * 10), (100, 100))
+        os.utime(old, (0, 0))
+        # Un acierto refresca la fecha y deja a "b" como el menos usado
+        self.assertEqual(report_cache.get('a', 'csv'), old)
+        self.assertEqual(report_cache.evict(max_bytes=15), 10)
+        self.assertIsNone(report_cache.get('b', 'csv'))
+        self.assertEqual(report_cache.get('a', 'csv'), old)
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        stage = FillingStage.objects.create(
+            number=5, people='test', material_type='bovino',
+            material_amount_kg=100.0, material_humidity_pct=80.0,
+        )
+        start = datetime(2025, 5, 1, 22, 0, tzinfo=dt_timezone.utc)
+        for i in range(30):
+            SensorReading.objects.create(
+                stage=stage, timestamp=start + timedelta(minutes=10 * i),
+                gas_total_m3=0.5 * i, temperature_c=35.0,
+            )
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('exporta', password='x'))
+
+    def export(self, granularity, gzip=False):
+        params = f'?format=csv&granularity={granularity}' + ('&gzip=1' if gzip else '')
+        return self.client.post('/api/dashboard/report/by-range/' + params,
+                                {'start_date': '2025-05-01', 'end_date': '2025-05-02'}, format='json')
+
+    def rows(self, response, gzip=False):
+        body = b''.join(response.streaming_content)
+        if gzip:
+            body = zlib.decompress(body, wbits=31)
+        return list(csv.reader(io.StringIO(body.decode('utf-8'))))
+
+    def test_raw_rows_stream_in_chunks(self):
+        with override_settings(READING_CHUNK_SIZE=7):
+            res = self.export('raw')
+            self.assertTrue(res.streaming)
+            rows = self.rows(res)
+        self.assertEqual(rows[0][:2], ['timestamp', 'stage_id'])
+        self.assertEqual(len(rows), 31)
+        self.assertEqual(rows[1][0], '2025-05-01T22:00:00+00:00')
+
+    def test_rollup_granularities_and_gzip(self):
+        hours = self.rows(self.export('hour', gzip=True), gzip=True)
+        self.assertEqual(len(hours), 1 + 5)
+        days = self.rows(self.export('day'))
+        self.assertEqual([row[0][:10] for row in days[1:]], ['2025-05-01', '2025-05-02'])
+        gas = sum(float(row[2]) for row in days[1:])
+        self.assertAlmostEqual(gas, 0.5 * 29)
+
+    def test_invalid_granularity(self):
+        self.assertEqual(self.export('minute').status_code, 400)
+
+    @skipIf(exports.pq is None, "pyarrow no instalado")
+    def test_parquet_row_groups_and_types(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'lecturas.parquet')
+            call_command('export_readings_parquet', path, '--chunk-size', '8', '--start', '2025-05-02', stdout=io.StringIO())
+            parquet = exports.pq.ParquetFile(path)
+            self.assertEqual(parquet.metadata.num_row_groups, 3)
+            table = parquet.read()
+        self.assertEqual(table.num_rows, 18)
+        self.assertEqual(str(table.schema.field('timestamp').type), 'timestamp[us, tz=UTC]')
+        self.assertEqual(table.column('gas_total_m3').to_pylist()[0], 0.5 * 12)
+        self.assertIsNone(table.column('pressure_hpa').to_pylist()[0])
+
+        res = self.client.get('/api/dashboard/readings/export/parquet/', {'end': '2025-05-01'})
+        self.assertEqual(res.status_code, 200)
+        body = b''.join(res.streaming_content)
+        self.assertEqual(exports.pq.read_table(io.BytesIO(body)).num_rows, 12)
+
+
+class GompertzFitTests(TestCase):
+    A, MU_G, LAG = 40.0, 3.0, 2.5
+
+    def setUp(self):
+        invalidate_active_stage()
+        self.stage = FillingStage.objects.create(
+            number=6, people='test', material_type='porcino',
+            material_amount_kg=120.0, material_humidity_pct=80.0,
+        )
+        start = datetime.combine(timezone.now().date() - timedelta(days=20), datetime.min.time(), tzinfo=dt_timezone.utc)
+        FillingStage.objects.filter(id=self.stage.id).update(created_at=start)
+        self.stage.refresh_from_db()
+        for k in range(20 * 4):
+            SensorReading.objects.create(stage=self.stage, timestamp=start + timedelta(hours=6 * k), gas_total_m3=self._total(k / 4.0))
+
+    def _total(self, t):
+        return self.A * math.exp(-math.exp(self.MU_G * math.e / self.A * (self.LAG - t) + 1.0))
+
+    def test_fit_recovers_parameters_and_is_incremental(self):
+        fit = fits.refit_stage(self.stage)
+        self.assertTrue(fit.converged)
+        self.assertEqual(fit.last_day, timezone.now().date() - timedelta(days=1))
+        self.assertAlmostEqual(fit.A_m3, self.A, delta=0.05 * self.A)
+        self.assertAlmostEqual(fit.mu_g, self.MU_G, delta=0.1 * self.MU_G)
+        self.assertAlmostEqual(fit.lag_days, self.LAG, delta=1.0)
+
+        tomorrow = timezone.now() + timedelta(days=1)
+        with mock.patch.object(fits, 'fit_gompertz', wraps=fits.fit_gompertz) as fit_call:
+            self.assertEqual(fits.refit_stage(self.stage).id, fit.id)
+            # Día nuevo sin lecturas nuevas (p.ej. etapa cerrada): ni ajuste ni escritura
+            with self.assertNumQueries(2):
+                self.assertEqual(fits.refit_stage(self.stage, now=tomorrow).last_day, fit.last_day)
+            self.assertEqual(fit_call.call_count, 0)
+            # Día nuevo con lecturas: parte del ajuste anterior
+            SensorReading.objects.create(stage=self.stage, timestamp=self.stage.created_at + timedelta(days=20),
+                                         gas_total_m3=self._total(20.0))
+            refit = fits.refit_stage(self.stage, now=tomorrow)
+            self.assertEqual(fit_call.call_args.kwargs['initial']['A'], fit.A_m3)
+        self.assertLessEqual(refit.iterations, fit.iterations)
+        self.assertEqual(refit.n_readings, fit.n_readings + 1)
+
+    def test_prior_from_same_material(self):
+        fits.refit_stage(self.stage)
+        prior = fits.material_prior('porcino', 60.0)
+        self.assertAlmostEqual(prior['A'], GompertzFit.objects.get().A_m3 / 2)
+        self.assertIsNone(fits.material_prior('vegetal', 60.0))
+
+    def test_predict_efficiency_includes_fit(self):
+        user = User.objects.create_user('ajuste', password='x')
+        Perfil.objects.update_or_create(user=user, defaults={'aprobado': True, 'permisos': Permisos.objects.create(VerDashboard=True)})
+        client = APIClient()
+        client.force_authenticate(user)
+        res = client.get('/api/dashboard/predict/efficiency/')
+        self.assertEqual(res.status_code, 200)
+        fit = res.data['fit']
+        self.assertEqual(len(fit['cumulative_biogas_m3']), max(len(res.data['expected_cumulative']), len(res.data['actual_cumulative'])))
+        self.assertAlmostEqual(fit['cumulative_biogas_m3'][-1], self.A, delta=0.1 * self.A)
+
+
+@override_settings(MQTT_INGEST_EMBEDDED=False, SENSOR_STREAM_TICK=0.05)
+class LiveStreamTests(SimpleTestCase):
+    async def _connect(self, query=''):
+        communicator = WebsocketCommunicator(MQTTWebSocketConsumer.as_asgi(), f'/ws/mqtt/?{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def _publish(self, publisher):
+        layer = get_channel_layer()
+        for group, event in publisher.take():
+            await layer.group_send(group, event)
+
+    def test_publisher_coalesces_per_group(self):
+        publisher = streams.StreamPublisher(send=None)
+        publisher.add(3, {'temperatura': 30.0, 'presion': 1000.0})
+        publisher.add(3, {'temperatura': 31.0})
+        messages = dict(publisher.take())
+        self.assertEqual(set(messages), {
+            streams.SENSOR_GROUP, 'sensor_stage_3', 'sensor_stage_3.temperatura', 'sensor_stage_3.presion',
+        })
+        frame = messages['sensor_stage_3']['data']
+        self.assertEqual((frame['temperatura'], frame['presion'], frame['meta']),
+                         (31.0, 1000.0, {'stage': 3, 'readings': 2, 'seq': 1, 'epoch': publisher.replay.epoch}))
+        self.assertEqual(set(messages['sensor_stage_3.presion']['data']) - {'type', 'timestamp', 'meta'}, {'presion'})
+        self.assertEqual(publisher.take(), [])
+        self.assertEqual(streams.requested_groups(b'stage=3&sensors=temperatura,ph,ph'),
+                         ['sensor_stage_3.temperatura', 'sensor_stage_3.ph'])
+        self.assertEqual(streams.requested_groups(b'stage=x'), [streams.SENSOR_GROUP])
+
+    async def test_burst_goes_out_as_one_frame_per_tick(self):
+        everything = await self._connect()
+        filtered = await self._connect('stage=3&sensors=temperatura,ph')
+        publisher = streams.StreamPublisher(send=None)
+        publisher.add(3, {'temperatura': 30.0, 'ph': 7.0, 'presion': 1000.0})
+        await self._publish(publisher)
+        first = await everything.receive_json_from()
+        self.assertEqual(first['temperatura'], 30.0)
+
+        # Dos ticks del publicador dentro de un tick del cliente: un solo frame
+        for value in (31.0, 32.0):
+            publisher.add(3, {'temperatura': value, 'ph': 7.1})
+            await self._publish(publisher)
+        merged = await everything.receive_json_from(timeout=1)
+        self.assertEqual((merged['temperatura'], merged['meta']['readings']), (32.0, 2))
+        self.assertTrue(await everything.receive_nothing(timeout=0.1))
+
+        # Sólo los sensores pedidos; los dos grupos salen en un frame
+        frame = await filtered.receive_json_from()
+        self.assertNotIn('presion', frame)
+        self.assertEqual((frame['temperatura'], frame['ph']), (30.0, 7.0))
+        await filtered.receive_json_from(timeout=1)
+        self.assertTrue(await filtered.receive_nothing(timeout=0.1))
+
+        await get_channel_layer().group_send(streams.ALERT_GROUP, {'type': 'sensor.alert', 'data': {'type': 'alert', 'id': 1}})
+        self.assertEqual((await filtered.receive_json_from())['type'], 'alert')
+        await everything.disconnect()
+        await filtered.disconnect()
+
+    async def test_subscription_filters_and_aggregates_per_window(self):
+        client = await self._connect()
+        await client.send_json_to({'type': 'subscribe', 'sensors': ['temperatura'], 'max_rate': 5, 'aggregate': 'all'})
+        self.assertEqual((await client.receive_json_from())['type'], 'subscribed')
+        publisher = streams.StreamPublisher(send=None)
+        for value in (30.0, 34.0, 32.0):
+            publisher.add(3, {'temperatura': value, 'ph': 7.0})
+        await self._publish(publisher)
+        frame = await client.receive_json_from(timeout=1)
+        self.assertEqual(frame['temperatura'], 32.0)
+        self.assertEqual(frame['window'], {'temperatura': {'n': 3, 'mean': 32.0, 'min': 30.0, 'max': 34.0}})
+        self.assertNotIn('ph', frame)
+
+        await client.send_json_to({'type': 'subscribe', 'max_rate': 0})
+        self.assertEqual((await client.receive_json_from())['type'], 'error')
+        await client.disconnect()
+
+    async def test_slow_client_drops_stale_frames(self):
+        sent = []
+        release = asyncio.Event()
+
+        async def blocked_send(frame):
+            sent.append(frame)
+            await release.wait()
+
+        outbox = streams.StreamOutbox(blocked_send, tick=0.02, max_pending=1)
+        outbox.subscribe(aggregate='max')
+        outbox.put({'temperatura': 30.0})
+        await asyncio.sleep(0.03)
+        # El primero está en vuelo; 35 espera en la cola y 31 y 33 quedan en la ventana
+        for value in (35.0, 31.0, 33.0):
+            outbox.put({'temperatura': value})
+            await asyncio.sleep(0.05)
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(outbox._queue.qsize(), 1)
+        release.set()
+        for _ in range(100):
+            if len(sent) == 3:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual([frame['temperatura'] for frame in sent], [30.0, 35.0, 33.0])
+        self.assertEqual(sent[2]['meta']['readings'], 2)
+        self.assertGreaterEqual(sent[2]['meta']['dropped'], 1)
+        outbox.close()
+
+    async def test_slow_send_is_serialized_and_bounded(self):
+        sent = []
+        in_flight = []
+        concurrent = []
+
+        async def slow_send(frame):
+            in_flight.append(1)
+            concurrent.append(len(in_flight))
+            await asyncio.sleep(0.1)
+            sent.append(frame)
+            in_flight.pop()
+
+        outbox = streams.StreamOutbox(slow_send, tick=0.02, max_pending=2)
+        outbox.subscribe(aggregate='mean')
+        depth = 0
+        for i in range(30):
+            outbox.put({'temperatura': 30.0 + i})
+            depth = max(depth, outbox._queue.qsize())
+            await asyncio.sleep(0.01)
+        for _ in range(200):
+            if sum(frame['meta']['readings'] for frame in sent) == 30:
+                break
+            await asyncio.sleep(0.01)
+        # Cada lectura sale en algún frame aunque se salteen ticks
+        self.assertEqual(sum(frame['meta']['readings'] for frame in sent), 30)
+        self.assertEqual(max(concurrent), 1)
+        self.assertLessEqual(depth, 2)
+        self.assertLess(len(sent), 10)
+        self.assertGreater(sum(frame['meta']['dropped'] for frame in sent), 0)
+        outbox.close()
+
+    def test_replay_ring_resume_and_gap(self):
+        buffer = replay.ReplayBuffer(tick=1.0, minutes=5 / 60.0)  # 6 ticks
+        for seq in range(1, 9):
+            values = {'temperatura': 30.0 + seq}
+            if seq % 2 == 0:
+                values['ph'] = 7.0
+            buffer.record(seq, 3, values, t=1000.0 + seq)
+        full = buffer.snapshot(now=1008.0)
+        stage = full['stages'][0]
+        self.assertEqual((full['last_seq'], full['gap'], stage['stage']), (8, False, 3))
+        # 6 ticks en el anillo, los de más de 5 s quedan afuera
+        self.assertEqual(stage['seq'], [3, 4, 5, 6, 7, 8])
+        self.assertEqual(stage['values']['ph'], [None, 7.0, None, 7.0, None, 7.0])
+
+        resumed = buffer.snapshot(since=6, epoch=full['epoch'], sensors={'temperatura'}, now=1008.0)
+        self.assertEqual(resumed['stages'][0]['seq'], [7, 8])
+        self.assertEqual(list(resumed['stages'][0]['values']), ['temperatura'])
+        self.assertFalse(resumed['gap'])
+        self.assertTrue(buffer.snapshot(since=1, epoch=full['epoch'], now=1008.0)['gap'])
+        restarted = buffer.snapshot(since=6, epoch='otra', now=1008.0)
+        self.assertTrue(restarted['gap'])
+        self.assertEqual(len(restarted['stages'][0]['seq']), 6)
+
+    async def test_replay_batch_on_connect(self):
+        publisher = streams.StreamPublisher(send=None)
+        for value in (30.0, 31.0, 32.0):
+            publisher.add(3, {'temperatura': value})
+            await self._publish(publisher)
+        server = asyncio.create_task(replay.serve_replay(get_channel_layer(), publisher.replay))
+        try:
+            client = await self._connect('stage=3&replay=1&since=1&epoch=' + publisher.replay.epoch)
+            batch = json.loads(zlib.decompress(await client.receive_from()))
+            self.assertEqual(batch['type'], 'replay')
+            self.assertEqual(batch['stages'][0]['seq'], [2, 3])
+            self.assertEqual(batch['stages'][0]['values'], {'temperatura': [31.0, 32.0]})
+
+            publisher.add(3, {'temperatura': 33.0})
+            await self._publish(publisher)
+            live = await client.receive_json_from(timeout=1)
+            self.assertEqual((live['temperatura'], live['meta']['seq']), (33.0, 4))
+            await client.disconnect()
+        finally:
+            server.cancel()
+
+    def test_packed_frames_round_trip_and_extend_schema(self):
+        encoder = frames.FrameEncoder('packed', ['temperatura', 'presion'])
+        frame = {'type': 'sensor_data', 'temperatura': 35.5, 'ph': 7.25, 'timestamp': '2025-01-01T00:00:00+00:00',
+                 'meta': {'stage': 3, 'seq': 9, 'readings': 2, 'dropped': 1}}
+        (kind, schema), (binary, payload) = encoder.encode(frame)
+        self.assertEqual((kind, binary), ('text', 'bytes'))
+        self.assertEqual(json.loads(schema)['fields'], ['temperatura', 'presion', 'ph'])
+        decoded = frames.unpack(payload, encoder.fields)
+        self.assertEqual(decoded['values'], {'temperatura': 35.5, 'ph': 7.25})
+        self.assertEqual((decoded['stage'], decoded['seq'], decoded['readings'], decoded['dropped']), (3, 9, 2, 1))
+        self.assertEqual(decoded['timestamp'], datetime(2025, 1, 1, tzinfo=dt_timezone.utc).timestamp())
+        self.assertLess(len(payload), len(json.dumps(frame)) / 3)
+        # Sin sensores nuevos no se repite el esquema
+        self.assertEqual([k for k, _ in encoder.encode({**frame, 'presion': 1000.0})], ['bytes'])
+        with self.assertRaises(ValueError):
+            frames.check_aggregate('packed', 'all')
+
+        out = io.StringIO()
+        call_command('bench_frames', frames=50, sensors=4, stdout=out)
+        self.assertIn('packed', out.getvalue())
+
+    async def test_negotiated_encoding_over_websocket(self):
+        client = await self._connect('encoding=packed')
+        schema = await client.receive_json_from()
+        self.assertEqual((schema['type'], schema['fields']), ('schema', []))
+        publisher = streams.StreamPublisher(send=None)
+        publisher.add(None, {'temperatura': 30.5})
+        await self._publish(publisher)
+        schema = await client.receive_json_from(timeout=1)
+        payload = await client.receive_from()
+        self.assertEqual(frames.unpack(payload, schema['fields'])['values'], {'temperatura': 30.5})
+
+        await client.send_json_to({'type': 'subscribe', 'encoding': 'json'})
+        self.assertEqual((await client.receive_json_from())['encoding'], 'json')
+        publisher.add(None, {'temperatura': 31.5})
+        await self._publish(publisher)
+        self.assertEqual((await client.receive_json_from(timeout=1))['temperatura'], 31.5)
+        await client.disconnect()
+
+    async def test_sensors_socket_follows_stream_and_cache(self):
+        streams.latest_values.clear()
+        self.addCleanup(streams.latest_values.clear)
+        streams.latest_values.seed({'temperatura': 36.0, 'presion': 1000.0})
+        tasks = len(asyncio.all_tasks())
+        client = WebsocketCommunicator(SensorsWebSocketConsumer.as_asgi(), '/ws/sensors/')
+        self.assertTrue((await client.connect())[0])
+        charts = {c['id']: c['currentValue'] for c in (await client.receive_json_from())['charts']}
+        self.assertEqual((charts['temperature'], charts['pressure'], charts['ph']), (36.0, 1.0, None))
+
+        publisher = streams.StreamPublisher(send=None)
+        publisher.add(3, {'temperatura': 38.0, 'caudal_gas': 1.0})
+        await self._publish(publisher)
+        frame = await client.receive_json_from(timeout=1)
+        self.assertEqual(frame['data'], {'temperature': 38.0, 'gas_production': 24.0})
+        await client.send_json_to({'type': 'request_sensor_list'})
+        charts = {c['id']: c['currentValue'] for c in (await client.receive_json_from())['charts']}
+        self.assertEqual((charts['temperature'], charts['gas_production']), (38.0, 24.0))
+
+        # Sin tareas propias del socket después de desconectarse
+        await client.disconnect()
+        await asyncio.sleep(0.1)
+        self.assertLessEqual(len(asyncio.all_tasks()), tasks)
+
+    async def test_sensors_socket_sensor_id_adds_to_subscription(self):
+        streams.latest_values.clear()
+        self.addCleanup(streams.latest_values.clear)
+        streams.latest_values.seed({})
+        client = WebsocketCommunicator(SensorsWebSocketConsumer.as_asgi(), '/ws/sensors/')
+        self.assertTrue((await client.connect())[0])
+        await client.receive_json_from()
+        # Suscripto a todo: sensor_id no reduce la suscripción
+        await client.send_json_to({'type': 'subscribe', 'sensor_id': 'ph'})
+        self.assertIsNone((await client.receive_json_from())['sensors'])
+        publisher = streams.StreamPublisher(send=None)
+        publisher.add(3, {'temperatura': 38.0, 'ph': 7.0})
+        await self._publish(publisher)
+        self.assertEqual((await client.receive_json_from(timeout=1))['data'], {'temperature': 38.0, 'ph': 7.0})
+
+        await client.send_json_to({'type': 'subscribe', 'sensors': ['ph']})
+        self.assertEqual((await client.receive_json_from())['sensors'], ['ph'])
+        await client.send_json_to({'type': 'subscribe', 'sensor_id': 'temperature'})
+        self.assertEqual((await client.receive_json_from())['sensors'], ['ph', 'temperature'])
+        await client.disconnect()
+
+    async def test_sensors_socket_seeds_cache_from_last_reading(self):
+        streams.latest_values.clear()
+        self.addCleanup(streams.latest_values.clear)
+        # Lectura sin raw_payload: la presión sólo está en su columna
+        reading = SensorReading(timestamp=timezone.now(), pressure_hpa=1012.0, temperature_c=36.5)
+        with mock.patch('dashboard.sensors_consumer.get_active_stage', return_value=FillingStage(id=3)), \
+                mock.patch('dashboard.sensors_consumer.SensorReading.objects') as objects:
+            objects.filter.return_value.order_by.return_value.first.return_value = reading
+            client = WebsocketCommunicator(SensorsWebSocketConsumer.as_asgi(), '/ws/sensors/')
+            self.assertTrue((await client.connect())[0])
+            charts = {c['id']: c['currentValue'] for c in (await client.receive_json_from())['charts']}
+        self.assertEqual(charts['pressure'], 1.012)
+        self.assertEqual((charts['temperature'], charts['humidity']), (36.5, None))
+        await client.disconnect()
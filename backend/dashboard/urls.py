@@ -16,12 +16,15 @@ from .views import (
     PracticeStatusAPIView,
     PracticeStartAPIView,
     PracticeStopAPIView,
+    IngestStatusAPIView,
+    ReportJobStatusAPIView,
 )
 
 urlpatterns = [
     path('', views.dashboard_view, name='dashboard'),
     path('report/create/', CreateReportAPIView.as_view(), name='create_report'),
     path('report/regenerate/<int:report_id>/', RegenerateReportAPIView.as_view(), name='regenerate_report'),
+    path('report/jobs/<int:job_id>/', ReportJobStatusAPIView.as_view(), name='report_job_status'),
     path('fillings/', views.CreateFillingAPIView.as_view(), name='create_filling'),
     path('fillings/list/', ListFillingsAPIView.as_view(), name='list_fillings'),
     path('fillings/close-current/', CloseCurrentFillingAPIView.as_view(), name='close_current_filling'),
@@ -40,4 +43,6 @@ urlpatterns = [
     path('practice/status/', PracticeStatusAPIView.as_view(), name='practice_status'),
     path('practice/start/', PracticeStartAPIView.as_view(), name='practice_start'),
     path('practice/stop/', PracticeStopAPIView.as_view(), name='practice_stop'),
+    path('readings/export/parquet/', views.ReadingsParquetExportAPIView.as_view(), name='readings_export_parquet'),
+    path('ingest/status/', IngestStatusAPIView.as_view(), name='ingest_status'),
 ]
\ No newline at end of file
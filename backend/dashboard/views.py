@@ -1,5 +1,6 @@
+from django.conf import settings
 from django.shortcuts import get_object_or_404, render
-from django.http import FileResponse, HttpResponse
+from django.http import FileResponse, Http404, HttpResponse
 from django.db.models import Sum
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -10,22 +11,22 @@ from usuarios.permisos import PuedeVerDashboard
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.decorators import api_view
 from django.core.files.base import ContentFile
-from .models import FillingStage, SensorReading, Report, ActuatorCommand, Alert, CalibrationRecord, PracticeSession
+from .models import FillingStage, SensorReading, Report, ReportJob, ActuatorCommand, Alert, CalibrationRecord, PracticeSession
 from .serializers import FillingStageSerializer, ReportSerializer, ActuatorCommandSerializer, AlertSerializer, CalibrationRecordSerializer, PracticeSessionSerializer
-from biocalculadora.calculators import estimate_timeseries_for_material
+from .stage_cache import get_active_stage, invalidate_active_stage
+from .aggregation import daily_gas_production
+from .rollups import daily_production, stage_production_series
+from . import exports, fits, report_cache, report_jobs, report_render
+from biocalculadora.forecast import forecast_bands
+from biocalculadora.series_cache import expected_series, params_version
 from datetime import datetime, timedelta
 from django.utils import timezone
 import pandas as pd
 import io
 import os
+import tempfile
 try:
     from reportlab.pdfgen import canvas
-    # Estilos bonitos con Platypus
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib import colors
-    from reportlab.lib.units import cm
 except ImportError:
     canvas = None
 
@@ -76,85 +77,17 @@ class CloseCurrentFillingAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        stage = FillingStage.objects.filter(active=True).order_by('-created_at').first()
+        stage = get_active_stage()
         if stage is None:
             return Response({"detail": "No hay etapa activa para cerrar."}, status=status.HTTP_404_NOT_FOUND)
-        stage.active = False
-        stage.save()
+        # La copia en caché puede estar vieja: sólo se cambia "active" y sólo
+        # si sigue abierta (update() no emite señales, se invalida a mano)
+        closed = FillingStage.objects.filter(pk=stage.pk, active=True).update(active=False)
+        invalidate_active_stage()
+        if not closed:
+            return Response({"detail": "No hay etapa activa para cerrar."}, status=status.HTTP_404_NOT_FOUND)
         return Response({"detail": f"Etapa #{stage.number} cerrada.", "stage_id": stage.id})
 
-# Utilidad: construir PDF con mejor estética usando ReportLab Platypus
-def build_pretty_report_pdf(*, stage, report_type_label: str, production_estimated: float, production_real: float, inferences_text: str, observations_text: str) -> bytes:
-    if not canvas:
-        # Si no hay reportlab, no podemos construir PDF bonito
-        return b""
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(
-        buffer,
-        pagesize=A4,
-        leftMargin=2*cm,
-        rightMargin=2*cm,
-        topMargin=2*cm,
-        bottomMargin=2*cm,
-        title="Reporte Biogestor ULSA"
-    )
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(name='TitleCenter', parent=styles['Title'], alignment=1, textColor=colors.HexColor('#1b5e20')))
-    styles.add(ParagraphStyle(name='SectionHeader', parent=styles['Heading4'], textColor=colors.HexColor('#2e7d32')))
-    styles.add(ParagraphStyle(name='Meta', parent=styles['Normal'], textColor=colors.HexColor('#424242')))
-    story = []
-
-    # Título
-    story.append(Paragraph('Sistema Biogestor ULSA', styles['TitleCenter']))
-    story.append(Paragraph(report_type_label, styles['Meta']))
-    story.append(Spacer(1, 12))
-
-    # Tabla de resumen
-    resumen_data = [
-        ['Etapa', f"#{stage.number}"],
-        ['Material', stage.material_type],
-        ['Cantidad (kg)', f"{stage.material_amount_kg}"],
-        ['Temperatura (°C)', f"{stage.temperature_c}"],
-        ['Producción estimada (m3)', f"{production_estimated:.2f}"],
-        ['Producción real (m3)', f"{production_real:.2f}"],
-    ]
-    tbl = Table(resumen_data, colWidths=[6*cm, 9*cm])
-    tbl.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (0,-1), colors.HexColor('#f1f8e9')),
-        ('TEXTCOLOR', (0,0), (0,-1), colors.HexColor('#2e7d32')),
-        ('FONTNAME', (0,0), (-1,-1), 'Helvetica'),
-        ('FONTSIZE', (0,0), (-1,-1), 10),
-        ('BOX', (0,0), (-1,-1), 0.5, colors.HexColor('#c8e6c9')),
-        ('INNERGRID', (0,0), (-1,-1), 0.25, colors.HexColor('#c8e6c9')),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('LEFTPADDING', (0,0), (-1,-1), 6),
-        ('RIGHTPADDING', (0,0), (-1,-1), 6),
-        ('TOPPADDING', (0,0), (-1,-1), 4),
-        ('BOTTOMPADDING', (0,0), (-1,-1), 4),
-    ]))
-    story.append(tbl)
-    story.append(Spacer(1, 16))
-
-    # Inferencias
-    story.append(Paragraph('Inferencias', styles['SectionHeader']))
-    story.append(Spacer(1, 6))
-    story.append(Paragraph(inferences_text or '-', styles['Normal']))
-    story.append(Spacer(1, 14))
-
-    # Comentarios
-    story.append(Paragraph('Comentarios', styles['SectionHeader']))
-    story.append(Spacer(1, 6))
-    story.append(Paragraph(observations_text or '-', styles['Normal']))
-    story.append(Spacer(1, 14))
-
-    # Pie de página simple (fecha)
-    ts = datetime.now().strftime('%Y-%m-%d %H:%M')
-    story.append(Paragraph(f"Generado: {ts}", styles['Meta']))
-
-    doc.build(story)
-    pdf_bytes = buffer.getvalue()
-    buffer.close()
-    return pdf_bytes
 # Endpoint para descargar archivos de reportes
 def download_report_file(request, report_id, filetype):
     report = get_object_or_404(Report, id=report_id)
@@ -191,7 +124,7 @@ from rest_framework.decorators import api_view
 from django.http import HttpResponse
 from django.core.files.base import ContentFile
 from .models import FillingStage, SensorReading, Report
-from biocalculadora.calculators import estimate_timeseries_for_material
+from biocalculadora.series_cache import expected_series, params_version
 from datetime import datetime, timedelta
 import pandas as pd
 import io
@@ -233,12 +166,14 @@ class StatsAPIView(APIView):
 
 class PredictEfficiencyAPIView(APIView):
     """Predicción simple de eficiencia basada en series esperada vs. real.
-    Retorna A (potencial), eficiencia acumulada (real/estimado) y series recortadas.
+    Retorna A (potencial), eficiencia acumulada (real/estimado) y series recortadas,
+    más la curva de Gompertz ajustada a los datos de la etapa ("fit", None si
+    aún no hay días suficientes).
     """
     permission_classes = [IsAuthenticated, PuedeVerDashboard]
 
     def get(self, request):
-        stage = FillingStage.objects.filter(active=True).order_by('-created_at').first()
+        stage = get_active_stage()
         if not stage:
             return Response({"detail": "No hay etapa activa"}, status=404)
 
@@ -253,22 +188,31 @@ class PredictEfficiencyAPIView(APIView):
             eff = float(actual_cum[-1]) / float(expected_cum[min(len(expected_cum)-1, len(actual_cum)-1)]) if actual_cum else 0.0
         except Exception:
             eff = 0.0
+        # Curva ajustada a los datos reales (se recalcula sólo con días y lecturas nuevas)
+        fit = None
+        try:
+            stage_fit = fits.refit_stage(stage)
+            if stage_fit is not None:
+                fit = fits.fit_payload(stage_fit, max(len(expected_cum), len(actual_cum)))
+        except Exception as e:
+            print(f"Error ajustando Gompertz (etapa {stage.id}): {e}")
         return Response({
             "efficiency_ratio": eff,
             "stage": stage.id,
             "expected_cumulative": expected_cum,
             "actual_cumulative": actual_cum,
+            "fit": fit,
         })
 
 class CurrentProductionAPIView(APIView):
     permission_classes = [IsAuthenticated, PuedeVerDashboard]
 
     def get(self, request):
-        stage = FillingStage.objects.filter(active=True).order_by('-created_at').first()
+        stage = get_active_stage()
         if stage is None:
             return Response({"detail": "No hay etapa activa"}, status=status.HTTP_404_NOT_FOUND)
 
-        series = estimate_timeseries_for_material(
+        series = expected_series(
             material_type=stage.material_type,
             vs_kg_per_day=stage.material_amount_kg,
             reactor_volume_m3=None,
@@ -277,63 +221,19 @@ class CurrentProductionAPIView(APIView):
 
         start_time = stage.created_at
         end_time = datetime.now()
-        readings = SensorReading.objects.filter(stage=stage, timestamp__gte=start_time, timestamp__lte=end_time).order_by('timestamp')
-
-        daily_map = {}
-        last_total_gas = None
-        last_ts = None
-
-        for r in readings:
-            ts = r.timestamp
-            payload = r.raw_payload or {}
-            delta = 0.0
-
-            if isinstance(payload, dict) and 'gas_total_m3' in payload:
-                try:
-                    total = float(payload.get('gas_total_m3') or 0.0)
-                    if last_total_gas is not None:
-                        delta = max(0.0, total - last_total_gas)
-                    last_total_gas = total
-                except Exception:
-                    pass
-            elif isinstance(payload, dict) and ('caudal_gas' in payload or 'caudal_gas_lmin' in payload or 'gas_flow_lmin' in payload):
-                try:
-                    if 'caudal_gas' in payload:
-                        rate = float(payload.get('caudal_gas') or 0.0)  # m3/h
-                    else:
-                        lmin = float(payload.get('caudal_gas_lmin') or payload.get('gas_flow_lmin') or 0.0)
-                        rate = lmin * 0.06  # L/min -> m3/h
-                    if last_ts is not None:
-                        dt_hours = max(0.0, (ts - last_ts).total_seconds() / 3600.0)
-                        delta = max(0.0, rate * dt_hours)
-                except Exception:
-                    pass
-            elif r.gas_flow is not None:
-                try:
-                    delta = max(0.0, float(r.gas_flow))
-                except Exception:
-                    pass
-
-            last_ts = ts
-            day_key = ts.date().isoformat()
-            if delta > 0:
-                daily_map[day_key] = daily_map.get(day_key, 0.0) + delta
-
-        days_actual = []
-        daily_actual = []
-        cumulative_actual = []
-        cum = 0.0
-        day_cursor = start_time.date()
-        today = datetime.now().date()
-        while day_cursor <= today:
-            key = day_cursor.isoformat()
-            val = daily_map.get(key, 0.0)
-            days_since_start = (day_cursor - start_time.date()).days
-            days_actual.append(float(days_since_start))
-            daily_actual.append(val)
-            cum += val
-            cumulative_actual.append(cum)
-            day_cursor = day_cursor + timedelta(days=1)
+        actual = stage_production_series(stage, start_time, end_time)
+
+        extra = {}
+        # ?bands=1: bandas P10/P50/P90 (Monte Carlo, semilla fija) de la serie esperada
+        if request.query_params.get('bands') in ('1', 'true'):
+            extra["expected_bands"] = forecast_bands(
+                material_type=stage.material_type,
+                vs_kg_per_day=stage.material_amount_kg,
+                reactor_volume_m3=None,
+                temperature_c=stage.temperature_c,
+                samples=getattr(settings, 'DASHBOARD_FORECAST_SAMPLES', 2000),
+                horizon_days=len(series["days"]),
+            )
 
         return Response({
             "stage": {
@@ -345,126 +245,66 @@ class CurrentProductionAPIView(APIView):
                 "temperature_c": stage.temperature_c,
             },
             "expected": series,
-            "actual": {
-                "days": days_actual,
-                "daily_biogas_m3": daily_actual,
-                "cumulative_biogas_m3": cumulative_actual,
-            }
+            "actual": actual,
+            **extra,
         })
 class CurrentReportAPIView(APIView):
     permission_classes = [IsAuthenticated, PuedeVerDashboard]
     parser_classes = [FormParser, MultiPartParser]
 
+    # formato -> (función de report_render, extensión, content type)
+    FORMATS = {
+        'excel': ('render_comparison_excel', 'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+        'pdf': ('render_comparison_pdf', 'pdf', 'application/pdf'),
+    }
+
     def get(self, request, format=None):
         """
         Returns current vs expected production report as PDF or Excel.
         Query params: format=pdf|excel
+
+        El archivo se cachea en disco (``report_cache``) hasta que llegue una
+        lectura nueva o cambie el día; el hash sirve de ETag.
         """
-        stage = FillingStage.objects.filter(active=True).order_by('-created_at').first()
+        stage = get_active_stage()
         if stage is None:
             return Response({"detail": "No hay etapa activa"}, status=status.HTTP_404_NOT_FOUND)
 
-        # Get expected and actual series (reuse logic from CurrentProductionAPIView)
-        series = estimate_timeseries_for_material(
-            material_type=stage.material_type,
-            vs_kg_per_day=stage.material_amount_kg,
-            reactor_volume_m3=None,
-            temperature_c=stage.temperature_c,
-        )
-        start_time = stage.created_at
-        end_time = datetime.now()
-        readings = SensorReading.objects.filter(stage=stage, timestamp__gte=start_time, timestamp__lte=end_time).order_by('timestamp')
-        daily_map = {}
-        last_total_gas = None
-        last_ts = None
-        for r in readings:
-            ts = r.timestamp
-            payload = r.raw_payload or {}
-            delta = 0.0
-            if isinstance(payload, dict) and 'gas_total_m3' in payload:
-                try:
-                    total = float(payload.get('gas_total_m3') or 0.0)
-                    if last_total_gas is not None:
-                        delta = max(0.0, total - last_total_gas)
-                    last_total_gas = total
-                except Exception:
-                    pass
-            elif isinstance(payload, dict) and ('caudal_gas' in payload or 'caudal_gas_lmin' in payload or 'gas_flow_lmin' in payload):
-                try:
-                    if 'caudal_gas' in payload:
-                        rate = float(payload.get('caudal_gas') or 0.0)
-                    else:
-                        lmin = float(payload.get('caudal_gas_lmin') or payload.get('gas_flow_lmin') or 0.0)
-                        rate = lmin * 0.06
-                    if last_ts is not None:
-                        dt_hours = max(0.0, (ts - last_ts).total_seconds() / 3600.0)
-                        delta = max(0.0, rate * dt_hours)
-                except Exception:
-                    pass
-            elif r.gas_flow is not None:
-                try:
-                    delta = max(0.0, float(r.gas_flow))
-                except Exception:
-                    pass
-            last_ts = ts
-            day_key = ts.date().isoformat()
-            if delta > 0:
-                daily_map[day_key] = daily_map.get(day_key, 0.0) + delta
-        days_actual = []
-        daily_actual = []
-        cumulative_actual = []
-        cum = 0.0
-        day_cursor = start_time.date()
-        today = datetime.now().date()
-        while day_cursor <= today:
-            key = day_cursor.isoformat()
-            val = daily_map.get(key, 0.0)
-            days_since_start = (day_cursor - start_time.date()).days
-            days_actual.append(float(days_since_start))
-            daily_actual.append(val)
-            cum += val
-            cumulative_actual.append(cum)
-            day_cursor = day_cursor + timedelta(days=1)
-
-        # Prepare DataFrame for report
-        df = pd.DataFrame({
-            'Día': days_actual,
-            'Fecha': pd.date_range(start=start_time.date(), periods=len(days_actual)),
-            'Producción Esperada (m3)': series.get('daily_biogas_m3', [0]*len(days_actual)),
-            'Producción Real (m3)': daily_actual,
-            'Acumulado Real (m3)': cumulative_actual,
-        })
-
         report_format = request.query_params.get('format', 'pdf').lower()
-        if report_format == 'excel':
-            output = io.BytesIO()
-            # Usar engine por defecto de pandas (openpyxl normalmente)
-            with pd.ExcelWriter(output) as writer:
-                df.to_excel(writer, index=False, sheet_name='Reporte')
-            output.seek(0)
-            response = HttpResponse(output.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-            response['Content-Disposition'] = 'attachment; filename="reporte_actual_vs_esperado.xlsx"'
-            return response
-        elif report_format == 'pdf' and canvas:
-            output = io.BytesIO()
-            c = canvas.Canvas(output)
-            c.setFont("Helvetica", 14)
-            c.drawString(50, 800, f"Reporte de Producción Actual vs Esperada - Llenado #{stage.number}")
-            c.setFont("Helvetica", 10)
-            y = 780
-            for i, row in df.iterrows():
-                c.drawString(50, y, f"Día {int(row['Día'])} | Fecha: {row['Fecha'].date()} | Esperada: {row['Producción Esperada (m3)']:.2f} | Real: {row['Producción Real (m3)']:.2f} | Acumulado: {row['Acumulado Real (m3)']:.2f}")
-                y -= 16
-                if y < 50:
-                    c.showPage()
-                    y = 800
-            c.save()
-            output.seek(0)
-            response = HttpResponse(output.read(), content_type='application/pdf')
-            response['Content-Disposition'] = 'attachment; filename="reporte_actual_vs_esperado.pdf"'
-            return response
-        else:
+        if report_format not in self.FORMATS or (report_format == 'pdf' and not canvas):
             return Response({"detail": "Formato de reporte no soportado o PDF no disponible."}, status=status.HTTP_400_BAD_REQUEST)
+        renderer, ext, content_type = self.FORMATS[report_format]
+
+        last_reading = SensorReading.objects.filter(stage=stage).order_by('-id').values_list('id', 'timestamp').first()
+        key = report_cache.cache_key(
+            report='current',
+            stage=[stage.id, stage.material_type, stage.material_amount_kg, stage.temperature_c, stage.created_at],
+            last_reading=last_reading,
+            params=params_version(),
+            day=datetime.now().date(),
+            format=report_format,
+        )
+        etag = f'"{key}"'
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+
+        def render():
+            ctx = report_jobs.build_context(stage, 'normal')
+            return getattr(report_render, renderer)(ctx)
+
+        path = report_cache.get_or_render(key, ext, render)
+        response = FileResponse(
+            open(path, 'rb'),
+            content_type=content_type,
+            as_attachment=True,
+            filename=f"reporte_actual_vs_esperado.{ext}",
+        )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
 
 from django.contrib.auth import get_user_model
@@ -474,287 +314,44 @@ class CreateReportAPIView(APIView):
     permission_classes = [AllowAny]
 
     def post(self, request):
+        """Encola la generación del reporte y responde 202 con el trabajo.
+        El estado se consulta en ``status_url`` o llega por el WebSocket."""
         data = request.data
         stage_id = data.get('stage_id')
         report_type = data.get('report_type', 'normal')
         try:
-            # 1) Resolver etapa
+            # Resolver etapa
             if stage_id:
                 stage = FillingStage.objects.get(id=stage_id)
             else:
-                stage = FillingStage.objects.filter(active=True).order_by('-created_at').first()
+                stage = get_active_stage()
                 if not stage:
                     return Response({"detail": "No hay etapa activa para asociar el reporte."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # 2) Calcular series esperada y real (reutilizando lógica de CurrentProductionAPIView)
-            series = estimate_timeseries_for_material(
-                material_type=stage.material_type,
-                vs_kg_per_day=stage.material_amount_kg,
-                reactor_volume_m3=None,
-                temperature_c=stage.temperature_c,
-            )
-
-            start_time = stage.created_at
-            end_time = datetime.now()
-            readings = SensorReading.objects.filter(stage=stage, timestamp__gte=start_time, timestamp__lte=end_time).order_by('timestamp')
-
-            daily_map = {}
-            last_total_gas = None
-            last_ts = None
-            for r in readings:
-                ts = r.timestamp
-                payload = r.raw_payload or {}
-                delta = 0.0
-                if isinstance(payload, dict) and 'gas_total_m3' in payload:
-                    try:
-                        total = float(payload.get('gas_total_m3') or 0.0)
-                        if last_total_gas is not None:
-                            delta = max(0.0, total - last_total_gas)
-                        last_total_gas = total
-                    except Exception:
-                        pass
-                elif isinstance(payload, dict) and ('caudal_gas' in payload or 'caudal_gas_lmin' in payload or 'gas_flow_lmin' in payload):
-                    try:
-                        if 'caudal_gas' in payload:
-                            rate = float(payload.get('caudal_gas') or 0.0)
-                        else:
-                            lmin = float(payload.get('caudal_gas_lmin') or payload.get('gas_flow_lmin') or 0.0)
-                            rate = lmin * 0.06
-                        if last_ts is not None:
-                            dt_hours = max(0.0, (ts - last_ts).total_seconds() / 3600.0)
-                            delta = max(0.0, rate * dt_hours)
-                    except Exception:
-                        pass
-                elif r.gas_flow is not None:
-                    try:
-                        delta = max(0.0, float(r.gas_flow))
-                    except Exception:
-                        pass
-
-                last_ts = ts
-                if delta > 0:
-                    key = ts.date().isoformat()
-                    daily_map[key] = daily_map.get(key, 0.0) + delta
-
-            # Proyección a vectores
-            days_actual = []
-            daily_actual = []
-            cumulative_actual = []
-            cum = 0.0
-            day_cursor = start_time.date()
-            today = datetime.now().date()
-            while day_cursor <= today:
-                key = day_cursor.isoformat()
-                val = daily_map.get(key, 0.0)
-                days_since_start = (day_cursor - start_time.date()).days
-                days_actual.append(float(days_since_start))
-                daily_actual.append(val)
-                cum += val
-                cumulative_actual.append(cum)
-                day_cursor = day_cursor + timedelta(days=1)
-
-            # 3) Producciones estimada y real
-            import pandas as pd
-            expected_daily = series.get('daily_biogas_m3', [0.0] * len(days_actual))
-            # Igualar longitudes por seguridad
-            if len(expected_daily) < len(days_actual):
-                expected_daily = expected_daily + [0.0] * (len(days_actual) - len(expected_daily))
-            elif len(expected_daily) > len(days_actual):
-                expected_daily = expected_daily[:len(days_actual)]
-
-            production_estimated = float(pd.Series(expected_daily).sum()) if len(expected_daily) else 0.0
-            production_real = float(pd.Series(daily_actual).sum()) if len(daily_actual) else 0.0
-
-            # 4) Inferencias en base a datos (simple comparativa %)
-            diff = production_real - production_estimated
-            perc = (diff / production_estimated * 100.0) if production_estimated > 0 else 0.0
-            trend = "por encima" if diff > 0 else ("por debajo" if diff < 0 else "igual a")
-            inferences_text = data.get('inferences') or (
-                f"La producción real ({production_real:.2f} m3) está {trend} de la estimada ({production_estimated:.2f} m3) en {abs(perc):.1f}%."
-            )
-
-            observations_text = data.get('observations', '')
-
-            # 5) Crear el objeto Report
-            report = Report.objects.create(
-                user=request.user if request.user.is_authenticated else None,
+            job = report_jobs.enqueue(
+                'create',
                 stage=stage,
+                user=request.user,
                 report_type=report_type,
-                observations=observations_text,
-                inferences=inferences_text,
-                production_estimated=production_estimated,
-                production_real=production_real,
+                observations=data.get('observations', ''),
+                inferences=data.get('inferences') or None,
             )
-
-            # 6) Construir DataFrame formal con series para Excel
-            df = pd.DataFrame({
-                'Día': days_actual,
-                'Fecha': pd.date_range(start=start_time.date(), periods=len(days_actual)) if days_actual else pd.Series([], dtype='datetime64[ns]'),
-                'Producción Esperada (m3/día)': expected_daily,
-                'Producción Real (m3/día)': daily_actual,
-                'Acumulado Real (m3)': cumulative_actual,
-            })
-            df['Acumulado Esperado (m3)'] = pd.Series(expected_daily).cumsum() if len(expected_daily) else 0.0
-
-            # 7) Generar Excel con portada y hoja de datos
-            excel_buffer = io.BytesIO()
-            # Usar engine por defecto de pandas; reduce dependencias
-            with pd.ExcelWriter(excel_buffer) as writer:
-                # Hoja Portada
-                cover = pd.DataFrame({
-                    'Campo': ['Sistema', 'Tipo de reporte', 'Etapa', 'Material', 'Cantidad (kg)', 'Temperatura (°C)', 'Producción estimada (m3)', 'Producción real (m3)', 'Inferencias', 'Comentarios'],
-                    'Valor': [
-                        'Sistema Biogestor ULSA',
-                        'Reporte regular' if report_type == 'normal' else 'Reporte final de producción',
-                        f"#{stage.number}",
-                        stage.material_type,
-                        stage.material_amount_kg,
-                        stage.temperature_c,
-                        round(production_estimated, 2),
-                        round(production_real, 2),
-                        inferences_text,
-                        observations_text,
-                    ]
-                })
-                cover.to_excel(writer, index=False, sheet_name='Resumen')
-
-                # Hoja Datos
-                df.to_excel(writer, index=False, sheet_name='Datos')
-
-            excel_buffer.seek(0)
-            report.file_excel.save(f"reporte_{report.id}.xlsx", ContentFile(excel_buffer.read()))
-
-            # 8) CSV de datos crudos
-            csv_buffer = io.StringIO()
-            df.to_csv(csv_buffer, index=False)
-            report.file_csv.save(f"reporte_{report.id}.csv", ContentFile(csv_buffer.getvalue().encode('utf-8')))
-
-            # 9) PDF con mejor estética
-            if canvas:
-                report_type_label = 'Reporte regular' if report_type == 'normal' else 'Reporte final de producción'
-                pdf_bytes = build_pretty_report_pdf(
-                    stage=stage,
-                    report_type_label=report_type_label,
-                    production_estimated=production_estimated,
-                    production_real=production_real,
-                    inferences_text=inferences_text,
-                    observations_text=observations_text,
-                )
-                if pdf_bytes:
-                    report.file_pdf.save(f"reporte_{report.id}.pdf", ContentFile(pdf_bytes))
-
-            # 10) Si es final, cerrar etapa sólo si se solicitó
-            if report_type == 'final':
-                stage.active = False
-                stage.save()
-
-            report.save()
-
-            pdf_url = f"/api/dashboard/report/download/{report.id}/pdf/" if report.file_pdf else None
-            excel_url = f"/api/dashboard/report/download/{report.id}/excel/" if report.file_excel else None
-            csv_url = f"/api/dashboard/report/download/{report.id}/csv/" if report.file_csv else None
-
             return Response({
-                "id": report.id,
-                "stage_active": stage.active,
-                "pdf_url": pdf_url,
-                "excel_url": excel_url,
-                "csv_url": csv_url,
-                "detail": "Reporte generado correctamente."
-            }, status=status.HTTP_201_CREATED)
+                **report_jobs.job_payload(job),
+                "detail": "Reporte en cola de generación.",
+            }, status=status.HTTP_202_ACCEPTED)
         except Exception as e:
             return Response({"detail": f"Error creando reporte: {e}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # If execution continues (shouldn't normally), provide production timeseries as fallback
-        series = estimate_timeseries_for_material(
-            material_type=stage.material_type,
-            vs_kg_per_day=stage.material_amount_kg,
-            reactor_volume_m3=None,
-            temperature_c=stage.temperature_c,
-        )
 
-        start_time = stage.created_at
-        end_time = datetime.now()
-        readings = SensorReading.objects.filter(stage=stage, timestamp__gte=start_time, timestamp__lte=end_time).order_by('timestamp')
-
-        daily_map = {}
-        last_total_gas = None
-        last_ts = None
-
-        for r in readings:
-            ts = r.timestamp
-            payload = r.raw_payload or {}
-            delta = 0.0
-
-            # Preferencia 1: acumulado total reportado por sensor
-            if isinstance(payload, dict) and 'gas_total_m3' in payload:
-                try:
-                    total = float(payload.get('gas_total_m3') or 0.0)
-                    if last_total_gas is not None:
-                        delta = max(0.0, total - last_total_gas)
-                    last_total_gas = total
-                except Exception:
-                    pass
-            # Preferencia 2: caudal (m3/h) a integrar por dt
-            elif isinstance(payload, dict) and ('caudal_gas' in payload or 'caudal_gas_lmin' in payload or 'gas_flow_lmin' in payload):
-                try:
-                    if 'caudal_gas' in payload:
-                        rate = float(payload.get('caudal_gas') or 0.0)  # m3/h
-                    else:
-                        # Convertir L/min a m3/h: (L/min) * (1 m3/1000 L) * 60 min/h = L/min * 0.06
-                        lmin = float(payload.get('caudal_gas_lmin') or payload.get('gas_flow_lmin') or 0.0)
-                        rate = lmin * 0.06
-                    if last_ts is not None:
-                        dt_hours = max(0.0, (ts - last_ts).total_seconds() / 3600.0)
-                        delta = max(0.0, rate * dt_hours)
-                except Exception:
-                    pass
-            # Preferencia 3: tratar gas_flow del modelo como incremento directo
-            elif r.gas_flow is not None:
-                try:
-                    delta = max(0.0, float(r.gas_flow))
-                except Exception:
-                    pass
-
-            last_ts = ts
-
-            day_key = ts.date().isoformat()
-            if delta > 0:
-                daily_map[day_key] = daily_map.get(day_key, 0.0) + delta
-
-        # Proyectar a vector desde inicio
-        days_actual = []
-        daily_actual = []
-        cumulative_actual = []
-        cum = 0.0
-        day_cursor = start_time.date()
-        today = datetime.now().date()
-        while day_cursor <= today:
-            key = day_cursor.isoformat()
-            val = daily_map.get(key, 0.0)
-            days_since_start = (day_cursor - start_time.date()).days
-            days_actual.append(float(days_since_start))
-            daily_actual.append(val)
-            cum += val
-            cumulative_actual.append(cum)
-            day_cursor = day_cursor + timedelta(days=1)
+class ReportJobStatusAPIView(APIView):
+    """Estado de un trabajo de generación de reporte."""
+    permission_classes = [AllowAny]
+
+    def get(self, request, job_id: int):
+        job = get_object_or_404(ReportJob.objects.select_related('report', 'stage'), id=job_id)
+        return Response(report_jobs.job_payload(job))
 
-        return Response({
-            "stage": {
-                "id": stage.id,
-                "number": stage.number,
-                "date": stage.date.isoformat(),
-                "material_type": stage.material_type,
-                "material_amount_kg": stage.material_amount_kg,
-                "temperature_c": stage.temperature_c,
-            },
-            "expected": series,
-            "actual": {
-                "days": days_actual,
-                "daily_biogas_m3": daily_actual,
-                "cumulative_biogas_m3": cumulative_actual,
-            }
-        })
 
 def dashboard_view(request):
     return render(request, 'dashboard/dashboard.html')
@@ -766,162 +363,14 @@ class RegenerateReportAPIView(APIView):
     def post(self, request, report_id: int):
         try:
             report = get_object_or_404(Report, id=report_id)
-            stage = report.stage
-            report_type = report.report_type
-
-            # Recalcular series como en CreateReportAPIView
-            series = estimate_timeseries_for_material(
-                material_type=stage.material_type,
-                vs_kg_per_day=stage.material_amount_kg,
-                reactor_volume_m3=None,
-                temperature_c=stage.temperature_c,
-            )
-            start_time = stage.created_at
-            end_time = datetime.now()
-            readings = SensorReading.objects.filter(stage=stage, timestamp__gte=start_time, timestamp__lte=end_time).order_by('timestamp')
-
-            daily_map = {}
-            last_total_gas = None
-            last_ts = None
-            for r in readings:
-                ts = r.timestamp
-                payload = r.raw_payload or {}
-                delta = 0.0
-                if isinstance(payload, dict) and 'gas_total_m3' in payload:
-                    try:
-                        total = float(payload.get('gas_total_m3') or 0.0)
-                        if last_total_gas is not None:
-                            delta = max(0.0, total - last_total_gas)
-                        last_total_gas = total
-                    except Exception:
-                        pass
-                elif isinstance(payload, dict) and ('caudal_gas' in payload or 'caudal_gas_lmin' in payload or 'gas_flow_lmin' in payload):
-                    try:
-                        if 'caudal_gas' in payload:
-                            rate = float(payload.get('caudal_gas') or 0.0)
-                        else:
-                            lmin = float(payload.get('caudal_gas_lmin') or payload.get('gas_flow_lmin') or 0.0)
-                            rate = lmin * 0.06
-                        if last_ts is not None:
-                            dt_hours = max(0.0, (ts - last_ts).total_seconds() / 3600.0)
-                            delta = max(0.0, rate * dt_hours)
-                    except Exception:
-                        pass
-                elif r.gas_flow is not None:
-                    try:
-                        delta = max(0.0, float(r.gas_flow))
-                    except Exception:
-                        pass
-
-                last_ts = ts
-                if delta > 0:
-                    key = ts.date().isoformat()
-                    daily_map[key] = daily_map.get(key, 0.0) + delta
-
-            days_actual = []
-            daily_actual = []
-            cumulative_actual = []
-            cum = 0.0
-            day_cursor = start_time.date()
-            today = datetime.now().date()
-            while day_cursor <= today:
-                key = day_cursor.isoformat()
-                val = daily_map.get(key, 0.0)
-                days_since_start = (day_cursor - start_time.date()).days
-                days_actual.append(float(days_since_start))
-                daily_actual.append(val)
-                cum += val
-                cumulative_actual.append(cum)
-                day_cursor = day_cursor + timedelta(days=1)
-
-            import pandas as pd
-            expected_daily = series.get('daily_biogas_m3', [0.0] * len(days_actual))
-            if len(expected_daily) < len(days_actual):
-                expected_daily = expected_daily + [0.0] * (len(days_actual) - len(expected_daily))
-            elif len(expected_daily) > len(days_actual):
-                expected_daily = expected_daily[:len(days_actual)]
-
-            production_estimated = float(pd.Series(expected_daily).sum()) if len(expected_daily) else 0.0
-            production_real = float(pd.Series(daily_actual).sum()) if len(daily_actual) else 0.0
-
-            # Si no hay inferencias u observaciones, genera de nuevo
-            diff = production_real - production_estimated
-            perc = (diff / production_estimated * 100.0) if production_estimated > 0 else 0.0
-            trend = "por encima" if diff > 0 else ("por debajo" if diff < 0 else "igual a")
-            inferences_text = report.inferences or (
-                f"La producción real ({production_real:.2f} m3) está {trend} de la estimada ({production_estimated:.2f} m3) en {abs(perc):.1f}%."
-            )
-            observations_text = report.observations or ''
-
-            # Actualizar campos principales
-            report.production_estimated = production_estimated
-            report.production_real = production_real
-            report.inferences = inferences_text
-            report.save()
-
-            # DataFrame de datos
-            df = pd.DataFrame({
-                'Día': days_actual,
-                'Fecha': pd.date_range(start=start_time.date(), periods=len(days_actual)) if days_actual else pd.Series([], dtype='datetime64[ns]'),
-                'Producción Esperada (m3/día)': expected_daily,
-                'Producción Real (m3/día)': daily_actual,
-                'Acumulado Real (m3)': cumulative_actual,
-            })
-            df['Acumulado Esperado (m3)'] = pd.Series(expected_daily).cumsum() if len(expected_daily) else 0.0
-
-            # Sobrescribir Excel
-            excel_buffer = io.BytesIO()
-            with pd.ExcelWriter(excel_buffer) as writer:
-                cover = pd.DataFrame({
-                    'Campo': ['Sistema', 'Tipo de reporte', 'Etapa', 'Material', 'Cantidad (kg)', 'Temperatura (°C)', 'Producción estimada (m3)', 'Producción real (m3)', 'Inferencias', 'Comentarios'],
-                    'Valor': [
-                        'Sistema Biogestor ULSA',
-                        'Reporte regular' if report_type == 'normal' else 'Reporte final de producción',
-                        f"#{stage.number}",
-                        stage.material_type,
-                        stage.material_amount_kg,
-                        stage.temperature_c,
-                        round(production_estimated, 2),
-                        round(production_real, 2),
-                        inferences_text,
-                        observations_text,
-                    ]
-                })
-                cover.to_excel(writer, index=False, sheet_name='Resumen')
-                df.to_excel(writer, index=False, sheet_name='Datos')
-            excel_buffer.seek(0)
-            report.file_excel.save(f"reporte_{report.id}.xlsx", ContentFile(excel_buffer.read()))
-
-            # Sobrescribir CSV
-            csv_buffer = io.StringIO()
-            df.to_csv(csv_buffer, index=False)
-            report.file_csv.save(f"reporte_{report.id}.csv", ContentFile(csv_buffer.getvalue().encode('utf-8')))
-
-            # Sobrescribir PDF con mejor estética
-            if canvas:
-                report_type_label = 'Reporte regular' if report_type == 'normal' else 'Reporte final de producción'
-                pdf_bytes = build_pretty_report_pdf(
-                    stage=stage,
-                    report_type_label=report_type_label,
-                    production_estimated=production_estimated,
-                    production_real=production_real,
-                    inferences_text=inferences_text,
-                    observations_text=observations_text,
-                )
-                if pdf_bytes:
-                    report.file_pdf.save(f"reporte_{report.id}.pdf", ContentFile(pdf_bytes))
-
-            pdf_url = f"/api/dashboard/report/download/{report.id}/pdf/" if report.file_pdf else None
-            excel_url = f"/api/dashboard/report/download/{report.id}/excel/" if report.file_excel else None
-            csv_url = f"/api/dashboard/report/download/{report.id}/csv/" if report.file_csv else None
-
+            job = report_jobs.enqueue('regenerate', report=report, user=request.user)
             return Response({
+                **report_jobs.job_payload(job),
                 "id": report.id,
-                "pdf_url": pdf_url,
-                "excel_url": excel_url,
-                "csv_url": csv_url,
-                "detail": "Reporte regenerado correctamente."
-            }, status=status.HTTP_200_OK)
+                "detail": "Regeneración del reporte en cola.",
+            }, status=status.HTTP_202_ACCEPTED)
+        except Http404:
+            raise
         except Exception as e:
             return Response({"detail": f"Error regenerando reporte: {e}"}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -932,6 +381,8 @@ class ReportByRangeAPIView(APIView):
     def post(self, request):
         """Genera un reporte para un rango de fechas [start_date, end_date].
         body: { start_date: 'YYYY-MM-DD', end_date: 'YYYY-MM-DD' }
+        Query params: format=excel|csv; con format=csv&granularity=raw|hour|day
+        (y opcionalmente gzip=1) las lecturas se exportan en streaming.
         """
         try:
             start_date = request.data.get('start_date')
@@ -941,41 +392,18 @@ class ReportByRangeAPIView(APIView):
             start_dt = datetime.fromisoformat(start_date)
             end_dt = datetime.fromisoformat(end_date) + timedelta(days=1) - timedelta(seconds=1)
 
-            readings = SensorReading.objects.filter(timestamp__gte=start_dt, timestamp__lte=end_dt).order_by('timestamp')
-            if not readings.exists():
-                return Response({"detail": "No hay lecturas en el rango"}, status=404)
+            granularity = request.query_params.get('granularity')
+            if request.query_params.get('format') == 'csv' and granularity:
+                return exports.streaming_csv_response(
+                    request, granularity, start_dt, end_dt,
+                    f"lecturas_{granularity}_{start_dt.date()}_{end_dt.date()}",
+                    compress=exports.wants_gzip(request),
+                )
 
-            # Agregar por día acumulado (usamos heurística de gas_total_m3/caudal como en otros endpoints)
-            daily_map = {}
-            last_total_gas = None
-            last_ts = None
-            for r in readings:
-                ts = r.timestamp
-                payload = r.raw_payload or {}
-                delta = 0.0
-                try:
-                    if isinstance(payload, dict) and 'gas_total_m3' in payload:
-                        total = float(payload.get('gas_total_m3') or 0.0)
-                        if last_total_gas is not None:
-                            delta = max(0.0, total - last_total_gas)
-                        last_total_gas = total
-                    elif isinstance(payload, dict) and ('caudal_gas' in payload or 'caudal_gas_lmin' in payload or 'gas_flow_lmin' in payload):
-                        if 'caudal_gas' in payload:
-                            rate = float(payload.get('caudal_gas') or 0.0)
-                        else:
-                            lmin = float(payload.get('caudal_gas_lmin') or payload.get('gas_flow_lmin') or 0.0)
-                            rate = lmin * 0.06
-                        if last_ts is not None:
-                            dt_hours = max(0.0, (ts - last_ts).total_seconds() / 3600.0)
-                            delta = max(0.0, rate * dt_hours)
-                    elif r.gas_flow is not None:
-                        delta = max(0.0, float(r.gas_flow))
-                except Exception:
-                    pass
-                last_ts = ts
-                if delta > 0:
-                    day_key = ts.date().isoformat()
-                    daily_map[day_key] = daily_map.get(day_key, 0.0) + delta
+            # Producción diaria desde los rollups (todas las etapas)
+            daily_map = daily_production(start_dt.date(), end_dt.date())
+            if not daily_map:
+                return Response({"detail": "No hay lecturas en el rango"}, status=404)
 
             # DataFrame
             df = pd.DataFrame({
@@ -1003,6 +431,43 @@ class ReportByRangeAPIView(APIView):
             return Response({"detail": f"Error generando reporte por rango: {e}"}, status=400)
 
 
+class IngestStatusAPIView(APIView):
+    """Métricas de la ingesta MQTT de este proceso (modo embebido)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        from .ingest import get_ingest_service
+        return Response(get_ingest_service().stats())
+
+
+class ReadingsParquetExportAPIView(APIView):
+    """Lecturas crudas en Parquet (columnas tipadas, zstd) para análisis.
+    Query params: stage=<id>, start=YYYY-MM-DD, end=YYYY-MM-DD (opcionales).
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if exports.pq is None:
+            return Response({"detail": "Exportación Parquet no disponible (falta pyarrow)."}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        try:
+            stage_id = request.query_params.get('stage')
+            stage = get_object_or_404(FillingStage, id=int(stage_id)) if stage_id else None
+            start = request.query_params.get('start')
+            end = request.query_params.get('end')
+            start_dt = datetime.fromisoformat(start) if start else None
+            end_dt = datetime.fromisoformat(end) + timedelta(days=1) - timedelta(microseconds=1) if end else None
+        except ValueError as e:
+            return Response({"detail": f"Parámetros inválidos: {e}"}, status=400)
+
+        # Archivo temporal en disco: el pie del Parquet se escribe al final
+        output = tempfile.TemporaryFile()
+        exports.write_parquet(output, start=start_dt, end=end_dt, stage=stage)
+        output.seek(0)
+        name = f"lecturas_etapa_{stage.id}" if stage else "lecturas"
+        return FileResponse(output, as_attachment=True, filename=f"{name}.parquet",
+                            content_type='application/vnd.apache.parquet')
+
+
 class ActuatorCommandAPIView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -1135,6 +600,10 @@ class PracticeStopAPIView(APIView):
         sess = PracticeSession.objects.filter(ended_at__isnull=True).order_by('-started_at').first()
         if not sess:
             return Response({"detail": "No hay práctica activa"}, status=404)
+        granularity = request.query_params.get('granularity')
+        stream = request.query_params.get('format') == 'csv' and granularity
+        if stream and granularity not in exports.GRANULARITIES:
+            return Response({"detail": f"Granularidad inválida: {granularity}"}, status=400)
         sess.ended_by = request.user if request.user.is_authenticated else None
         sess.ended_at = timezone.now()
         sess.save()
@@ -1142,37 +611,15 @@ class PracticeStopAPIView(APIView):
         # Construir reporte (excel/csv) para el intervalo de práctica
         start_dt = sess.started_at
         end_dt = sess.ended_at
-        readings = SensorReading.objects.filter(timestamp__gte=start_dt, timestamp__lte=end_dt).order_by('timestamp')
-        daily_map = {}
-        last_total_gas = None
-        last_ts = None
-        for r in readings:
-            ts = r.timestamp
-            payload = r.raw_payload or {}
-            delta = 0.0
-            try:
-                if isinstance(payload, dict) and 'gas_total_m3' in payload:
-                    total = float(payload.get('gas_total_m3') or 0.0)
-                    if last_total_gas is not None:
-                        delta = max(0.0, total - last_total_gas)
-                    last_total_gas = total
-                elif isinstance(payload, dict) and ('caudal_gas' in payload or 'caudal_gas_lmin' in payload or 'gas_flow_lmin' in payload):
-                    if 'caudal_gas' in payload:
-                        rate = float(payload.get('caudal_gas') or 0.0)
-                    else:
-                        lmin = float(payload.get('caudal_gas_lmin') or payload.get('gas_flow_lmin') or 0.0)
-                        rate = lmin * 0.06
-                    if last_ts is not None:
-                        dt_hours = max(0.0, (ts - last_ts).total_seconds() / 3600.0)
-                        delta = max(0.0, rate * dt_hours)
-                elif r.gas_flow is not None:
-                    delta = max(0.0, float(r.gas_flow))
-            except Exception:
-                pass
-            last_ts = ts
-            if delta > 0:
-                day_key = ts.date().isoformat()
-                daily_map[day_key] = daily_map.get(day_key, 0.0) + delta
+
+        if stream:
+            return exports.streaming_csv_response(
+                request, granularity, start_dt, end_dt,
+                f"reporte_practica_{sess.id}_{granularity}",
+                compress=exports.wants_gzip(request),
+            )
+        readings = SensorReading.objects.filter(timestamp__gte=start_dt, timestamp__lte=end_dt)
+        daily_map = daily_gas_production(readings)
 
         df = pd.DataFrame({
             'Fecha': list(daily_map.keys()),
@@ -41,12 +41,48 @@ export async function getCurrentProduction() {
   return response.data as CurrentProductionResponse;
 }
 
+export interface ReportJob {
+  job_id: number;
+  kind: 'create' | 'regenerate';
+  status: 'PENDING' | 'RUNNING' | 'DONE' | 'ERROR';
+  report_id: number | null;
+  stage_id: number | null;
+  stage_active?: boolean;
+  error: string | null;
+  status_url: string;
+  pdf_url: string | null;
+  excel_url: string | null;
+  csv_url: string | null;
+}
+
+export const getReportJob = async (jobId: number) => {
+  const res = await apiClient.get(`/api/dashboard/report/jobs/${jobId}/`);
+  return res.data as ReportJob;
+};
+
+// La generación es asíncrona (202): consultar el trabajo hasta que termine
+export const waitForReportJob = async (job: ReportJob, intervalMs = 1500, timeoutMs = 300000) => {
+  const deadline = Date.now() + timeoutMs;
+  let current = job;
+  while (current.status === 'PENDING' || current.status === 'RUNNING') {
+    if (Date.now() > deadline) {
+      throw new Error('La generación del reporte está tardando demasiado.');
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    current = await getReportJob(current.job_id);
+  }
+  if (current.status === 'ERROR') {
+    throw new Error(current.error || 'Error generando el reporte.');
+  }
+  return current;
+};
+
 export const createReport = async (reportType: 'normal' | 'final', observations: string) => {
   const res = await apiClient.post('/api/dashboard/report/create/', {
     report_type: reportType,
     observations,
   });
-  return res.data;
+  return waitForReportJob(res.data as ReportJob);
 };
 
 export const getReportHistory = async () => {